@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# Vectorised version of the latency cleaning in bg480_collect-raspi.py.  A
+# capture (binary, or raw_output.txt style lines) is loaded once into typed
+# arrays: one entry per packet for the time, kind, type name and length, and
+# for DATA packets a row in a uint8 matrix holding every payload of the same
+# length.  The trigger button test is then one comparison over a matrix
+# column instead of a string split per packet, and only the packets that can
+# change the cleaning state are walked in order.  The rules are the ones
+# events.LatencyCleaner follows, so the kept lines and latencies are the
+# same packet for packet.
+#
+# latency_test() in bg480_collect-raspi.py cleans its own captures as it reads
+# them with the stages in events.py, this is for cleaning saved runs in bulk,
+# reanalyze.py uses it when NumPy is installed.  NumPy is optional, HAVE_NUMPY
+# is False without it.  See bench_analysis.py for a comparison on results/.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    np = None
+    HAVE_NUMPY = False
+
+from capture import BG_EVENT_USB_DIGITAL_INPUT, NO_DEVICE, PID_NAMES, CaptureReader, record_to_text, ticks_to_ns
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+# Packet kinds, everything that is not a trigger edge or a DATA packet is KIND_OTHER
+KIND_TRIGGER_OFF = 0
+KIND_TRIGGER_ON = 1
+KIND_OTHER_INPUT = 2
+KIND_DATA = 3
+KIND_OTHER = 4
+
+KINDS = {'TRIGGER_OFF': KIND_TRIGGER_OFF, 'TRIGGER_ON': KIND_TRIGGER_ON, 'OTHER_INPUT': KIND_OTHER_INPUT}
+
+# Record headers as laid out by capture.py (RECORD_HEADER and RECORD_HEADER_V1)
+if HAVE_NUMPY:
+    RECORD_DTYPE = np.dtype([('time_sop', '<u8'), ('events', '<u4'), ('length', '<u2'), ('pid', 'u1'),
+                             ('address', 'u1'), ('endpoint', 'u1')])
+    RECORD_DTYPE_V1 = np.dtype([('time_sop', '<u8'), ('events', '<u4'), ('length', '<u2'), ('pid', 'u1')])
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+class CaptureArrays:
+    def __init__(self, times, kinds, names, name_list, lengths, rows, payloads, lines=None):
+        # Per packet: time, KIND_*, index into name_list, payload length (DATA
+        # only) and row in payloads[length] (-1 if there is none)
+        self.times = times
+        self.kinds = kinds
+        self.names = names
+        self.name_list = name_list
+        self.lengths = lengths
+        self.rows = rows
+        # Payload length -> 2-D uint8 array, one row per DATA packet
+        self.payloads = payloads
+        # Source lines when loaded from text, used to write out the cleaned lines unchanged
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.times)
+
+    # The clean_output.txt lines of the given packets, as CleanText writes them.
+    # Times from a binary capture are ticks, scale (ns per tick) converts them.
+    def clean_lines(self, indices, scale=None):
+        kinds = self.kinds[indices].tolist()
+        indices = indices.tolist()
+
+        if self.lines is not None:
+            clean = []
+
+            for i, kind in zip(indices, kinds):
+                fields = self.lines[i].split(',')
+
+                if kind == KIND_DATA:
+                    clean.append(f'{fields[0]},{fields[2]},{fields[3]}')
+                else:
+                    clean.append(f'{fields[0]},{fields[2]}')
+
+            return clean
+
+        times = self.times[indices].tolist()
+
+        if scale is not None:
+            times = [ticks_to_ns(time, scale) for time in times]
+        names = self.names[indices].tolist()
+        lengths = self.lengths[indices].tolist()
+        rows = self.rows[indices].tolist()
+        payloads = {}
+
+        # Payloads are turned into hex a whole length at a time, then cut up
+        for length in set(length for kind, length in zip(kinds, lengths) if kind == KIND_DATA):
+            selected = [row for kind, row_length, row in zip(kinds, lengths, rows)
+                        if kind == KIND_DATA and row_length == length]
+            text = self.payloads[length][selected].tobytes().hex(' ')
+            payloads[length] = iter([text[j:j + 3 * length - 1] for j in range(0, len(text), 3 * length)])
+
+        clean = []
+
+        for kind, time, name, length in zip(kinds, times, names, lengths):
+            if kind == KIND_DATA:
+                clean.append(f'{time},{self.name_list[name]},{next(payloads[length])} ')
+            else:
+                clean.append(f'{time},{self.name_list[name]}')
+
+        return clean
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+def packet_kind(name):
+    name = name.strip()
+
+    if name.startswith('DATA'):
+        return KIND_DATA
+    return KINDS.get(name, KIND_OTHER)
+
+
+# Packet type names as indices into a list of the distinct names, and the kind of every packet
+def index_names(names):
+    name_index = {}
+    names = np.array([name_index.setdefault(name, len(name_index)) for name in names], dtype=np.int16)
+    name_list = list(name_index)
+    name_kinds = np.array([packet_kind(name) for name in name_list], dtype=np.int8)
+
+    return names, name_list, name_kinds[names]
+
+
+# Load raw_output.txt style lines (time,length,type[,data]), as written by
+# the RawText stage in events.py.  All the DATA payloads of one length are
+# decoded from hex in one go.  Payloads that are not the usual "xx " per
+# byte are left without a row, so they never match.
+def load_lines(lines):
+    lines = [line.rstrip('\n') for line in lines]
+    fields = [line.split(',', 3) for line in lines]
+    times = np.array([int(field[0]) for field in fields], dtype=np.int64)
+    names, name_list, kinds = index_names([field[2] for field in fields])
+
+    # DATA lines without a payload field are read as other packets, same as line_events()
+    kinds[[i for i in np.flatnonzero(kinds == KIND_DATA).tolist() if len(fields[i]) < 4]] = KIND_OTHER
+    data_indices = np.flatnonzero(kinds == KIND_DATA)
+    data = [fields[i][3] if len(fields[i]) > 3 else '' for i in data_indices.tolist()]
+    data_lengths = np.array([payload.count(' ') for payload in data], dtype=np.int32)
+    well_formed = np.array([len(payload) for payload in data], dtype=np.int32) == 3 * data_lengths
+
+    lengths = np.zeros(len(lines), dtype=np.int32)
+    lengths[data_indices] = data_lengths
+    rows = np.full(len(lines), -1, dtype=np.int64)
+    payloads = {}
+
+    for length in np.unique(data_lengths[well_formed]).tolist():
+        members = np.flatnonzero(well_formed & (data_lengths == length))
+        group = [data[i] for i in members.tolist()]
+
+        try:
+            matrix = np.frombuffer(bytes.fromhex(''.join(group)), dtype=np.uint8)
+        except ValueError:
+            # Something in the group is not hex, decode it line by line to find out what
+            valid = []
+
+            for i, payload in zip(members.tolist(), group):
+                try:
+                    valid.append((i, bytes.fromhex(payload)))
+                except ValueError:
+                    pass
+
+            members = np.array([i for i, payload in valid], dtype=np.int64)
+            matrix = np.frombuffer(b''.join(payload for i, payload in valid), dtype=np.uint8)
+
+        payloads[length] = matrix.reshape(len(members), length)
+        rows[data_indices[members]] = np.arange(len(members))
+
+    return CaptureArrays(times, kinds, names, name_list, lengths, rows, payloads, lines)
+
+
+# Load a binary capture straight from the mapped file, the same packets (and
+# tick times) capture_events() gives once DeviceFilter(address, endpoint) and
+# ButtonEdges(input_pin) have passed them on.  Only finding where each record starts is done one record at a
+# time, the headers and payloads are then gathered into arrays in one go.
+def load_capture(path, address=None, endpoint=None, input_pin=None):
+    with CaptureReader(path) as reader:
+        offsets = np.array(reader.record_offsets(), dtype=np.int64)
+        record_dtype = RECORD_DTYPE if reader.version >= 2 else RECORD_DTYPE_V1
+        named = input_pin is not None or not reader.metadata.get('extra_buttons')
+        buffer = np.frombuffer(reader.buffer, dtype=np.uint8)
+
+        # Everything taken from the file is a copy, the buffer has to be gone before the reader closes it
+        try:
+            headers = buffer[offsets[:, None] + np.arange(record_dtype.itemsize)].view(record_dtype)[:, 0]
+            arrays = records_to_arrays(headers, buffer, offsets + record_dtype.itemsize, address, endpoint,
+                                       input_pin, named)
+        finally:
+            del buffer
+
+    return arrays
+
+
+# CaptureArrays from the record headers, see load_capture()
+def records_to_arrays(headers, buffer, data_offsets, address, endpoint, input_pin, named):
+    times = headers['time_sop'].astype(np.int64)
+    events = headers['events'].astype(np.int64)
+    inputs = events & BG_EVENT_USB_DIGITAL_INPUT != 0
+    labels = np.zeros(len(headers), dtype=np.int64)
+    label_index = {}
+
+    # Version 1 records have no device address or endpoint
+    if 'address' in headers.dtype.names:
+        record_address = headers['address']
+        record_endpoint = headers['endpoint']
+    else:
+        record_address = record_endpoint = np.full(len(headers), NO_DEVICE)
+
+    # Digital input events, as TRIGGER_ON/OFF for input_pin or OTHER_INPUT when only another input changed
+    input_indices = np.flatnonzero(inputs)
+    input_events = events[input_indices]
+
+    if input_pin is not None:
+        changed = input_events ^ np.concatenate((input_events[:1], input_events[:-1]))
+        other = (changed != 0) & ((changed >> (input_pin - 1)) & 1 == 0)
+        input_events = np.where(other, -1, BG_EVENT_USB_DIGITAL_INPUT | (input_events >> (input_pin - 1)) & 1)
+
+    for value in np.unique(input_events).tolist():
+        name = 'OTHER_INPUT' if value == -1 else record_to_text(0, value, 0, b'', named).split(',')[2]
+        labels[input_indices[input_events == value]] = label_index.setdefault(name, len(label_index))
+
+    # DATA packets from the wanted device and endpoint
+    packets = ~inputs
+
+    if address is not None:
+        packets &= record_address == address
+    if endpoint is not None:
+        packets &= record_endpoint == endpoint
+
+    for pid in np.unique(headers['pid'][packets]).tolist():
+        name = PID_NAMES.get(pid, 'INVALID')
+        labels[packets & (headers['pid'] == pid)] = label_index.setdefault(name, len(label_index))
+
+    kept = np.flatnonzero(inputs | packets)
+    name_list = list(label_index)
+    name_kinds = np.array([packet_kind(name) for name in name_list], dtype=np.int8)
+    names = labels[kept].astype(np.int16)
+    kinds = name_kinds[names]
+    lengths = np.where(kinds == KIND_DATA, headers['length'][kept], 0).astype(np.int32)
+    rows = np.full(len(kept), -1, dtype=np.int64)
+    payloads = {}
+
+    for length in np.unique(lengths[kinds == KIND_DATA]).tolist():
+        members = np.flatnonzero((kinds == KIND_DATA) & (lengths == length))
+        payloads[length] = buffer[data_offsets[kept[members]][:, None] + np.arange(length)]
+        rows[members] = np.arange(len(members))
+
+    return CaptureArrays(times[kept], kinds, names, name_list, lengths, rows, payloads)
+
+
+# Which packets pass the trigger button test, as two boolean arrays (released,
+# pressed), for a TriggerMask.  Only DATA packets of the button's packet
+# length can match.
+def button_matches(arrays, trigger_mask, length):
+    released = np.zeros(len(arrays), dtype=bool)
+    pressed = np.zeros(len(arrays), dtype=bool)
+    matrix = arrays.payloads.get(length)
+
+    if matrix is None or trigger_mask.offset >= length:
+        return released, pressed
+
+    packets = (arrays.kinds == KIND_DATA) & (arrays.lengths == length) & (arrays.rows >= 0)
+    indices = np.flatnonzero(packets)
+    bits = matrix[arrays.rows[indices], trigger_mask.offset] & trigger_mask.mask
+    released[indices] = bits == trigger_mask.off
+    pressed[indices] = bits == trigger_mask.on
+
+    return released, pressed
+
+
+# Same cleaning as events.LatencyCleaner, returns (kept packet indices,
+# latencies).  The kept packets are every trigger edge and the DATA packet
+# that answered it, then the last edge if it was never answered.  DATA
+# packets that fail the button test can never change the cleaning state, so
+# they are dropped up front and only the rest is walked in order.
+def clean_arrays(arrays, trigger_mask, length):
+    released, pressed = button_matches(arrays, trigger_mask, length)
+    relevant = np.flatnonzero((arrays.kinds != KIND_DATA) | released | pressed)
+
+    # The packet waiting for an answer is never dropped by OTHER_INPUT if it has DATA in it
+    data_names = np.array(['DATA' in name for name in arrays.name_list], dtype=bool)
+    has_data = data_names[arrays.names]
+
+    kinds = arrays.kinds.tolist()
+    released = released.tolist()
+    pressed = pressed.tolist()
+    has_data = has_data.tolist()
+
+    triggers = []
+    reports = []
+    # Last packet kept, only a trigger edge can still be answered
+    last = None
+    kept = 0
+    data_off_test = False
+    data_on_test = False
+    first_run = True
+
+    for i in relevant.tolist():
+        kind = kinds[i]
+
+        if kind == KIND_OTHER_INPUT:
+            if last is not None and not has_data[last]:
+                if kinds[last] == KIND_TRIGGER_OFF:
+                    data_on_test = True
+                else:
+                    data_off_test = True
+
+                last = None
+                kept -= 1
+                first_run = kept == 0
+
+        elif kind == KIND_TRIGGER_OFF and (data_on_test or first_run):
+            data_off_test = False
+            data_on_test = False
+            first_run = False
+            last = i
+            kept += 1
+
+        elif kind == KIND_TRIGGER_ON and data_off_test:
+            data_off_test = False
+            data_on_test = False
+            last = i
+            kept += 1
+
+        elif kind == KIND_DATA:
+            if first_run or last is None:
+                continue
+
+            if released[i] and kinds[last] == KIND_TRIGGER_OFF:
+                data_off_test = True
+                data_on_test = False
+            elif pressed[i] and kinds[last] == KIND_TRIGGER_ON:
+                data_off_test = False
+                data_on_test = True
+            else:
+                continue
+
+            # A response is final, nothing after it can take it back
+            triggers.append(last)
+            reports.append(i)
+            last = i
+            kept += 1
+
+        elif not first_run:
+            last = i
+
+    triggers = np.array(triggers, dtype=np.int64)
+    reports = np.array(reports, dtype=np.int64)
+    indices = np.stack((triggers, reports), axis=1).ravel()
+
+    if last is not None and kinds[last] in (KIND_TRIGGER_OFF, KIND_TRIGGER_ON):
+        indices = np.append(indices, last)
+
+    return indices, arrays.times[reports] - arrays.times[triggers]
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# Checks that the NumPy analysis in analysis.py cleans every run in results/
+# the same way as the events.py stages (LatencyCleaner), and compares how
+# long each takes.  Runs without a raw_output.txt are cleaned again from
+# their clean_output.txt.
+#
+# Each run is compared twice: from its text lines (line_events() against
+# load_lines()), and from a binary capture written from them
+# (capture_events() against load_capture()).
+#
+# The oldest runs count the trigger position in bytes and give a whole byte
+# as the value (2 hex digits), so those are cleaned with byte positions.
+#
+# usage: python3 bench_analysis.py [repeats] [results directory]
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+
+from fractions import Fraction
+
+from analysis import HAVE_NUMPY, clean_arrays, load_capture, load_lines
+from capture import BG_EVENT_USB_DIGITAL_INPUT, CaptureWriter
+from events import ButtonEdges, CleanText, DeviceFilter, LatencyCleaner, LatencyTimes, capture_events, line_events, \
+    run_pipeline
+from trigger_mask import nibble_mask
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+RESULTS_DIR = f'{os.path.dirname(os.path.abspath(__file__))}/results'
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# events.LatencyCleaner on events from lines or a capture, the way reanalyze.py
+# cleans without NumPy.  Times are left as they are (scale 1).
+def events_clean(events, position, value, length, byte_positions=False):
+    device = DeviceFilter()
+    cleaner = device.subscribe(ButtonEdges(1)).subscribe(
+        LatencyCleaner(nibble_mask(position, value, byte_positions), length))
+    out_file = io.StringIO()
+    cleaner.subscribe(CleanText(out_file, Fraction(1)))
+    times = cleaner.subscribe(LatencyTimes())
+    run_pipeline(events, device)
+
+    return out_file.getvalue().splitlines(), times.times
+
+
+def text_clean(packets, position, value, length, byte_positions=False):
+    return events_clean(line_events(packets), position, value, length, byte_positions)
+
+
+def array_clean(packets, position, value, length, byte_positions=False):
+    arrays = load_lines(packets)
+    kept, latencies = clean_arrays(arrays, nibble_mask(position, value, byte_positions), length)
+    return arrays.clean_lines(kept), latencies.tolist()
+
+
+def capture_text_clean(path, position, value, length, byte_positions=False):
+    return events_clean(capture_events(path), position, value, length, byte_positions)
+
+
+def capture_array_clean(path, position, value, length, byte_positions=False):
+    arrays = load_capture(path, input_pin=1)
+    kept, latencies = clean_arrays(arrays, nibble_mask(position, value, byte_positions), length)
+    return arrays.clean_lines(kept), latencies.tolist()
+
+
+# Binary capture of raw_output.txt lines, with the nanosecond times as ticks.
+# Lines that are neither a trigger edge nor a packet are left out.
+def write_capture(packets, path):
+    with CaptureWriter(path, 1000000, 0, {}) as writer:
+        for line in packets:
+            fields = line.split(',')
+            packet_type = fields[2].strip()
+
+            if packet_type == 'TRIGGER_ON':
+                writer.write(int(fields[0]), BG_EVENT_USB_DIGITAL_INPUT, b'', 0)
+            elif packet_type == 'TRIGGER_OFF':
+                writer.write(int(fields[0]), BG_EVENT_USB_DIGITAL_INPUT | 1, b'', 0)
+            elif len(fields) > 3:
+                data = bytes.fromhex(fields[3])
+                writer.write(int(fields[0]), 0, data, len(data))
+
+
+# Trigger details from a results file
+def trigger_details(results):
+    details = {}
+
+    with open(results) as in_file:
+        for line in in_file:
+            if line.startswith('Trigger Button '):
+                key, value = line[len('Trigger Button '):].split(':', 1)
+                details[key] = value.strip()
+
+    return details['Position'], details['Value'], int(details['Packet Length'])
+
+
+# Lines of a run in raw_output.txt form, clean_output.txt lines get the length field back
+def run_packets(run_dir):
+    if os.path.exists(f'{run_dir}/raw_output.txt'):
+        with open(f'{run_dir}/raw_output.txt') as in_file:
+            return [line.rstrip('\n') for line in in_file], 'raw_output.txt'
+
+    with open(f'{run_dir}/clean_output.txt') as in_file:
+        return [line.rstrip('\n').replace(',', ',0,', 1) for line in in_file], 'clean_output.txt'
+
+
+def best_time(function, repeats, *args):
+    best = None
+
+    for i in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    if not HAVE_NUMPY:
+        print('NumPy is not installed, nothing to compare.')
+        sys.exit(1)
+
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    results_dir = sys.argv[2] if len(sys.argv) > 2 else RESULTS_DIR
+    totals = {'text': [0, 0], 'capture': [0, 0]}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for results in sorted(glob.glob(f'{results_dir}/*/*/*/results-*.txt')):
+            run_dir = os.path.dirname(results)
+            run = os.path.relpath(run_dir, results_dir)
+            position, value, length = trigger_details(results)
+            byte_positions = len(value) == 2
+            packets, source = run_packets(run_dir)
+            capture_path = f'{temp_dir}/raw_output.bin'
+            write_capture(packets, capture_path)
+
+            print(f'{run} ({source}, {len(packets)} lines)')
+
+            for mode, source_data, before_function, after_function in (
+                    ('text', packets, text_clean, array_clean),
+                    ('capture', capture_path, capture_text_clean, capture_array_clean)):
+                # Every kept line and every latency has to match
+                before = before_function(source_data, position, value, length, byte_positions)
+                after = after_function(source_data, position, value, length, byte_positions)
+
+                if before != after:
+                    print(f'{run} differs from {mode}: {len(before[1])} != {len(after[1])} clean times')
+                    sys.exit(1)
+
+                before_time = best_time(before_function, repeats, source_data, position, value, length,
+                                        byte_positions)
+                after_time = best_time(after_function, repeats, source_data, position, value, length,
+                                       byte_positions)
+                totals[mode][0] += before_time
+                totals[mode][1] += after_time
+
+                print(f'\tfrom {mode}: {len(after[1])} clean times, identical results. '
+                      f'{round(before_time * 1000, 2)} ms -> {round(after_time * 1000, 2)} ms '
+                      f'({round(before_time / after_time, 2)}x)')
+
+    for mode, (before_time, after_time) in totals.items():
+        print(f'All runs from {mode}: {round(before_time * 1000, 2)} ms -> {round(after_time * 1000, 2)} ms '
+              f'({round(before_time / after_time, 2)}x)')
+
+if __name__ == "__main__":
+    main()
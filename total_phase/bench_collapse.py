@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# Checks that CollapseEngine gives the same results as the nested if/elif
+# state machine usb_dump() used before, and compares packets per second.
+#
+# usage: python3 bench_collapse.py [packets] [seed]
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import random
+import sys
+import time
+
+from collapse import *
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+PID_DATA0 = 0xc3
+PID_DATA1 = 0x4b
+PID_STALL = 0x1e
+
+# Made up traffic, roughly what the Beagle sees from a polled device on a
+# hub: each entry is a run of PIDs and how likely it is to be picked
+TRAFFIC = [
+    ((PID_SOF,), 30),
+    ((PID_IN, PID_NAK), 40),
+    ((PID_IN, PID_DATA0, PID_ACK), 4),
+    ((PID_IN, PID_DATA1, PID_ACK), 4),
+    ((PID_PING, PID_NAK), 3),
+    ((PID_SPLIT, PID_IN, PID_NYET), 3),
+    ((PID_SPLIT, PID_IN, PID_NAK), 3),
+    ((PID_SPLIT, PID_IN, PID_ACK), 2),
+    ((PID_SPLIT, PID_OUT, PID_NYET), 2),
+    ((PID_SPLIT, PID_SETUP, PID_NYET), 1),
+    ((KEEP_ALIVE,), 2),
+    ((0,), 2),                      # trigger events
+    ((PID_IN, PID_STALL), 1),
+    ((PID_SPLIT, PID_DATA0), 1),
+    ((PID_PING, PID_ACK), 1),
+]
+
+QUEUE_SIZE = 3
+IDLE_SAMPLES = 2000 * 480000
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+# Same queue handling as PacketQueue in bg480_collect-raspi.py, without the packet data
+class BenchQueue:
+    def __init__(self):
+        self._tail = 0
+        self._head = 0
+
+    def save_packet(self):
+        self._tail = (self._tail + 1) % QUEUE_SIZE
+
+    def clear(self, dequeue=False):
+        if not dequeue:
+            self._head = self._tail
+            return []
+
+        pkts = []
+        while self._head != self._tail:
+            pkts.append(self._head)
+            self._head = (self._head + 1) % QUEUE_SIZE
+        return pkts
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+def make_stream(packets, seed):
+    rng = random.Random(seed)
+    runs = [run for run, weight in TRAFFIC]
+    weights = [weight for run, weight in TRAFFIC]
+    stream = []
+    time_sop = 1
+
+    while len(stream) < packets:
+        for pid in rng.choices(runs, weights)[0]:
+            # Mostly microframe spacing, with the odd long idle gap
+            time_sop += rng.choice((60000, 60000, 60000, 120, 3 * IDLE_SAMPLES // 2))
+            stream.append((pid, time_sop))
+
+    return stream[:packets]
+
+
+# The collapsing part of usb_dump() before CollapseEngine.  Returns the
+# (state, counts, collapse time, output) seen after every packet.
+def legacy_collapse(stream, trace=True):
+    count = {SOF: 0, PING_NAK: 0, IN_ACK: 0, IN_NAK: 0, SPLIT_IN_ACK: 0, SPLIT_IN_NYET: 0, SPLIT_IN_NAK: 0,
+             SPLIT_OUT_NYET: 0, SPLIT_SETUP_NYET: 0, KEEP_ALIVE: 0}
+    collapse_time = [0]
+    pkt_q = BenchQueue()
+    state = IDLE
+    results = []
+
+    def summary():
+        collapse_time[0] = 0
+        for k in count:
+            count[k] = 0
+
+    def collapse(group, time_sop):
+        count[group] += 1
+        if collapse_time[0] == 0:
+            collapse_time[0] = time_sop
+        pkt_q.clear()
+
+    for pid, time_sop in stream:
+        output = False
+
+        if time_sop - collapse_time[0] >= IDLE_SAMPLES:
+            summary()
+
+        while True:
+            re_run = False
+
+            if state == IDLE:
+                if pid == KEEP_ALIVE:
+                    collapse(KEEP_ALIVE, time_sop)
+                elif pid == PID_SOF:
+                    collapse(SOF, time_sop)
+                elif pid == PID_IN:
+                    pkt_q.save_packet()
+                    state = IN
+                elif pid == PID_PING:
+                    pkt_q.save_packet()
+                    state = PING
+                elif pid == PID_SPLIT:
+                    pkt_q.save_packet()
+                    state = SPLIT
+                else:
+                    summary()
+                    output = True
+
+            elif state == IN:
+                state = IDLE
+                if pid == PID_ACK:
+                    collapse(IN_ACK, time_sop)
+                elif pid == PID_NAK:
+                    collapse(IN_NAK, time_sop)
+                else:
+                    re_run = True
+
+            elif state == PING:
+                state = IDLE
+                if pid == PID_NAK:
+                    collapse(PING_NAK, time_sop)
+                else:
+                    re_run = True
+
+            elif state == SPLIT:
+                if pid == PID_IN:
+                    pkt_q.save_packet()
+                    state = SPLIT_IN
+                elif pid == PID_OUT:
+                    pkt_q.save_packet()
+                    state = SPLIT_OUT
+                elif pid == PID_SETUP:
+                    pkt_q.save_packet()
+                    state = SPLIT_SETUP
+                else:
+                    state = IDLE
+                    re_run = True
+
+            elif state == SPLIT_IN:
+                state = IDLE
+                if pid == PID_NYET:
+                    collapse(SPLIT_IN_NYET, time_sop)
+                elif pid == PID_NAK:
+                    collapse(SPLIT_IN_NAK, time_sop)
+                elif pid == PID_ACK:
+                    collapse(SPLIT_IN_ACK, time_sop)
+                else:
+                    re_run = True
+
+            elif state == SPLIT_OUT:
+                state = IDLE
+                if pid == PID_NYET:
+                    collapse(SPLIT_OUT_NYET, time_sop)
+                else:
+                    re_run = True
+
+            elif state == SPLIT_SETUP:
+                state = IDLE
+                if pid == PID_NYET:
+                    collapse(SPLIT_SETUP_NYET, time_sop)
+                else:
+                    re_run = True
+
+            if not re_run:
+                break
+
+            summary()
+            pkt_q.clear(dequeue=True)
+
+        if trace:
+            results.append((state, tuple(count[group] for group in range(GROUPS)), collapse_time[0],
+                            pkt_q._head, pkt_q._tail, output))
+
+    return results
+
+
+def engine_collapse(stream, trace=True):
+    pkt_q = BenchQueue()
+    engine = CollapseEngine(pkt_q, IDLE_SAMPLES)
+    step = engine.step
+    results = []
+
+    for pid, time_sop in stream:
+        output = step(pid, time_sop)
+
+        if trace:
+            results.append((engine.state, tuple(engine.count), engine.time_sop, pkt_q._head, pkt_q._tail, output))
+
+    return results
+
+
+def packets_per_second(function, stream):
+    start = time.perf_counter()
+    function(stream, trace=False)
+    return len(stream) / (time.perf_counter() - start)
+
+
+def main():
+    packets = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    stream = make_stream(packets, seed)
+
+    # Every state, counter and queue position has to match after every packet
+    legacy = legacy_collapse(stream)
+    engine = engine_collapse(stream)
+
+    for i, (before, after) in enumerate(zip(legacy, engine)):
+        if before != after:
+            print(f'Packet {i} (pid {stream[i][0]:#04x}) differs: {before} != {after}')
+            sys.exit(1)
+
+    print(f'{packets} packets, {sum(result[-1] for result in engine)} output, identical results.')
+
+    before = packets_per_second(legacy_collapse, stream)
+    after = packets_per_second(engine_collapse, stream)
+
+    print(f'if/elif state machine: {round(before)} packets/s')
+    print(f'transition table:      {round(after)} packets/s ({round(after / before, 2)}x)')
+
+
+if __name__ == "__main__":
+    main()
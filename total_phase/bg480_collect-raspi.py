@@ -2,56 +2,210 @@
 #==========================================================================
 # IMPORTS
 #==========================================================================
+import json
 import multiprocessing
 import os
+import random
+import sqlite3
+import sys
 import time
 
+# Simulated analyzers for testing without a Beagle, see fake_beagle.py
+if os.environ.get('FAKE_BEAGLE') == '1':
+    import fake_beagle
+    sys.modules['beagle'] = fake_beagle
+
 from beagle_py import *
+from calibration import calibration_key, device_calibrations, load_calibrations, save_calibration
+from capture import CaptureReader, CaptureWriter, NO_DEVICE, is_input_event, ns_per_tick, save_json, ticks_to_ns
+from collapse import CollapseEngine, KEEP_ALIVE
+from events import ButtonEdges, Calibration, CleanText, DeviceFilter, LatencyCleaner, LatencySummary, LatencyTimes, \
+    RawText, ReportLengths, Responders, ResponseLog, capture_events, run_pipeline
+from latency_stats import SHOWN_QUANTILES, AdaptiveSpacing, LatencyStats, SequentialStop, write_latency_summary
+from ring_buffer import PacketRing, POLL_TIMEOUT
+from run_index import add_run
+from schedule import LEVEL_OFF, edge_input, edge_level, load_schedule, make_schedule, new_seed, save_schedule
+from trigger_mask import BitStability, TriggerMask, derive_masks, mask_from_dict, nibble_mask
+from usb_sysfs import SYSFS_ROOT, list_devices
 
 #==========================================================================
 # GLOBALS
 #==========================================================================
 beagle = 0
+# Analyzer opened by open_beagle(), rig tests give each worker its own
+BEAGLE_PORT = 0
 samplerate_khz = 0
+# Exact nanoseconds per Beagle tick, set once the sample rate is known
+tick_scale = 0
 IDLE_THRESHOLD = 2000
 current_datetime = time.strftime("%Y%m%d", time.localtime())
 output_dir = f'{os.getcwd()}/UNKNOWN/{current_datetime}'
 
-# Packet groups
-SOF = 0
-IN_ACK = 1
-IN_NAK = 2
-PING_NAK = 3
-SPLIT_IN_ACK = 4
-SPLIT_IN_NYET = 5
-SPLIT_IN_NAK = 6
-SPLIT_OUT_NYET = 7
-SPLIT_SETUP_NYET = 8
-KEEP_ALIVE = 9
-
-# States used in collapsing state machine
-IDLE = 0
-IN = 1
-PING = 3
-SPLIT = 4
-SPLIT_IN = 5
-SPLIT_OUT = 7
-SPLIT_SETUP = 8
-
 # Size of packet queue.  At most this many packets will need to be alive
 # at the same time.
 QUEUE_SIZE = 3
 
-# Disable COMBINE_SPLITS by setting to False.  Disabling
-# will show individual split counts for each group (such as
-# SPLIT/IN/ACK, SPLIT/IN/NYET, ...).  Enabling will show all the
-# collapsed split counts combined.
-COMBINE_SPLITS = True
+# Largest packet read from the Beagle
+PACKET_SIZE = 1024
+
+# Enable RING_BUFFER_CAPTURE to read the Beagle from a separate process
+# that only copies packets into a shared ring buffer, leaving collapsing
+# and decoding to usb_dump().  Up to RING_BUFFER_SLOTS packets can be
+# waiting before the reading process has to stop and wait.
+RING_BUFFER_CAPTURE = False
+RING_BUFFER_SLOTS = 16384
+
+# Enable HW_FILTER_PROFILE to have the Beagle drop SOF, IN/NAK, PING,
+# SPLIT, ACK and host to device DATA packets before they reach the Pi.
+# Only trigger events and DATA packets from devices are left.
+HW_FILTER_PROFILE = False
+
+# Enable TUNED_CAPTURE to size the Beagle host buffer for the expected
+# packet rate and lower the read latency.  The packet rate measured in the
+# last capture is used, or HOST_PACKET_RATE if nothing was captured yet.
+# HOST_BYTES_PER_PACKET is a rough size of each packet in the host buffer.
+TUNED_CAPTURE = False
+TUNED_LATENCY = 100
+HOST_PACKET_RATE = 40000
+HOST_BYTES_PER_PACKET = 32
+HOST_BUFFER_SECONDS = 4
+HOST_BUFFER_MAX = 64 * 1024 * 1024
+
+# How full the host buffer is gets checked every HOST_BUFFER_SAMPLE_INTERVAL
+# seconds during a capture.  Passing HOST_BUFFER_WARN of the buffer prints a
+# warning, and passing HOST_BUFFER_ABORT stops the capture since packets are
+# about to be lost.
+HOST_BUFFER_SAMPLE_INTERVAL = 0.25
+HOST_BUFFER_WARN = 0.5
+HOST_BUFFER_ABORT = 0.9
+
+# Defaults for sequential latency tests, which keep triggering until the
+# confidence interval on the average latency (and optionally the 99th
+# percentile) is within +/- these many milliseconds, or the trigger cap is hit
+SEQUENTIAL_MEAN_MS = 0.25
+SEQUENTIAL_P99_MS = None
+SEQUENTIAL_MAX_TRIGGERS = 1000
+
+# Enable ADAPTIVE_TRIGGERS to shorten the time between trigger edges during
+# latency tests once the device's response times are known.  The usual 400-1000ms
+# window is used for the first ADAPTIVE_SAMPLES responses, then edges are spaced
+# ADAPTIVE_MULTIPLE times the slowest response (p99.9) apart, but never less than
+# ADAPTIVE_FLOOR_MS, plus a random delay spanning ADAPTIVE_JITTER_POLLS polling intervals.
+ADAPTIVE_TRIGGERS = False
+ADAPTIVE_SAMPLES = 20
+ADAPTIVE_MULTIPLE = 4
+ADAPTIVE_FLOOR_MS = 20
+ADAPTIVE_JITTER_POLLS = 16
+
+# Enable CLOSED_LOOP_TRIGGERS to have latency tests wait for the device to answer
+# each trigger edge before the next one.  Once the response is decoded the next
+# edge fires after a random CLOSED_LOOP_SETTLE_MS delay.  If no response arrives
+# within CLOSED_LOOP_TIMEOUT_MS the next edge fires anyway.  Takes the place of
+# adaptive spacing when both are enabled.
+CLOSED_LOOP_TRIGGERS = False
+CLOSED_LOOP_SETTLE_MS = (20, 60)
+CLOSED_LOOP_TIMEOUT_MS = 1000
+
+# Random delay between trigger edges in milliseconds.
+# See documentation for why these values were chosen
+TRIGGER_MIN_DELAY = 400
+TRIGGER_MAX_DELAY = 1000
+
+# Enable HARDWARE_TIMED_TRIGGERS to generate every trigger edge of a capture up
+# front and have the pigpio daemon play them as DMA waves, instead of
+# time.sleep() between edges.  The schedule is saved next to the capture as
+# trigger_schedule.csv.  Waves of up to WAVE_EDGES edges are streamed one after
+# another, and SCHEDULE_SPARE_EDGES covers edges sent before the Beagle was ready.
+# Not used with adaptive or closed loop triggers, which need to see responses.
+HARDWARE_TIMED_TRIGGERS = False
+WAVE_EDGES = 500
+SCHEDULE_SPARE_EDGES = 20
+
+# Seed for the random parts of a capture: trigger spacing and the calibration
+# shuffle.  None picks a new seed for every capture.  Either way the seed is
+# saved with the trigger schedule and in the results file.
+TRIGGER_SEED = None
+
+# Path of a trigger_schedule.csv from an earlier run to send the exact same
+# trigger edges again, blank to generate a new schedule
+REPLAY_SCHEDULE = ''
+
+# Set FAKE_PIGPIO=1 in the environment to use the stand-in in fake_pigpio.py
+# instead of the pigpio daemon, for trying things out without a Raspberry Pi
+FAKE_PIGPIO = os.environ.get('FAKE_PIGPIO') == '1'
+
+# Set to False when running a job file, questions that would need an operator
+# are answered with the default or end the job instead
+INTERACTIVE = True
+
+# Settings a job file can change, job file key -> global.  Anything not set
+# by a job keeps the value it had when the job file was started
+JOB_SETTINGS = {'ring_buffer_capture': 'RING_BUFFER_CAPTURE',
+                'hw_filter': 'HW_FILTER_PROFILE',
+                'tuned_capture': 'TUNED_CAPTURE',
+                'adaptive_triggers': 'ADAPTIVE_TRIGGERS',
+                'closed_loop_triggers': 'CLOSED_LOOP_TRIGGERS',
+                'hardware_timed_triggers': 'HARDWARE_TIMED_TRIGGERS',
+                'trigger_seed': 'TRIGGER_SEED',
+                'replay_schedule': 'REPLAY_SCHEDULE',
+                'trigger_min_delay': 'TRIGGER_MIN_DELAY',
+                'trigger_max_delay': 'TRIGGER_MAX_DELAY',
+                'calibration_cache': 'CALIBRATION_CACHE',
+                'calibration_triggers': 'CALIBRATION_TRIGGERS',
+                'run_index': 'RUN_INDEX'}
+
+# TestedDevice details a job file can give
+JOB_DEVICE_FIELDS = ('vendor_id', 'product_id', 'manufacturer', 'product', 'version', 'serial', 'device_address',
+                     'endpoint')
+
+# Tests run by a job that does not ask for a number or a sequential test
+JOB_TESTS = 100
+
+# Trigger details found for each device and button are kept here, see calibration.py
+CALIBRATION_CACHE = f'{os.path.dirname(os.path.abspath(__file__))}/calibration_cache.json'
+
+# Every saved run and its clean times are added to this SQLite index, see
+# run_index.py.  Blank to leave the index alone.
+RUN_INDEX = f'{os.path.dirname(os.path.abspath(__file__))}/run_index.sqlite'
+
+# Triggers sent to find a button's trigger details.  Every bit is checked
+# across all of them at once, so more only makes the capture longer.
+CALIBRATION_TRIGGERS = 30
+
+# Triggers sent to check that cached trigger details still match the device.
+# At least half of them have to give a clean time.
+CALIBRATION_VERIFY_TRIGGERS = 6
+
+# Where Device Info looks for USB devices, point USB_SYSFS_ROOT at a copy of
+# the tree to try it on another machine
+USB_SYSFS_ROOT = os.environ.get('USB_SYSFS_ROOT', SYSFS_ROOT)
+
+# Raspberry Pi GPIO pair (button wire, Beagle wire) for each Beagle digital input.
+# Input 1 is the original trigger button, inputs 2-4 are for extra buttons tested
+# in the same capture.  Change pins as needed for your testing setup
+BUTTON_PINS = {1: (20, 21), 2: (16, 26), 3: (19, 13), 4: (6, 5)}
+
+# Pin maps like BUTTON_PINS for each analyzer in a rig test, in the order the
+# analyzers are found.  No two analyzers can share a pin, and only the buttons
+# on inputs in an analyzer's map are tested on it
+RIG_BUTTON_PINS = [BUTTON_PINS, {1: (23, 24)}, {1: (17, 27)}, {1: (22, 10)}]
+
+# Tests run on every analyzer of a rig test unless another count is entered
+RIG_TESTS = 100
+
+# Beagle digital input enable bits
+DIGITAL_IN_ENABLE = {1: BG_USB2_DIGITAL_IN_ENABLE_PIN1, 2: BG_USB2_DIGITAL_IN_ENABLE_PIN2,
+                     3: BG_USB2_DIGITAL_IN_ENABLE_PIN3, 4: BG_USB2_DIGITAL_IN_ENABLE_PIN4}
 
 
 ##==========================================================================
 # CLASSES
 ##==========================================================================
+# Trigger button details could not be found from a calibration capture
+class TriggerError(Exception):
+    pass
+
+
 class TestedDevice:
     vendor_id = ''
     product_id = ''
@@ -59,17 +213,141 @@ class TestedDevice:
     product = ''
     version = ''
     serial = ''
+    # Link speed in Mbit/s and interrupt IN endpoint -> polling interval (us), from sysfs
+    speed = ''
+    endpoint_intervals = {}
+    # TriggerMask the button is tested with, position and value are the
+    # nibble holding it as older trigger details give them
+    trigger_mask = None
     trigger_nibble = ''
     trigger_position = ''
     trigger_length = 0
     trigger_name = ''
+    beagle_input = 1
+    # Only DATA packets from this device address and endpoint are analyzed, blank for any
+    device_address = ''
+    endpoint = ''
+    # TriggerButtons tested in the same captures as the trigger button above
+    extra_buttons = []
+
+
+# Trigger details of an extra button, wired to its own Beagle digital input
+class TriggerButton:
+    def __init__(self, trigger_name='', beagle_input=2):
+        self.trigger_mask = None
+        self.trigger_nibble = ''
+        self.trigger_position = ''
+        self.trigger_length = 0
+        self.trigger_name = trigger_name
+        self.beagle_input = beagle_input
+
+
+# Details of the last usb_dump() run
+class CaptureStats:
+    host_packets = 0
+    elapsed = 0.0
+    packet_rate = 0.0
+    hw_filter = False
+    host_buffer_size = 0
+    host_buffer_high_water = 0
+    host_buffer_abort = False
+    triggers = 0
+    seed = None
+
+
+# Samples how full the Beagle host buffer is while capturing
+class HostBufferMonitor:
+    def __init__(self, size):
+        self.size = size
+        self.high_water = 0
+        self.abort = False
+        self._next_sample = 0
+
+    # Returns True once the buffer is full enough that the capture should stop
+    def sample(self):
+        now = time.monotonic()
+        
+        if now < self._next_sample:
+            return False
+        
+        self._next_sample = now + HOST_BUFFER_SAMPLE_INTERVAL
+        
+        used = bg_host_buffer_used(beagle)
+        if used > self.high_water:
+            self.high_water = used
+        
+        if self.size > 0 and used >= self.size * HOST_BUFFER_ABORT:
+            self.abort = True
+            
+        return self.abort
+
+
+# Pairs each trigger with the DATA packet answering it while usb_dump() is
+# running, using the same trigger config checks as latency_test().  Each
+# latency is converted to milliseconds once, then given to the sequential
+# test stopping rule and/or sent to trigger_on() for adaptive spacing.
+# The responded event tells trigger_on() the current edge was answered.
+# latency_test() still analyzes the capture file afterwards.
+# With extra buttons the input that changed picks whose trigger config is used.
+class ResponsePairing:
+    def __init__(self, stop=None, latencies=None, responded=None):
+        self.stop = stop
+        self.latencies = latencies
+        self.responded = responded
+        self.address, self.endpoint = selected_device()
+        self.buttons = tested_buttons()
+        self.button = TestedDevice
+        self.pressed = False
+        self.trigger_events = None
+        self.trigger_time = None
+
+    # Called with every trigger and DATA packet written to the capture,
+    # returns True once the sequential test has seen enough latencies
+    def packet(self, time_sop, events, data, length, address, endpoint):
+        if events & BG_EVENT_USB_DIGITAL_INPUT:
+            if self.trigger_events is not None:
+                changed = events ^ self.trigger_events
+                
+                for button in self.buttons:
+                    if changed >> (button.beagle_input - 1) & 1:
+                        self.button = button
+            
+            # A low input is a pressed button
+            self.pressed = not events >> (self.button.beagle_input - 1) & 1
+            self.trigger_events = events
+            self.trigger_time = time_sop
+            return False
+
+        button = self.button
+        
+        if self.trigger_time is None or length != button.trigger_length:
+            return False
+
+        if (self.address is not None and address != self.address) or \
+                (self.endpoint is not None and endpoint != self.endpoint):
+            return False
+
+        released, pressed = button.trigger_mask.state(data, length)
+        
+        if not (pressed if self.pressed else released):
+            return False
+
+        latency_ms = float((time_sop - self.trigger_time) * tick_scale) / 1000000
+        self.trigger_time = None
+        
+        if self.responded is not None:
+            self.responded.set()
+        
+        if self.latencies is not None:
+            self.latencies.put(latency_ms)
+
+        return self.stop is not None and self.stop.add(latency_ms)
 
 
 class PacketInfo:
     def __init__(self):
-        self.data = array_u08(1024)
+        self.data = array_u08(PACKET_SIZE)
         self.time_sop = 0
-        self.time_sop_ns = 0
         self.time_duration = 0
         self.time_dataoffset = 0
         self.status = 0
@@ -112,20 +390,6 @@ class PacketQueue:
         return pkts
 
 
-class CollapseInfo:
-    def __init__(self):
-        # Timestamp when collapsing begins
-        self.time_sop = 0
-        # The number of packets collapsed for each packet group
-        self.count = {SOF: 0, PING_NAK: 0, IN_ACK: 0, IN_NAK: 0, SPLIT_IN_ACK: 0, SPLIT_IN_NYET: 0, SPLIT_IN_NAK: 0,
-                      SPLIT_OUT_NYET: 0, SPLIT_SETUP_NYET: 0, KEEP_ALIVE: 0}
-
-    def clear(self):
-        self.time_sop = 0
-        for k in self.count:
-            self.count[k] = 0
-
-
 ##==========================================================================
 # UTILITY FUNCTIONS
 ##==========================================================================
@@ -133,10 +397,10 @@ def open_beagle():
     # Open the device
     global beagle
     
-    port = 0      # open port 0 by default
+    port = BEAGLE_PORT      # open port 0 by default
     samplerate = 0      # in kHz (query)
     timeout = 500    # 500 in milliseconds
-    latency = 2000    # 2000 in milliseconds
+    latency = TUNED_LATENCY if TUNED_CAPTURE else 2000    # 2000 in milliseconds
     
     beagle = bg_open(port)
     if beagle <= 0:
@@ -169,10 +433,23 @@ def open_beagle():
     print("Latency set to %d ms." % latency)
 
     print("Host interface is %s." % (bg_host_ifce_speed(beagle) and "high speed" or "full speed"))
+    
+    # Size the host buffer to hold a few seconds of packets
+    if TUNED_CAPTURE:
+        packet_rate = CaptureStats.packet_rate or HOST_PACKET_RATE
+        bg_host_buffer_size(beagle, min(int(packet_rate * HOST_BYTES_PER_PACKET * HOST_BUFFER_SECONDS),
+                                        HOST_BUFFER_MAX))
+    
+    CaptureStats.host_buffer_size = bg_host_buffer_size(beagle, 0)
+    print("Host buffer size is %d bytes." % CaptureStats.host_buffer_size)
 
     # Set up the digital input and output lines.
     #setup_digital_lines()
-    input_enable_mask = BG_USB2_DIGITAL_IN_ENABLE_PIN1
+    input_enable_mask = 0
+    
+    # One digital input for each button being tested
+    for beagle_input in active_inputs():
+        input_enable_mask |= DIGITAL_IN_ENABLE[beagle_input]
 
     # Enable digital input pins
     bg_usb2_digital_in_config(beagle, input_enable_mask)
@@ -182,8 +459,107 @@ def open_beagle():
     sys.stdout.flush()
     
     
+# TestedDevice details and trigger config saved in the capture file header
+def device_metadata():
+    return {'vendor_id': TestedDevice.vendor_id,
+            'product_id': TestedDevice.product_id,
+            'manufacturer': TestedDevice.manufacturer,
+            'product': TestedDevice.product,
+            'version': TestedDevice.version,
+            'serial': TestedDevice.serial,
+            'speed': TestedDevice.speed,
+            'endpoint_intervals': TestedDevice.endpoint_intervals,
+            'trigger_mask': mask_details(TestedDevice),
+            'trigger_nibble': TestedDevice.trigger_nibble,
+            'trigger_position': TestedDevice.trigger_position,
+            'trigger_length': TestedDevice.trigger_length,
+            'trigger_name': TestedDevice.trigger_name,
+            'beagle_input': TestedDevice.beagle_input,
+            'device_address': TestedDevice.device_address,
+            'endpoint': TestedDevice.endpoint,
+            'extra_buttons': [{**vars(button), 'trigger_mask': mask_details(button)}
+                              for button in TestedDevice.extra_buttons]}
+
+
+# Polling interval of the device's interrupt IN endpoints, only the
+# calibrated endpoint once it is known
+def polling_interval():
+    intervals = TestedDevice.endpoint_intervals
+    
+    if TestedDevice.endpoint != '' and int(TestedDevice.endpoint) in intervals:
+        intervals = {int(TestedDevice.endpoint): intervals[int(TestedDevice.endpoint)]}
+    
+    return ', '.join(f'EP {endpoint} {interval / 1000:g} ms' for endpoint, interval in sorted(intervals.items())
+                     if interval is not None)
+
+
+# The trigger button followed by any extra buttons
+def tested_buttons():
+    return [TestedDevice] + TestedDevice.extra_buttons
+
+
+# Set a button's TriggerMask, and the nibble position and value shown for it
+def set_trigger_mask(button, trigger_mask):
+    button.trigger_mask = trigger_mask
+    button.trigger_position, button.trigger_nibble = trigger_mask.nibble() if trigger_mask else ('', '')
+
+
+# A button's TriggerMask as saved in capture headers and job status files
+def mask_details(button):
+    return button.trigger_mask.to_dict() if button.trigger_mask else None
+
+
+# Manually entered trigger details, a nibble position and value as before,
+# or a byte and bit mask for buttons that share a nibble with others
+def enter_trigger_mask(button):
+    position = input('Enter Trigger Button Position (count from 1 by nibbles, m for a bit mask): ')
+    
+    if position == 'm':
+        offset = int(input('Enter Trigger Button Byte (count from 1): ')) - 1
+        mask = int(input('Enter Trigger Button Mask (0x): '), 16)
+        on = int(input('Enter Trigger Button Pressed Value (0x): '), 16)
+        off = int(input('Enter Trigger Button Released Value (0x, blank for 0): ') or '0', 16)
+        set_trigger_mask(button, TriggerMask(offset, mask, on & mask, off & mask))
+    
+    else:
+        set_trigger_mask(button, nibble_mask(position, input('Enter Trigger Button Value (0x): ')))
+
+
+# Beagle digital inputs of every button being tested
+def active_inputs():
+    return [button.beagle_input for button in tested_buttons()]
+
+
+# Bank 1 bits of the GPIO pairs for the given Beagle digital inputs
+def input_bits(inputs):
+    bits = 0
+    
+    for beagle_input in inputs:
+        for pin in BUTTON_PINS[beagle_input]:
+            bits |= 1 << pin
+    
+    return bits
+
+
+# Bank 1 bits changed by a trigger edge, edge 0 releases every button
+def edge_bits(edge, inputs):
+    if edge == 0:
+        return input_bits(inputs)
+    
+    return input_bits([edge_input(edge, inputs)])
+
+
+# Device address and endpoint to pass to DeviceFilter, None matches any
+def selected_device():
+    address = None if TestedDevice.device_address == '' else int(TestedDevice.device_address)
+    endpoint = None if TestedDevice.endpoint == '' else int(TestedDevice.endpoint)
+    
+    return address, endpoint
+
+
+# Packets keep the raw tick counts, this is only used when they are shown
 def timestamp_to_ns(stamp):
-    return (stamp * 1000) // (samplerate_khz // 1000)
+    return ticks_to_ns(stamp, tick_scale)
 
 
 def print_general_status(status):
@@ -336,135 +712,136 @@ def usb_print_packet(packet, error_status, find_caller):
         packet_data = usb_print_data_packet(packet.data, packet.length)
     else:
         packet_data = ""
+    
+    time_sop_ns = timestamp_to_ns(packet.time_sop)
 
     # Only collect trigger and data packets
     # 0x00800000 is the value when digital input is released
-    if packet.events in (BG_EVENT_USB_DIGITAL_INPUT, 0x00800001):
+    if is_input_event(packet.events):
         if packet.events == BG_EVENT_USB_DIGITAL_INPUT:
             if find_caller:
-                print('%s,TRIGGER_ON' % packet.time_sop_ns)
-            return f'{packet.time_sop_ns},{packet.length},TRIGGER_ON'
+                print('%s,TRIGGER_ON' % time_sop_ns)
+            return f'{time_sop_ns},{packet.length},TRIGGER_ON'
             
+        elif packet.events == 0x00800001:
+            if find_caller:
+                print('%s,TRIGGER_OFF' % time_sop_ns)
+            return f'{time_sop_ns},{packet.length},TRIGGER_OFF'
+        
         else:
+            inputs = f'{packet.events & BG_EVENT_USB_DIGITAL_INPUT_MASK:04b}'
             if find_caller:
-                print('%s,TRIGGER_OFF' % packet.time_sop_ns)
-            return f'{packet.time_sop_ns},{packet.length},TRIGGER_OFF'
+                print('%s,INPUTS_%s' % (time_sop_ns, inputs))
+            return f'{time_sop_ns},{packet.length},INPUTS_{inputs}'
     
     elif packet.data[0] in (BG_USB_PID_DATA0, BG_USB_PID_DATA1):
         if find_caller:
-            print('%s,%s' % (packet.time_sop_ns, packet_data))
-        return f'{packet.time_sop_ns},{packet.length},{packet_data}'
+            print('%s,%s' % (time_sop_ns, packet_data))
+        return f'{time_sop_ns},{packet.length},{packet_data}'
     
     sys.stdout.flush()
 
 
-# Dump saved summary information
-def usb_print_summary_packet(packet_number, collapse_info, signal_errors):
-    offset = 0
-    summary = ""
-
-    counts = [collapse_info.count[key] for key in collapse_info.count if collapse_info.count[key] > 0]
-
-    if len(counts) > 0:
-        summary += "COLLAPSED "
+# Configure the Beagle and start capturing
+def start_capture():
+    global samplerate_khz
+    
+    open_beagle()
+    
+    samplerate_khz = bg_samplerate(beagle, 0)
 
-        if collapse_info.count[KEEP_ALIVE] > 0:
-            summary += "[%d KEEP-ALIVE] " %  \
-                       collapse_info.count[KEEP_ALIVE]
+    # Configure Beagle 480 for realtime capture
+    bg_usb2_capture_config(beagle, BG_USB2_CAPTURE_REALTIME)
+    bg_usb2_target_config(beagle, BG_USB2_AUTO_SPEED_DETECT)
+    bg_usb_configure(beagle, BG_USB_CAPTURE_USB2, BG_USB_TRIGGER_MODE_IMMEDIATE)
 
-        if collapse_info.count[SOF] > 0:
-            summary += "[%d SOF] " %  \
-                       collapse_info.count[SOF]
+    if HW_FILTER_PROFILE:
+        configure_hw_filter()
+    
+    else:
+        # Filter out our own packets.  This is only relevant when
+        # one host controller is used.
+        bg_usb2_hw_filter_config(beagle, BG_USB2_HW_FILTER_SELF)
+        bg_usb2_complex_match_disable(beagle)
 
-        if collapse_info.count[IN_ACK] > 0:
-            summary += "[%d IN/ACK] " % \
-                       collapse_info.count[IN_ACK]
+    # Open the connection to the Beagle.  Default to port 0.
+    if bg_enable(beagle, BG_PROTOCOL_USB) != BG_OK:
+        print("error: could not enable USB capture; exiting...")
+        sys.exit(1)
 
-        if collapse_info.count[IN_NAK] > 0:
-            summary += "[%d IN/NAK] " % \
-                       collapse_info.count[IN_NAK]
 
-        if collapse_info.count[PING_NAK] > 0:
-            summary += "[%d PING/NAK] " % \
-                       collapse_info.count[PING_NAK]
+# Used with HW_FILTER_PROFILE, drop everything except trigger events and DATA packets
+# from the device in the Beagle, so far fewer packets have to be read by the Pi
+def configure_hw_filter():
+    # SOF, IN/NAK, PING/NAK and SPLIT transactions are handled by the PID filters
+    bg_usb2_hw_filter_config(beagle, BG_USB2_HW_FILTER_SELF | BG_USB2_HW_FILTER_PID_SOF | BG_USB2_HW_FILTER_PID_IN |
+                             BG_USB2_HW_FILTER_PID_PING | BG_USB2_HW_FILTER_PID_SPLIT)
 
-        if COMBINE_SPLITS:
-            split_count = collapse_info.count[SPLIT_IN_ACK] + \
-                          collapse_info.count[SPLIT_IN_NYET] + \
-                          collapse_info.count[SPLIT_IN_NAK] + \
-                          collapse_info.count[SPLIT_OUT_NYET] + \
-                          collapse_info.count[SPLIT_SETUP_NYET]
+    # ACKs and DATA packets sent by the host need a complex match state that filters them.
+    # IN tokens are kept so DATA packets can still be tied to a device.
+    state = BeagleUsb2ComplexMatchState()
 
-            if split_count > 0:
-                summary += "[%d SPLITS] " % split_count
-        else:
-            if collapse_info.count[SPLIT_IN_ACK] > 0:
-                summary += "[%d SPLIT/IN/ACK] " % \
-                           collapse_info.count[SPLIT_IN_ACK]
+    state.data_0_valid = 1
+    state.data_0_match.packet_type = BG_USB2_MATCH_PACKET_ACK
+    state.data_0_match.action_mask = BG_USB_COMPLEX_MATCH_ACTION_FILTER
 
-            if collapse_info.count[SPLIT_IN_NYET] > 0:
-                summary += "[%d SPLIT/IN/NYET] " % \
-                           collapse_info.count[SPLIT_IN_NYET]
+    state.data_1_valid = 1
+    state.data_1_match.packet_type = BG_USB2_MATCH_PACKET_DATA0_DATA1
+    state.data_1_match.data_properties_valid = 1
+    state.data_1_match.data_properties.direction = BG_USB2_MATCH_DIRECTION_OUT_SETUP
+    state.data_1_match.action_mask = BG_USB_COMPLEX_MATCH_ACTION_FILTER
 
-            if collapse_info.count[SPLIT_IN_NAK] > 0:
-                summary += "[%d SPLIT/IN/NAK] " % \
-                           collapse_info.count[SPLIT_IN_NAK]
+    if (bg_usb2_complex_match_config_single(beagle, 0, 0, state) != BG_OK) or \
+            (bg_usb2_complex_match_enable(beagle) != BG_OK):
+        print('Complex match filter was not accepted, only the PID filters are enabled.')
 
-            if collapse_info.count[SPLIT_OUT_NYET] > 0:
-                summary += "[%d SPLIT/OUT/NYET] " % \
-                           collapse_info.count[SPLIT_OUT_NYET]
+    print('Hardware filter enabled.')
+    print('')
 
-            if collapse_info.count[SPLIT_SETUP_NYET] > 0:
-                summary += "[%d SPLIT/SETUP/NYET] " % \
-                           collapse_info.count[SPLIT_SETUP_NYET]
 
-        offset += 1
+# Stop capturing and close the analyzer
+def stop_capture():
+    bg_disable(beagle)
+    bg_close(beagle)
 
-    # Output any signal errors
-    if signal_errors > 0:
-        summary += "<%d SIGNAL ERRORS>" % signal_errors
-        offset += 1
 
-    collapse_info.clear()
+# Used with RING_BUFFER_CAPTURE, only reads packets from the Beagle into the ring
+# so the Beagle host buffer is drained as fast as possible.  usb_dump() does the rest.
+def capture_producer(ring):
+    start_capture()
+    ring.set_info(samplerate_khz, bg_host_ifce_speed(beagle), CaptureStats.host_buffer_size)
     
-    return packet_number, 0
-
-
-# Outputs any packets saved during the collapsing process
-def output_saved(packetnum, signal_errors, collapse_info, pkt_q, find_caller):
-    (packetnum, signal_errors) = \
-                usb_print_summary_packet(packetnum, collapse_info,
-                                         signal_errors)
-
-    pkts = pkt_q.clear(dequeue=True)
-
-    for pkt in pkts:
-        usb_print_packet(pkt, 0, find_caller)
-
-    return packetnum, signal_errors
-
-
-# Collapses a group of packets.  This involves incrementing the group
-# counter and clearing the queue. If this is the first group to
-# be collapsed, the collapse time needs to be set, which marks when
-# this collapsing began.
-def collapse(group, collapse_info, pkt_q):
-    collapse_info.count[group] += 1
-
-    if collapse_info.time_sop == 0:
-        if not pkt_q.is_empty:
-            collapse_info.time_sop = pkt_q.head.time_sop
-        else:
-            collapse_info.time_sop = pkt_q.tail.time_sop
-
-    pkt_q.clear()
+    monitor = HostBufferMonitor(CaptureStats.host_buffer_size)
+    packet = array_u08(PACKET_SIZE)
+    
+    while not ring.stop.is_set():
+        (length, status, events, time_sop, time_duration, time_dataoffset, packet) = bg_usb2_read(beagle, packet)
+        
+        if monitor.sample():
+            break
+        
+        if not ring.put(length, status, events, time_sop, time_duration, time_dataoffset, packet):
+            break
+        
+        # Same reasons usb_dump() stops decoding
+        if (status & BG_READ_USB_END_OF_CAPTURE) or length < 0:
+            break
+    
+    ring.set_host_buffer(monitor.high_water, monitor.abort)
+    stop_capture()
+    ring.close()
 
 
 # The main packet dump routine
-def usb_dump(num_packets):
+# Trigger and data packets are streamed to a binary capture file at capture_path.
+# If stop_check is given it is called with every packet written, and the
+# capture ends early once it returns True.  Response times put in the
+# latencies queue, or the responded event, are used by trigger_on() to space
+# the trigger edges.  The buttons on the given Beagle digital inputs are
+# pressed in turn, every button being tested by default.
+def usb_dump(num_packets, capture_path, stop_check=None, latencies=None, responded=None, inputs=None):
     import inspect
     
-    packet_collection = []
     completion = [90, 80, 70, 60, 50, 40, 30, 20, 10]
     
     # Only print raw packets from find_trigger() function, to help debug weird devices
@@ -473,50 +850,86 @@ def usb_dump(num_packets):
     else:
         find_caller = False
     
+    if inputs is None:
+        inputs = active_inputs()
+    
+    # Every capture gets a seed so its random trigger timing can be repeated
+    seed = TRIGGER_SEED if TRIGGER_SEED is not None else new_seed()
+    
+    # Triggers that do not depend on responses are generated up front, or replayed from an earlier run,
+    # and saved next to the capture
+    if latencies is None and responded is None:
+        if REPLAY_SCHEDULE:
+            seed, schedule = load_schedule(REPLAY_SCHEDULE)
+            print(f'Replaying trigger schedule {REPLAY_SCHEDULE}\n')
+        else:
+            schedule = make_schedule(num_packets + SCHEDULE_SPARE_EDGES, TRIGGER_MIN_DELAY, TRIGGER_MAX_DELAY, seed)
+        
+        save_schedule(f'{os.path.dirname(capture_path)}/trigger_schedule.csv', schedule, seed, inputs)
+    else:
+        schedule = None
+    
+    CaptureStats.seed = seed
+    
     # Start trggering function in the background
     if __name__ == "__main__":
         print('Start triggering...\n')
         
-        trigger_process = multiprocessing.Process(target=trigger_on)
+        if schedule and HARDWARE_TIMED_TRIGGERS:
+            trigger_process = multiprocessing.Process(target=trigger_waves, args=(schedule, seed, inputs))
+        else:
+            trigger_process = multiprocessing.Process(target=trigger_on,
+                                                      args=(latencies, responded, schedule, seed, inputs))
         
         trigger_process.start()
     
     print('Connect to analyzer...\n')
-    open_beagle()
     
-    # Collapsing counts and the time the collapsing started
-    collapse_info = CollapseInfo()
-
+    global samplerate_khz, tick_scale
+    
+    if RING_BUFFER_CAPTURE:
+        # Another process reads the Beagle, packets are decoded here as they come out of the ring
+        ring = PacketRing(RING_BUFFER_SLOTS, PACKET_SIZE)
+        capture_process = multiprocessing.Process(target=capture_producer, args=(ring,))
+        capture_process.start()
+        
+        while not ring.ready.wait(POLL_TIMEOUT):
+            if not capture_process.is_alive():
+                print("error: capture process exited; exiting...")
+                sys.exit(1)
+        
+        samplerate_khz = ring.samplerate_khz
+        host_speed = ring.host_speed
+        CaptureStats.host_buffer_size = ring.host_buffer_size
+        
+    else:
+        ring = None
+        start_capture()
+        host_speed = bg_host_ifce_speed(beagle)
+        monitor = HostBufferMonitor(CaptureStats.host_buffer_size)
+    
+    tick_scale = ns_per_tick(samplerate_khz)
+    
     # Packets are saved during the collapsing process
     pkt_q = PacketQueue()
 
-    signal_errors = 0
     packetnum = 0
+    host_packets = 0
+    
+    # Device address and endpoint from the last IN token, used to tag DATA packets
+    in_address = NO_DEVICE
+    in_endpoint = NO_DEVICE
 
-    # Collapsing packets is handled through a state machine.
-    # IDLE is the initial state.
-    state = IDLE
-
-    global samplerate_khz
-    samplerate_khz = bg_samplerate(beagle, 0)
-    idle_samples = IDLE_THRESHOLD * samplerate_khz
-
-    # Configure Beagle 480 for realtime capture
-    bg_usb2_capture_config(beagle, BG_USB2_CAPTURE_REALTIME)
-    bg_usb2_target_config(beagle, BG_USB2_AUTO_SPEED_DETECT)
-    bg_usb_configure(beagle, BG_USB_CAPTURE_USB2, BG_USB_TRIGGER_MODE_IMMEDIATE)
-
-    # Filter out our own packets.  This is only relevant when
-    # one host controller is used.
-    bg_usb2_hw_filter_config(beagle, BG_USB2_HW_FILTER_SELF)
-
-    # Open the connection to the Beagle.  Default to port 0.
-    if bg_enable(beagle, BG_PROTOCOL_USB) != BG_OK:
-        print("error: could not enable USB capture; exiting...")
-        sys.exit(1)
+    # Collapsing packets is handled through a table driven state machine,
+    # saving packets into the queue while a sequence is incomplete
+    collapse = CollapseEngine(pkt_q, IDLE_THRESHOLD * samplerate_khz)
+    
+    capture = CaptureWriter(capture_path, samplerate_khz, host_speed, device_metadata())
 
     print('Start USB collection...\n')
     
+    start = time.time()
+    
     # Output the header...
     if find_caller:
         print('time(ns),pid,data0 ... dataN(*)')
@@ -534,14 +947,27 @@ def usb_dump(num_packets):
         # Info for the current packet
         cur_packet = pkt_q.tail
 
-        (cur_packet.length, cur_packet.status, cur_packet.events, cur_packet.time_sop, cur_packet.time_duration,
-         cur_packet.time_dataoffset, cur_packet.data) = bg_usb2_read(beagle, cur_packet.data)
-
-        cur_packet.time_sop_ns = timestamp_to_ns(cur_packet.time_sop)
+        if ring is None:
+            (cur_packet.length, cur_packet.status, cur_packet.events, cur_packet.time_sop, cur_packet.time_duration,
+             cur_packet.time_dataoffset, cur_packet.data) = bg_usb2_read(beagle, cur_packet.data)
+            
+            if monitor.sample():
+                break
+        
+        elif not ring.get(cur_packet):
+            # Nothing in the ring yet, keep waiting unless the reading process has stopped
+            if capture_process.is_alive():
+                continue
+            
+            break
+        
+        # Count everything the Beagle sent to the Pi
+        if cur_packet.length > 0 or cur_packet.events:
+            host_packets += 1
 
         # Exit if observed end of capture
         if cur_packet.status & BG_READ_USB_END_OF_CAPTURE:
-            usb_print_summary_packet(packetnum, collapse_info, signal_errors)
+            collapse.clear()
 
             break
 
@@ -554,12 +980,17 @@ def usb_dump(num_packets):
 
         # Check for USB error
         if cur_packet.status == BG_READ_USB_ERR_BAD_SIGNALS:
-            signal_errors += 1
+            collapse.signal_errors += 1
 
         # Set the PID for collapsing state machine below.  Treat
         # KEEP_ALIVEs as packets.
         if cur_packet.length > 0:
             pid = cur_packet.data[0]
+            
+            # IN token holds the 7 bit address and 4 bit endpoint of the DATA packet that follows
+            if pid == BG_USB_PID_IN and cur_packet.length >= 3:
+                in_address = cur_packet.data[1] & 0x7f
+                in_endpoint = ((cur_packet.data[2] & 0x07) << 1) | (cur_packet.data[1] >> 7)
         elif cur_packet.events & BG_EVENT_USB_KEEP_ALIVE and not cur_packet.status & BG_READ_USB_ERR_BAD_PID:
             pid = KEEP_ALIVE
         else:
@@ -568,137 +999,86 @@ def usb_dump(num_packets):
         # Collapse these packets appropriately:
         # SOF* (IN (ACK|NAK))* (PING NAK)*
         # (SPLIT (OUT|SETUP) NYET)* (SPLIT IN (ACK|NYET|NACK))*
-
-        # If the time elapsed since collapsing began is greater than
-        # the threshold, output the counts and zero out the counters.
-        if cur_packet.time_sop - collapse_info.time_sop >= idle_samples:
-            (packetnum, signal_errors) = \
-                usb_print_summary_packet(packetnum, collapse_info,
-                                         signal_errors)
-
-        while True:
+        # Anything else ends the collapsing and is output here.
+        if not collapse.step(pid, cur_packet.time_sop):
+            continue
+
+        if (cur_packet.length > 0 or cur_packet.events or
+            (cur_packet.status != 0 and
+             cur_packet.status != BG_READ_TIMEOUT)):
+
+            # Send to capture file, and print if testing button
+            # Only increment counter if a trigger is seen
+            if is_input_event(cur_packet.events):
+                capture.write(cur_packet.time_sop, cur_packet.events, cur_packet.data, cur_packet.length)
+                packetnum += 1
+                
+                if find_caller:
+                    usb_print_packet(cur_packet, 0, find_caller)
+                
+                if stop_check is not None and stop_check(cur_packet.time_sop, cur_packet.events, cur_packet.data,
+                                                         cur_packet.length, NO_DEVICE, NO_DEVICE):
+                    break
             
-            re_run = False
-
-            # The initial state of the state machine.  Collapse SOFs
-            # and KEEP_ALIVEs.  Save IN, PING, or SPLIT packets and
-            # move to the next state for the next packet.  Otherwise,
-            # print the collapsed packet counts and the current packet.
-            if state == IDLE:
-                if pid == KEEP_ALIVE:
-                    collapse(KEEP_ALIVE, collapse_info, pkt_q)
-                elif pid == BG_USB_PID_SOF:
-                    collapse(SOF, collapse_info, pkt_q)
-                elif pid == BG_USB_PID_IN:
-                    pkt_q.save_packet()
-                    state = IN
-                elif pid == BG_USB_PID_PING:
-                    pkt_q.save_packet()
-                    state = PING
-                elif pid == BG_USB_PID_SPLIT:
-                    pkt_q.save_packet()
-                    state = SPLIT
-                else:
-                    (packetnum, signal_errors) = \
-                                usb_print_summary_packet(packetnum,
-                                                         collapse_info,
-                                                         signal_errors)
-
-                    if (cur_packet.length > 0 or cur_packet.events or
-                        (cur_packet.status != 0 and
-                         cur_packet.status != BG_READ_TIMEOUT)):
-
-                        # Send to packet collector if testing button
-                        # Only increment counter if a trigger is seen
-                        if cur_packet.events in (BG_EVENT_USB_DIGITAL_INPUT, 0x00800001):
-                            packet_collection.append(usb_print_packet(cur_packet, 0, find_caller))
-                            packetnum += 1
-                        
-                        # We still want to collect data packets
-                        elif cur_packet.data[0] in (BG_USB_PID_DATA0, BG_USB_PID_DATA1):
-                            packet_collection.append(usb_print_packet(cur_packet, 0, find_caller))
-
-            # Collapsing IN+ACK or IN+NAK.  Otherwise, output any
-            # saved packets and rerun the collapsing state machine
-            # on the current packet.
-            elif state == IN:
-                state = IDLE
-                if pid == BG_USB_PID_ACK:
-                    collapse(IN_ACK, collapse_info, pkt_q)
-                elif pid == BG_USB_PID_NAK:
-                    collapse(IN_NAK, collapse_info, pkt_q)
-                else:
-                    re_run = True
-
-            # Collapsing PING+NAK
-            elif state == PING:
-                state = IDLE
-                if pid == BG_USB_PID_NAK:
-                    collapse(PING_NAK, collapse_info, pkt_q)
-                else:
-                    re_run = True
-
-            # Expecting an IN, OUT, or SETUP
-            elif state == SPLIT:
-                if pid == BG_USB_PID_IN:
-                    pkt_q.save_packet()
-                    state = SPLIT_IN
-                elif pid == BG_USB_PID_OUT:
-                    pkt_q.save_packet()
-                    state = SPLIT_OUT
-                elif pid == BG_USB_PID_SETUP:
-                    pkt_q.save_packet()
-                    state = SPLIT_SETUP
-                else:
-                    state = IDLE
-                    re_run = True
-
-            # Collapsing SPLIT+IN+NYET, SPLIT+IN+NAK, SPLIT+IN+ACK
-            elif state == SPLIT_IN:
-                state = IDLE
-                if pid == BG_USB_PID_NYET:
-                    collapse(SPLIT_IN_NYET, collapse_info, pkt_q)
-                elif pid == BG_USB_PID_NAK:
-                    collapse(SPLIT_IN_NAK, collapse_info, pkt_q)
-                elif pid == BG_USB_PID_ACK:
-                    collapse(SPLIT_IN_ACK, collapse_info, pkt_q)
-                else:
-                    re_run = True
-
-            # Collapsing SPLIT+OUT+NYET
-            elif state == SPLIT_OUT:
-                state = IDLE
-                if pid == BG_USB_PID_NYET:
-                    collapse(SPLIT_OUT_NYET, collapse_info, pkt_q)
-                else:
-                    re_run = True
-
-            # Collapsing SPLIT+SETUP+NYET
-            elif state == SPLIT_SETUP:
-                state = IDLE
-                if pid == BG_USB_PID_NYET:
-                    collapse(SPLIT_SETUP_NYET, collapse_info, pkt_q)
-                else:
-                    re_run = True
-
-            if not re_run:
-                break
-
-            # The state machine is about to be re-run.  This
-            # means that a complete packet sequence wasn't collapsed
-            # and there are packets in the queue that need to be
-            # output before we can process the current packet.
-            (packetnum, signal_errors) = output_saved(packetnum, signal_errors, collapse_info, pkt_q, find_caller)
-
+            # We still want to collect data packets
+            elif cur_packet.data[0] in (BG_USB_PID_DATA0, BG_USB_PID_DATA1):
+                capture.write(cur_packet.time_sop, cur_packet.events, cur_packet.data, cur_packet.length,
+                              in_address, in_endpoint)
+                
+                if find_caller:
+                    usb_print_packet(cur_packet, 0, find_caller)
+                
+                if stop_check is not None and stop_check(cur_packet.time_sop, cur_packet.events, cur_packet.data,
+                                                         cur_packet.length, in_address, in_endpoint):
+                    break
+
+    CaptureStats.host_packets = host_packets
+    CaptureStats.triggers = packetnum
+    CaptureStats.elapsed = time.time() - start
+    CaptureStats.packet_rate = host_packets / CaptureStats.elapsed
+    CaptureStats.hw_filter = HW_FILTER_PROFILE
+    
     # Stop the background triggering function, capturing, and close the analyzer
     trigger_process.terminate()
-    bg_disable(beagle)
-    bg_close(beagle)
-    trigger_adjust(True)
+    
+    if schedule and HARDWARE_TIMED_TRIGGERS:
+        stop_waves()
+    
+    if ring is None:
+        stop_capture()
+        CaptureStats.host_buffer_high_water = monitor.high_water
+        CaptureStats.host_buffer_abort = monitor.abort
+        
+    else:
+        ring.stop.set()
+        capture_process.join()
+        
+        print(f'\nRing buffer overflowed {ring.overflows} times, '
+              f'high water mark {ring.high_water} of {ring.slots} slots.')
+        
+        CaptureStats.host_buffer_high_water = ring.host_buffer_high_water
+        CaptureStats.host_buffer_abort = bool(ring.host_buffer_abort)
+        ring.close(unlink=True)
+    
+    trigger_adjust(True, inputs)
+    capture.close()
     
     print('\nDone. Stopping triggers and collection.\n')
     
-    return packet_collection
+    print(f'{CaptureStats.host_packets} packets reached the host, {round(CaptureStats.packet_rate)} packets/s '
+          f'with the hardware filter {"enabled" if CaptureStats.hw_filter else "disabled"}.\n')
+    
+    host_buffer_fill = CaptureStats.host_buffer_high_water / max(CaptureStats.host_buffer_size, 1)
+    print(f'Host buffer high water mark {CaptureStats.host_buffer_high_water} of '
+          f'{CaptureStats.host_buffer_size} bytes ({round(host_buffer_fill * 100, 1)}%).\n')
+    
+    if CaptureStats.host_buffer_abort:
+        print('Host buffer was nearly full, capture was stopped early since packets were about to be lost.\n')
+    
+    elif host_buffer_fill >= HOST_BUFFER_WARN:
+        print('Host buffer came close to overflowing, try the tuned capture or hardware filter settings.\n')
+    
+    return capture_path
 
 
 #=========================================================================
@@ -716,111 +1096,60 @@ def setup_digital_lines():
 #==========================================================================
 # LATENCY TESTING FUNCTIONS
 # =========================================================================
-# Find the trigger button details by comparing the data on and data off arrays
-def find_button(packet_data_off, data_off_matches, packet_data_on, data_on_matches):
-    button_change = []
-    
-    for i in range(len(data_off_matches)):
-        # Check to see if position is unchanged for both lists
-        if (data_off_matches[i]) and (data_on_matches[i]):
-            # Check if there is a difference between the lists
-            if packet_data_off[0][i] != packet_data_on[0][i]:
-                # Find where byte gets cleared out
-                if (packet_data_off[0][i] == '0') or (packet_data_on[0][i] == '0'):
-                    button_change.append(i)
+# Find the trigger button's mask by comparing the data on and data off packets
+def find_button(packet_data_off, packet_data_on):
+    if not (packet_data_off and packet_data_on):
+        raise TriggerError('No DATA packets answered the triggers, make sure trigger wire is connected to testing device')
+    
+    stability = BitStability(packet_data_off, packet_data_on)
+    button_change = derive_masks(stability)
+    constant, toggling, noisy = stability.counts()
+    print(f'\n{len(packet_data_off)} released and {len(packet_data_on)} pressed DATA packets, '
+          f'{constant} constant, {toggling} toggling and {noisy} noisy bits.')
     
     # Check for errors
-    # Sometimes more than one nibble changes during a trigger
+    # Sometimes more than one byte changes during a trigger
     if len(button_change) > 1:
-        print('Multiple triggered nibbles found')
-        print('Chose the correct triggered nibble position:\n')
+        print('Multiple triggered bytes found')
+        
+        if not INTERACTIVE:
+            raise TriggerError('Multiple triggered bytes found, enter the trigger button details instead.')
         
-        # List out all the possible trigger nibble choices
+        print('Chose the correct triggered byte:\n')
+        
+        # List out all the possible trigger byte choices
         for i in range(0, len(button_change)):
-            # Check if the DATA packets make sense
-            if packet_data_on[0][button_change[i]] >= packet_data_off[0][button_change[i]]:
-                print(f'{i+1} - 0x{packet_data_on[0][button_change[i]]} at position {button_change[i] + 1}')
-                data_front = ''.join(packet_data_on[0][:button_change[i]])
-                # Removed end of packet as it seems less readable
-                #data_end = ''.join(packet_data_on[0][button_change[i + 1]:])
-                print(f'Example: {data_front}<{packet_data_on[0][button_change[i]]}>\n')
-                
-            else:
-                print(f'{i+1} - 0x{packet_data_off[0][button_change[i]]} at position {button_change[i] + 1}')
-                data_front = ''.join(packet_data_off[0][:button_change[i]])
-                # Removed end of packet as it seems less readable
-                #data_end = ''.join(packet_data_off[0][button_change[i + 1]:])
-                print(f'Example: {data_front}<{packet_data_off[0][button_change[i]]}>\n')
+            print(f'{i+1} - {button_change[i]}')
+            print(f'Example: {packet_example(packet_data_on[0], button_change[i].offset)}\n')
             
         print('')
         choice = int(input('Enter Choice #'))
              
-        return int(button_change[choice - 1])
+        return button_change[choice - 1]
    
     elif len(button_change) == 0:
-        print('Unable to determine triggered button. Review raw collection and enter manually.')
-        
-        test_button()
+        raise TriggerError('Unable to determine triggered button. Review raw collection and enter manually.')
     
-    return int(button_change[0])
+    return button_change[0]
 
 
-# Create the data on and data off arrays for comparison
-def find_matches(packet_data_in):
-    import random
-    
-    packet_data = packet_data_in
-    data_test_list = []
-    test_tracker = []
-    
-    # Create a new shuffled list for comparing data points
-    shuffled_data = packet_data.copy()
-    random.shuffle(shuffled_data)
-
-    for i in range(0, len(packet_data[0])):
-        data_test_list.append(None)
-        test_tracker.append(False)
-
-    # Search for matches between the normal nibbles and shuffled to discover nibbles that do not change
-    for i in range(0, len(packet_data)):
-        for x in range(0, len(packet_data[i])):
-            # Check for mismatched data packets that were collected
-            if len(packet_data[i]) > len(shuffled_data[i]):
-                pass
-            
-            elif (i == 0) or (test_tracker[x]):
-                if packet_data[i][x] == shuffled_data[i][x]:
-                    data_test_list[x] = packet_data[i][x]
-                    test_tracker[x] = True
-    
-    return test_tracker
+# A DATA packet as hex with the byte at offset marked
+def packet_example(data, offset):
+    return f'{data[:offset].hex()}<{data[offset:offset + 1].hex()}>{data[offset + 1:].hex()}'
 
 
 # Filter through the packet collection to remove bad trigger and data packets
-def clean_data_packets(packets):
-    data_len = []
-    data_off_test = ''
-    data_on_test = ''
-    packet_data_off = []
-    packet_data_on = []
-    clean_input = []
-    first_run = True
-        
+def clean_data_packets(events, button=TestedDevice):
     # Figure out the correct length of data packets
-    if TestedDevice.trigger_length == 0:
+    if button.trigger_length == 0:
         # Find most common byte length for data packets
-        for i in packets:
-            split_packets = i.split(',')
-            packet_type = split_packets[2].strip()
-            
-            if packet_type.startswith('DATA'):
-                data_len.append(int(split_packets[1]))
+        device = DeviceFilter(*selected_device())
+        data_len = device.subscribe(ReportLengths()).lengths
+        run_pipeline(events, device)
         
         # Drop out if no DATA packets were collected
         if len(data_len) == 0:
-            print('No DATA packets found, make sure trigger wire is connected to testing device\n')
-            
-            test_button()
+            raise TriggerError('No DATA packets found, make sure trigger wire is connected to testing device')
         
         # Originally tried finding most common data length.
         # When plugged into an xbox console, there were a lot of bad packets
@@ -833,208 +1162,298 @@ def clean_data_packets(packets):
             print(f'1 - {trigger_choice_1} bytes')
             print(f'2 - {trigger_choice_2} bytes')
             print('')
-            choice = input('Enter Choice #')
+            choice = input('Enter Choice #') if INTERACTIVE else '2'
                     
             if choice == '1':
-                TestedDevice.trigger_length = trigger_choice_1
+                button.trigger_length = trigger_choice_1
             
             else:
-                TestedDevice.trigger_length = trigger_choice_2
+                button.trigger_length = trigger_choice_2
                 
         else:
-            TestedDevice.trigger_length = trigger_choice_1
+            button.trigger_length = trigger_choice_1
 
     # Clean up data packets that might swap during collection
-    for line in packets:
-        
-        split_line = line.split(',')
-        packet_type = split_line[2].strip()
-        
-        # First packet will always be trigger off
-        # Check previous packet to enure it makes sense
-        if packet_type == 'TRIGGER_OFF' and (data_on_test or first_run):
-            data_off_test = False
-            data_on_test = False
-            first_run = False
-            clean_input.append(f'{split_line[0]},{split_line[2]}')
-            
-        elif packet_type == 'TRIGGER_ON' and data_off_test:
-            data_off_test = False
-            data_on_test = False
-            clean_input.append(f'{split_line[0]},{split_line[2]}')
-            
-        # Watch for trigger packets with no matching data packet
-        elif packet_type.startswith('DATA') and (not first_run):
-            # Drop off data packets that are not the right length
-            byte_data = split_line[3].strip('\n').split(' ')[:-1]
-            # Save off data packet into a no whitespace string for nibble testing
-            byte_string = [i for i in split_line[3].replace(' ', '')]
-            
-            if TestedDevice.trigger_length == len(byte_data):
-                if clean_input[-1].split(',')[1] == 'TRIGGER_OFF':
-                    packet_data_off.append(byte_string)
-                    data_off_test = True
-                    data_on_test = False
-                    clean_input.append(f'{split_line[0]},{split_line[2]},{split_line[3]}')
-                    
-                elif clean_input[-1].split(',')[1] == 'TRIGGER_ON':
-                    packet_data_on.append(byte_string)
-                    data_off_test = False
-                    data_on_test = True
-                    clean_input.append(f'{split_line[0]},{split_line[2]},{split_line[3]}')
-        
-        # If misaligned packets are found, wait for the next trigger off and start collecting again
-        elif not first_run:
-            clean_input.pop()
-            clean_input.append(f'{split_line[0]},{split_line[2]}')
+    device = DeviceFilter(*selected_device())
+    calibration = device.subscribe(ButtonEdges(button.beagle_input)).subscribe(Calibration(button.trigger_length))
+    run_pipeline(events, device)
 
-    return packet_data_off, packet_data_on
+    return calibration.packet_data_off, calibration.packet_data_on
 
 
-# Function for handling all the automated trigger detail functions
-def find_trigger():
-    print('\nRunning 10 test triggers to find trigger button details...\n')
-            
-    packet_list = usb_dump(10)
+# The device answering the triggers is the one that sends a DATA packet right after most of them
+def select_responder(events):
+    counter = Responders()
+    run_pipeline(events, counter)
+    responders = counter.responders
     
-    packet_data_off, packet_data_on = clean_data_packets(packet_list)
+    if responders:
+        (address, endpoint), count = responders.most_common(1)[0]
+        
+        if address != NO_DEVICE:
+            TestedDevice.device_address = address
+            TestedDevice.endpoint = endpoint
+            print(f'Using DATA packets from device address {address} endpoint {endpoint}, '
+                  f'first response to {count} triggers.\n')
+
+
+# Function for handling all the automated trigger detail functions
+# Only the given button is pressed, its trigger details are filled in
+def find_trigger(button=TestedDevice):
+    import tempfile
     
-    data_off_matches = find_matches(packet_data_off)
-    data_on_matches = find_matches(packet_data_on)
+    print(f'\nRunning {CALIBRATION_TRIGGERS} test triggers to find trigger button details...\n')
     
-    # Add 1 to account for leading byte
-    TestedDevice.trigger_position = find_button(packet_data_off, data_off_matches, packet_data_on, data_on_matches) + 1
+    # Calibration captures are small, so they are only kept long enough to be read back
+    with tempfile.TemporaryDirectory() as capture_dir:
+        capture_path = usb_dump(CALIBRATION_TRIGGERS, f'{capture_dir}/raw_output.bin', inputs=[button.beagle_input])
+        # Decoded once, the responder, packet length and trigger details all come from these
+        events = list(capture_events(capture_path))
     
-    # Convert string to hex for comparison to figure out which data packets are on
-    data_off_trigger = hex(int(packet_data_off[0][TestedDevice.trigger_position - 1], 16))
-    data_on_trigger = hex(int(packet_data_on[0][TestedDevice.trigger_position - 1], 16))
+    select_responder(events)
+    packet_data_off, packet_data_on = clean_data_packets(events, button)
     
-    if data_on_trigger >= data_off_trigger:
-        nibble_value = packet_data_on[0][TestedDevice.trigger_position - 1]
-        data_front = ''.join(packet_data_on[0][:TestedDevice.trigger_position])
-        data_end = ''.join(packet_data_on[0][TestedDevice.trigger_position:])
-        print('\nTrigger found.')
-        print(f'Example: {data_front}<{packet_data_on[0][TestedDevice.trigger_position]}>{data_end}\n')
+    trigger_mask = find_button(packet_data_off, packet_data_on)
+    set_trigger_mask(button, trigger_mask)
     
+    print('\nTrigger found.')
+    print(f'Mask: {trigger_mask}')
+    print(f'Example: {packet_example(packet_data_on[0], trigger_mask.offset)}\n')
+
+
+# Trigger details of a button as kept in the calibration cache.  The device
+# address is left out since the host can give the device a new one any time.
+def button_calibration(button=TestedDevice):
+    return {'trigger_mask': mask_details(button),
+            'trigger_length': button.trigger_length,
+            'endpoint': TestedDevice.endpoint}
+
+
+def apply_calibration(calibration, button=TestedDevice):
+    # Calibrations saved before trigger masks have the nibble position and value
+    if 'trigger_mask' in calibration:
+        set_trigger_mask(button, mask_from_dict(calibration['trigger_mask']))
     else:
-        nibble_value = packet_data_off[0][TestedDevice.trigger_position - 1]
-        data_front = ''.join(packet_data_off[0][:TestedDevice.trigger_position - 1])
-        data_end = ''.join(packet_data_off[0][TestedDevice.trigger_position:])
-        print('\nTrigger found.')
-        print(f'Example: {data_front}<{packet_data_off[0][TestedDevice.trigger_position - 1]}>{data_end}\n')
+        set_trigger_mask(button, nibble_mask(calibration['trigger_position'], calibration['trigger_nibble']))
+    
+    button.trigger_length = calibration['trigger_length']
+    TestedDevice.device_address = ''
+    TestedDevice.endpoint = calibration['endpoint']
+
 
-    TestedDevice.trigger_nibble = nibble_value
+def calibration_cache_key(button=TestedDevice):
+    return calibration_key(TestedDevice.vendor_id, TestedDevice.product_id, TestedDevice.version, button.trigger_name)
+
+
+# Load the most recently saved calibration of the selected device as the trigger button
+def load_cached_calibration():
+    calibrations = device_calibrations(CALIBRATION_CACHE, TestedDevice.vendor_id, TestedDevice.product_id,
+                                       TestedDevice.version)
+    
+    if not calibrations:
+        return
+    
+    name, calibration = max(calibrations.items(), key=lambda item: item[1]['saved'])
+    TestedDevice.trigger_name = name
+    apply_calibration(calibration)
+    
+    print(f'\nLoaded cached trigger details for button {name}, saved {calibration["saved"]}.')
+    
+    if len(calibrations) > 1:
+        print(f'Other cached buttons - {", ".join(sorted(set(calibrations) - {name}))}')
+
+
+# Quick capture to check the button's trigger details still match the live packets
+def verify_trigger(button=TestedDevice):
+    import tempfile
+    
+    print(f'\nRunning {CALIBRATION_VERIFY_TRIGGERS} test triggers to check the cached trigger button details...\n')
+    
+    with tempfile.TemporaryDirectory() as capture_dir:
+        capture_path = usb_dump(CALIBRATION_VERIFY_TRIGGERS, f'{capture_dir}/raw_output.bin',
+                                inputs=[button.beagle_input])
+        events = list(capture_events(capture_path))
+    
+    select_responder(events)
+    clean_times = clean_capture(events, button)
+    
+    print(f'{len(clean_times)} clean times from {CALIBRATION_VERIFY_TRIGGERS} triggers.\n')
+    
+    return len(clean_times) >= CALIBRATION_VERIFY_TRIGGERS // 2
+
+
+# Use the cached trigger details of a button if they still match the device,
+# otherwise find them again and save them to the cache
+def calibrate(button=TestedDevice):
+    calibration = load_calibrations(CALIBRATION_CACHE).get(calibration_cache_key(button))
+    
+    if calibration is not None:
+        apply_calibration(calibration, button)
+        
+        if verify_trigger(button):
+            print(f'Cached trigger details for button {button.trigger_name} still match, skipping calibration.\n')
+            return
+        
+        print(f'Cached trigger details for button {button.trigger_name} no longer match, calibrating again.')
+        button.trigger_length = 0
+    
+    find_trigger(button)
+    save_calibration(CALIBRATION_CACHE, calibration_cache_key(button), button_calibration(button))
+
+
+# Subscribe the stages pairing each trigger edge of a button with the DATA
+# packet that answers it to device.  The kept lines are written to out_file
+# in the clean_output.txt form if one is given.  Returns the LatencyCleaner
+# stage, which emits a Response for each clean time.
+def button_stages(device, button=TestedDevice, out_file=None, scale=None):
+    cleaner = device.subscribe(ButtonEdges(button.beagle_input)).subscribe(
+        LatencyCleaner(button.trigger_mask, button.trigger_length))
+    
+    if out_file is not None:
+        cleaner.subscribe(CleanText(out_file, scale))
+    
+    return cleaner
+
+
+# Latencies in ticks of a button in already decoded events
+def clean_capture(events, button=TestedDevice):
+    device = DeviceFilter(*selected_device())
+    times = button_stages(device, button).subscribe(LatencyTimes())
+    run_pipeline(events, device)
+    
+    return times.times
+
+
+# Print the summary of a button's LatencyStats, and return it for the results
+# file.  None if there are fewer than two clean times.
+def latency_summary(stats):
+    summary = stats.summary()
+    
+    print(f'Results:')
+    
+    if summary is None:
+        print('\tNot enough clean times for a summary')
+        return None
+    
+    latency_min, latency_max, latency_avg, latency_stdev = summary
+    print(f'\tMin - {latency_min} ms')
+    print(f'\tMax - {latency_max} ms')
+    print(f'\tAvg - {latency_avg} ms')
+    print(f'\tStDev - {latency_stdev} ms')
+    
+    for q in SHOWN_QUANTILES:
+        print(f'\tp{q * 100:g} - {stats.quantile(q)} ms')
+    
+    return summary
 
 
 # Function for handling latency testing
-def latency_test(test_count):
-    from statistics import fmean, stdev
+# With a SequentialStop, test_count is the most triggers sent and the test stops
+# as soon as the latency is known well enough
+# With extra buttons each button gets test_count triggers in the same capture,
+# and is analyzed on its own from its digital input
+# Every button's LatencyStats are saved next to its clean_output file
+# Returns the results file and the trigger button's LatencyStats
+def latency_test(test_count, stop=None):
     import time
     
-    print(f'\nRunning {test_count} test triggers...\n')
+    buttons = tested_buttons()
+    
+    if len(buttons) > 1:
+        test_count *= len(buttons)
+        print(f'\nTesting {len(buttons)} buttons in turn.')
+    
+    if stop:
+        print(f'\nRunning up to {test_count} test triggers...\n')
+    else:
+        print(f'\nRunning {test_count} test triggers...\n')
+    
+    test_time = time.strftime("%H%M%S", time.localtime())
+    raw_capture = f'{output_dir}/{test_time}/raw_output.bin'
+    raw_output = f'{output_dir}/{test_time}/raw_output.txt'
+    
+    # Create directory if missing, packets are streamed here during the capture
+    os.makedirs(os.path.dirname(raw_capture), exist_ok=True)
+    
+    # Responses are paired during the capture for the sequential test and adaptive or closed loop triggers
+    latencies = multiprocessing.Queue() if ADAPTIVE_TRIGGERS and not CLOSED_LOOP_TRIGGERS else None
+    responded = multiprocessing.Event() if CLOSED_LOOP_TRIGGERS else None
+    
+    if stop or latencies or responded:
+        pairing = ResponsePairing(stop, latencies, responded)
+        stop_check = pairing.packet
+    else:
+        stop_check = None
     
     start = time.time()
-    packets = usb_dump(test_count)
+    usb_dump(test_count, raw_capture, stop_check, latencies, responded)
     end = time.time()
     
+    if stop:
+        if stop.done:
+            print(f'\nLatency is known well enough after {CaptureStats.triggers} triggers.\n')
+        else:
+            print(f'\nStopped at the {test_count} trigger cap before the latency was known well enough.\n')
+        
+        test_count = CaptureStats.triggers
+    
     print(f'Elapsed time to collect {test_count} packets - {round(end - start, 2)}s.\n')
     
-    test_time = time.strftime("%H%M%S", time.localtime())
-    raw_output = f'{output_dir}/{test_time}/raw_output.txt'
     print(f'\nSaving raw collection to {raw_output}\n')
     
-    # Create directory if missing
-    os.makedirs(os.path.dirname(raw_output), exist_ok=True)
+    # Times are kept as Beagle ticks until the results are shown
+    with CaptureReader(raw_capture) as reader:
+        scale = ns_per_tick(reader.samplerate_khz)
+        # With extra buttons the other inputs can be low too, so the levels are shown
+        named = not reader.metadata.get('extra_buttons')
     
-    # Export raw dump to csv with controller details for verification and debugging
-    with open(raw_output, 'w') as out_file:
-        for line in packets:
-            out_file.write(f'{line}\n')
-
     print('Cleaning collected packets, and analyzing...\n')
     
-    data_off_test = ''
-    data_on_test = ''
-    packet_data_off = []
-    packet_data_on = []
-    clean_input = []
-    first_run = True
-    time_keeper = []
-    trigger_position = int(TestedDevice.trigger_position) - 1
-    clean_times = []
-    
-    for line in packets:
-        
-        split_line = line.split(',')
-        line_time = int(split_line[0])
-        packet_type = split_line[2].strip()
-        
-        # Check previous packet to enure it makes sense
-        if packet_type == 'TRIGGER_OFF' and (data_on_test or first_run):
-            data_off_test = False
-            data_on_test = False
-            first_run = False
-            time_keeper.append(line_time)
-            clean_input.append(f'{split_line[0]},{split_line[2]}')
-            
-        elif packet_type == 'TRIGGER_ON' and data_off_test:
-            data_off_test = False
-            data_on_test = False
-            time_keeper.append(line_time)
-            clean_input.append(f'{split_line[0]},{split_line[2]}')
-            
-        # Watch for trigger packets with no matching data packet
-        elif packet_type.startswith('DATA') and (not first_run):
-            byte_data = split_line[3].strip('\n').split(' ')[:-1]
-            # Save off data packet into a no whitespace string for nibble testing
-            byte_string = [i for i in split_line[3].replace(' ', '')]
-            
-            # Drop off data packets that are not the right length
-            if TestedDevice.trigger_length == len(byte_data):
-                # Make sure we only collect valid packets and times
-                if ('0' == byte_string[trigger_position]) and clean_input[-1].split(',')[1] == 'TRIGGER_OFF':
-                    packet_data_off.append(byte_data)
-                    data_off_test = True
-                    data_on_test = False
-                    time_keeper.append(line_time)
-                    clean_input.append(f'{split_line[0]},{split_line[2]},{split_line[3]}')
-                
-                elif (TestedDevice.trigger_nibble == byte_string[trigger_position]) \
-                        and clean_input[-1].split(',')[1] == 'TRIGGER_ON':
-                    packet_data_on.append(byte_data)
-                    data_off_test = False
-                    data_on_test = True
-                    time_keeper.append(line_time)
-                    clean_input.append(f'{split_line[0]},{split_line[2]},{split_line[3]}')
-        
-        # If misaligned packets are found, wait for the next trigger off and start collecting again
-        elif not first_run:
-            time_keeper.pop()
-            time_keeper.append(line_time)
-            clean_input.pop()
-            clean_input.append(f'{split_line[0]},{split_line[2]}')
+    # The capture is read once, the raw collection, every button's cleaned
+    # collection and latencies, and the run index samples all come from the same events
+    clean_outputs = [f'{output_dir}/{test_time}/clean_output.txt']
+    clean_outputs += [f'{output_dir}/{test_time}/clean_output-input{button.beagle_input}.txt'
+                      for button in TestedDevice.extra_buttons]
+    stats_outputs = [f'{output_dir}/{test_time}/latency_stats.json']
+    stats_outputs += [f'{output_dir}/{test_time}/latency_stats-input{button.beagle_input}.json'
+                      for button in TestedDevice.extra_buttons]
+    out_files = [open(raw_output, 'w')] + [open(clean_output, 'w') for clean_output in clean_outputs]
+    
+    try:
+        device = DeviceFilter(*selected_device())
+        cleaners = [button_stages(device, button, out_file, scale) for button, out_file in zip(buttons, out_files[1:])]
+        summaries = [cleaner.subscribe(LatencySummary(scale)) for cleaner in cleaners]
+        logs = [cleaner.subscribe(ResponseLog()) for cleaner in cleaners] if RUN_INDEX else []
+        run_pipeline(capture_events(raw_capture), RawText(out_files[0], scale, named), device)
+    
+    finally:
+        for out_file in out_files:
+            out_file.close()
 
     print('Done.')
     
-    clean_output = f'{output_dir}/{test_time}/clean_output.txt'
-    print(f'\nSaving cleaned collection to {clean_output}\n')
+    for clean_output in clean_outputs:
+        print(f'\nSaving cleaned collection to {clean_output}\n')
+    
+    for stats_output, button_summary in zip(stats_outputs, summaries):
+        print(f'Saving latency statistics to {stats_output}\n')
+        button_summary.stats.save(stats_output)
     
-    with open(clean_output, 'w') as out_file:
-        for line in clean_input:
-            out_file.write(f'{line}\n')
+    stats = summaries[0].stats
     
-    if len(time_keeper) == 0:
+    if stats.count == 0:
         print('No clean triggers found.')
-
-    for i in range(0, len(time_keeper) - 1, 2):
-        clean_times.append(time_keeper[i + 1] - time_keeper[i])
-
-    print(f'\n{len(clean_times)} clean times collected, out of {test_count} triggers sent.\n')
-    print(f'Results:')
-    print(f'\tMin - {min(clean_times)/1000000} ms')
-    print(f'\tMax - {max(clean_times)/1000000} ms')
-    print(f'\tAvg - {fmean(clean_times)/1000000} ms')
-    print(f'\tStDev - {stdev(clean_times)/1000000} ms')
+    
+    print(f'\n{stats.count} clean times collected, out of {test_count} triggers sent.\n')
+    summary = latency_summary(stats)
+    
+    # Extra buttons are cleaned from their own digital input's edges in the same capture
+    extra_results = []
+    
+    for button, button_summary in zip(TestedDevice.extra_buttons, summaries[1:]):
+        print(f'\n{button_summary.stats.count} clean times collected for button {button.trigger_name} '
+              f'on digital input {button.beagle_input}.\n')
+        extra_results.append((button, button_summary.stats.count, latency_summary(button_summary.stats)))
     
     results = f'{output_dir}/{test_time}/results-{test_count}.txt'
     print(f'\nSaving results to {results}\n')
@@ -1045,79 +1464,532 @@ def latency_test(test_count):
         out_file.write(f'Product - {TestedDevice.product}\n')
         out_file.write(f'Version - {TestedDevice.version}\n')
         out_file.write(f'Serial - {TestedDevice.serial}\n')
+        
+        if TestedDevice.speed:
+            out_file.write(f'Speed - {TestedDevice.speed} Mbit/s\n')
+            out_file.write(f'Polling Interval - {polling_interval()}\n')
+        
         out_file.write(f'Trigger Button Position: {TestedDevice.trigger_position}\n')
         out_file.write(f'Trigger Button Value: {TestedDevice.trigger_nibble}\n')
+        out_file.write(f'Trigger Button Mask: {TestedDevice.trigger_mask}\n')
         out_file.write(f'Trigger Button Packet Length: {TestedDevice.trigger_length}\n')
         out_file.write(f'Trigger Button Name: {TestedDevice.trigger_name}\n')
+        out_file.write(f'Device Address: {TestedDevice.device_address}\n')
+        out_file.write(f'Endpoint: {TestedDevice.endpoint}\n')
         out_file.write('\n')
         out_file.write(f'Triggers sent - {test_count} \n')
+        out_file.write(f'Trigger Seed - {CaptureStats.seed}\n')
+        
+        if REPLAY_SCHEDULE:
+            out_file.write(f'Trigger Schedule - replayed from {REPLAY_SCHEDULE}\n')
+        
+        if stop:
+            out_file.write(f'Sequential Test - stop at +/- {stop.mean_bound} ms average')
+            
+            if stop.quantile_bound is not None:
+                out_file.write(f', +/- {stop.quantile_bound} ms 99th percentile')
+            
+            out_file.write(f', {"bounds met" if stop.done else "trigger cap hit"}\n')
+        
+        if CLOSED_LOOP_TRIGGERS:
+            spacing = 'Closed Loop'
+        elif ADAPTIVE_TRIGGERS:
+            spacing = 'Adaptive'
+        else:
+            spacing = 'Fixed'
+        
+        out_file.write(f'Trigger Spacing - {spacing}, '
+                       f'{round(test_count / (end - start) * 3600)} triggers/hour\n')
+        
+        out_file.write(f'Hardware Filter - {"Enabled" if CaptureStats.hw_filter else "Disabled"}\n')
+        out_file.write(f'Host Packet Rate - {round(CaptureStats.packet_rate)} packets/s\n')
+        out_file.write(f'Host Buffer Size - {CaptureStats.host_buffer_size} bytes\n')
+        out_file.write(f'Host Buffer High Water Mark - {CaptureStats.host_buffer_high_water} bytes\n')
+        
+        if CaptureStats.host_buffer_abort:
+            out_file.write('Host Buffer Overflow - capture stopped early\n')
+        
         out_file.write('\n')
-        out_file.write('Results:\n')
-        out_file.write(f'\tMinimum - {min(clean_times)/1000000} ms\n')
-        out_file.write(f'\tMaximum - {max(clean_times)/1000000} ms\n')
-        out_file.write(f'\tAverage - {fmean(clean_times)/1000000} ms\n')
-        out_file.write(f'\tSample Standard Deviation - {stdev(clean_times)/1000000} ms\n')
+        write_latency_summary(out_file, summary)
+        
+        for button, clean_count, button_summary in extra_results:
+            out_file.write('\n')
+            out_file.write(f'Extra Button - {button.trigger_name} (digital input {button.beagle_input})\n')
+            out_file.write(f'Trigger Button Position: {button.trigger_position}\n')
+            out_file.write(f'Trigger Button Value: {button.trigger_nibble}\n')
+            out_file.write(f'Trigger Button Mask: {button.trigger_mask}\n')
+            out_file.write(f'Trigger Button Packet Length: {button.trigger_length}\n')
+            out_file.write(f'Clean Times - {clean_count}\n')
+            write_latency_summary(out_file, button_summary)
+    
+    if RUN_INDEX:
+        index_run_dir(os.path.dirname(results), [log.responses for log in logs])
+    
+    return results, stats
 
 
-# Function for pulling the Raspberry Pi pins during latency tests and automatic button search
-def trigger_on():
+# Add a saved run and each button's responses to RUN_INDEX.  The run is
+# already saved, so a problem with the index is only reported, and
+# run_index.py can add it later.
+def index_run_dir(run_dir, responses):
+    try:
+        add_run(RUN_INDEX, run_dir, responses)
+    except (sqlite3.Error, OSError, ValueError, KeyError, IndexError) as error:
+        print(f'Could not add the run to {RUN_INDEX} - {error}\n')
+
+
+# Analyzers connected to the Pi as (port, unique id), leaving out any another program has open
+def find_analyzers():
+    (num_devices, ports, unique_ids) = bg_find_devices_ext(16, 16)
+    analyzers = []
     
-    import pigpio
+    for port, unique_id in zip(ports, unique_ids):
+        if port & BG_PORT_NOT_FREE:
+            print(f'Beagle on port {port & ~BG_PORT_NOT_FREE} ({unique_id}) is in use, skipping it.')
+            continue
+        
+        analyzers.append((port, unique_id))
+    
+    return analyzers
+
 
-    from random import randrange
+# Runs a latency test on one analyzer of a rig, in its own process.  Every
+# worker has its own Beagle handle, pins and output directory, and puts
+# (port, unique id, results file, LatencyStats) on the results queue.
+def rig_worker(port, unique_id, pins, test_count, rig_dir, results):
+    global BEAGLE_PORT, BUTTON_PINS, HARDWARE_TIMED_TRIGGERS, output_dir
     
-    # GPIO on the Raspberry Pi
-    first_pin = 20
-    second_pin = 21
+    BEAGLE_PORT = port
+    BUTTON_PINS = pins
+    output_dir = f'{rig_dir}/{unique_id}'
     
-    # See documentation for why these values were chosen
-    min_delay = 400
-    max_delay = 1000
+    # Every worker shares the one pigpio daemon, which plays a single wave at
+    # a time and clears all of them between captures, so each edge is timed here
+    HARDWARE_TIMED_TRIGGERS = False
+    
+    # Devices on other analyzers can have any address, so DATA packets from any device are used
+    TestedDevice.device_address = ''
+    TestedDevice.endpoint = ''
+    TestedDevice.extra_buttons = [button for button in TestedDevice.extra_buttons if button.beagle_input in pins]
+    
+    print(f'\nStarting latency test on Beagle port {port} ({unique_id}), output in {output_dir}\n')
+    
+    results_file, stats = latency_test(test_count)
+    results.put((port, unique_id, results_file, stats))
+
+
+# Runs the same latency test on every analyzer connected to the Pi at once,
+# one device per analyzer, then merges the results into rig_summary.txt and
+# every analyzer's LatencyStats into the rig's latency_stats.json
+def rig_test(test_count):
+    import queue
+    
+    analyzers = find_analyzers()
+    
+    if not analyzers:
+        print('\nNo Beagle analyzers found.\n')
+        return
+    
+    if len(analyzers) > len(RIG_BUTTON_PINS):
+        print(f'\nOnly {len(RIG_BUTTON_PINS)} pin maps in RIG_BUTTON_PINS, '
+              f'the other {len(analyzers) - len(RIG_BUTTON_PINS)} analyzers are not used.')
+        analyzers = analyzers[:len(RIG_BUTTON_PINS)]
+    
+    rig_dir = f'{output_dir}/rig-{time.strftime("%H%M%S", time.localtime())}'
+    results = multiprocessing.Queue()
+    
+    if HARDWARE_TIMED_TRIGGERS:
+        print('\nHardware timed triggers cannot be shared between analyzers, Rig Tests time each edge in software.')
+    workers = []
+    
+    print(f'\nRunning {test_count} test triggers on {len(analyzers)} analyzers...\n')
+    
+    for (port, unique_id), pins in zip(analyzers, RIG_BUTTON_PINS):
+        worker = multiprocessing.Process(target=rig_worker, args=(port, unique_id, pins, test_count, rig_dir, results))
+        worker.start()
+        workers.append(worker)
+    
+    # Results are read while the workers run, so none of them blocks on a full queue
+    rig_results = []
+    
+    while any(worker.is_alive() for worker in workers) or not results.empty():
+        try:
+            rig_results.append(results.get(timeout=POLL_TIMEOUT))
+        except queue.Empty:
+            pass
+    
+    for worker in workers:
+        worker.join()
+    
+    if not rig_results:
+        print('\nNo analyzer finished its latency test.\n')
+        return
+    
+    rig_results.sort()
+    summary = f'{rig_dir}/rig_summary.txt'
+    print(f'\nSaving rig summary to {summary}\n')
+    
+    with open(summary, 'w') as out_file:
+        out_file.write(f'Device ID - {TestedDevice.vendor_id}:{TestedDevice.product_id}\n')
+        out_file.write(f'Product - {TestedDevice.product}\n')
+        out_file.write(f'Trigger Button Name: {TestedDevice.trigger_name}\n')
+        out_file.write(f'Triggers sent per analyzer - {test_count}\n')
+        out_file.write('\n')
+        out_file.write('port,unique_id,clean_times,min_ms,max_ms,avg_ms,stdev_ms,results\n')
+        
+        all_stats = LatencyStats()
+        
+        for port, unique_id, results_file, stats in rig_results:
+            all_stats.merge(stats)
+            # An analyzer with too few clean times leaves its statistics blank
+            summary = stats.summary() or ('', '', '', '')
+            out_file.write(f'{port},{unique_id},{stats.count},{",".join(str(value) for value in summary)},'
+                           f'{results_file}\n')
+        
+        out_file.write('\n')
+        out_file.write(f'Analyzers - {len(rig_results)} of {len(analyzers)} finished\n')
+        out_file.write(f'All analyzers - {all_stats.count} clean times\n')
+        write_latency_summary(out_file, all_stats.summary())
+    
+    all_stats.save(f'{rig_dir}/latency_stats.json')
+    
+    for port, unique_id, results_file, stats in rig_results:
+        if stats.count:
+            print(f'Port {port} ({unique_id}) - {stats.count} clean times, average {stats.average()} ms')
+        else:
+            print(f'Port {port} ({unique_id}) - no clean times')
+
+
+# Function for pulling the Raspberry Pi pins during latency tests and automatic button search
+# If a latencies queue is given the edges are spaced by what the device's response times allow.
+# If a responded event is given each edge waits for the device to answer the previous one.
+# Otherwise the delays (microseconds) from a schedule are used in order, then random ones.
+# The random delays all come from seed.
+# The buttons on the given Beagle digital inputs are pressed and released in turn.
+def trigger_on(latencies=None, responded=None, delays=None, seed=None, inputs=(1,)):
+    
+    import queue
+    
+    pigpio = import_pigpio()
+    rng = random.Random(seed)
+    randrange = rng.randrange
+    delays = iter(delays or [])
+    
+    min_delay = TRIGGER_MIN_DELAY
+    max_delay = TRIGGER_MAX_DELAY
 
     pi = pigpio.pi()
     
-    # Change pins as needed for your testing setup
-    pi.set_mode(first_pin, pigpio.OUTPUT)
-    pi.set_mode(second_pin, pigpio.OUTPUT)
+    # GPIO on the Raspberry Pi, see BUTTON_PINS
+    for beagle_input in inputs:
+        for pin in BUTTON_PINS[beagle_input]:
+            pi.set_mode(pin, pigpio.OUTPUT)
+
+    if latencies is not None:
+        spacing = AdaptiveSpacing(min_delay, max_delay, ADAPTIVE_SAMPLES, ADAPTIVE_MULTIPLE, ADAPTIVE_FLOOR_MS,
+                                  ADAPTIVE_JITTER_POLLS, rng=rng)
+    
+    # Picks up the response times seen so far, then the delay before the next edge
+    def next_delay():
+        if responded is not None:
+            # Wait for the answer to the last edge, then let the device settle
+            responded.wait(CLOSED_LOOP_TIMEOUT_MS / 1000)
+            return randrange(*CLOSED_LOOP_SETTLE_MS)
+        
+        if latencies is None:
+            delay = next(delays, None)
+            
+            if delay is not None:
+                return delay / 1000
+            
+            return randrange(min_delay, max_delay)
+        
+        try:
+            while True:
+                spacing.add(latencies.get_nowait())
+        except queue.Empty:
+            pass
+        
+        return spacing.delay()
+
+    # Only an answer to the edge about to fire counts, not a late one to an earlier edge
+    def edge_ready():
+        if responded is not None:
+            responded.clear()
 
+    edge = 0
+    
     while True:
-        test = randrange(min_delay, max_delay)
+        test = next_delay()
         time.sleep(test / 1000)
-        pi.set_bank_1((1 << first_pin) | (1 << second_pin))
+        edge_ready()
+        pi.set_bank_1(edge_bits(edge, inputs))
         
-        test = randrange(min_delay, max_delay)
+        test = next_delay()
         time.sleep(test / 1000)
-        pi.clear_bank_1((1 << first_pin) | (1 << second_pin))
+        edge_ready()
+        pi.clear_bank_1(edge_bits(edge + 1, inputs))
+        
+        edge += 2
+        
+        
+# Plays a pre-generated schedule of edge delays (microseconds) as pigpio waves, so
+# the DMA hardware times every edge.  Each wave is queued behind the one playing,
+# and deleted once it has finished, so any number of edges fit in the daemon's
+# pulse memory.  Falls back to trigger_on() if the capture outlasts the schedule.
+def trigger_waves(delays, seed=None, inputs=(1,)):
+    
+    pigpio = import_pigpio()
+
+    pi = pigpio.pi()
+    
+    # GPIO on the Raspberry Pi, see BUTTON_PINS
+    for beagle_input in inputs:
+        for pin in BUTTON_PINS[beagle_input]:
+            pi.set_mode(pin, pigpio.OUTPUT)
+    
+    pi.wave_clear()
+    
+    # A pulse changes the pins then waits, so each edge goes with the delay before the next one
+    pulses = [pigpio.pulse(0, 0, delays[0])]
+    
+    for edge in range(len(delays)):
+        next_delay = delays[edge + 1] if edge + 1 < len(delays) else 0
+        pins = edge_bits(edge, inputs)
+        
+        if edge_level(edge) == LEVEL_OFF:
+            pulses.append(pigpio.pulse(pins, 0, next_delay))
+        else:
+            pulses.append(pigpio.pulse(0, pins, next_delay))
+    
+    playing = None
+    
+    for start in range(0, len(pulses), WAVE_EDGES):
+        pi.wave_add_generic(pulses[start:start + WAVE_EDGES])
+        wave = pi.wave_create()
         
+        # Only one wave can wait behind the playing one, so wait for the last one sent to start
+        while playing is not None and pi.wave_tx_busy() and pi.wave_tx_at() != playing[-1]:
+            time.sleep(POLL_TIMEOUT)
         
+        pi.wave_send_using_mode(wave, pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+        
+        # Waves before the one playing are done with
+        if playing is not None:
+            for finished in playing[:-1]:
+                pi.wave_delete(finished)
+            playing = [playing[-1], wave]
+        else:
+            playing = [wave]
+    
+    while pi.wave_tx_busy():
+        time.sleep(POLL_TIMEOUT)
+    
+    pi.wave_clear()
+    trigger_on(seed=seed, inputs=inputs)
+
+
+# Stop any trigger waves still playing in the pigpio daemon
+def stop_waves():
+    pigpio = import_pigpio()
+    
+    pi = pigpio.pi()
+    pi.wave_tx_stop()
+    pi.wave_clear()
+
+
+# pigpio, or the local stand-in when FAKE_PIGPIO is set
+def import_pigpio():
+    if FAKE_PIGPIO:
+        import fake_pigpio as pigpio
+    else:
+        import pigpio
+    
+    return pigpio
+
+
 # Function for pulling the Raspberry Pi pins as needed
-def trigger_adjust(trigger_set):
+# Every button being tested is pulled unless inputs are given
+def trigger_adjust(trigger_set, inputs=None):
     
     import inspect
-    import pigpio
     
-    # GPIO on the Raspberry Pi
-    first_pin = 20
-    second_pin = 21
+    pigpio = import_pigpio()
+    
+    if inputs is None:
+        inputs = active_inputs()
+    
+    # GPIO on the Raspberry Pi, see BUTTON_PINS
+    pins = [pin for beagle_input in inputs for pin in BUTTON_PINS[beagle_input]]
+    pin_names = f'{", ".join(str(pin) for pin in pins[:-1])} and {pins[-1]}'
 
     pi = pigpio.pi()
     
-    # Change pins as needed for your testing setup
-    pi.set_mode(first_pin, pigpio.OUTPUT)
-    pi.set_mode(second_pin, pigpio.OUTPUT)
+    for pin in pins:
+        pi.set_mode(pin, pigpio.OUTPUT)
     
     # Pull pins high/low as requested
     if trigger_set:
-        pi.set_bank_1((1 << first_pin) | (1 << second_pin))
+        pi.set_bank_1(input_bits(inputs))
         
         if 'usb_dump' not in inspect.stack()[1][3]:
-            print(f'\nPins {first_pin} and {second_pin} set High/Off.')
+            print(f'\nPins {pin_names} set High/Off.')
             
     else:
-        pi.clear_bank_1((1 << first_pin) | (1 << second_pin))
+        pi.clear_bank_1(input_bits(inputs))
         
         if 'usb_dump' not in inspect.stack()[1][3]:
-            print(f'\nPins {first_pin} and {second_pin} set Low/On.')
+            print(f'\nPins {pin_names} set Low/On.')
+
+
+#=========================================================================
+# JOB FUNCTIONS
+# ========================================================================
+# Set up TestedDevice and the buttons for a job, then find the trigger
+# details of any button the job does not give them for
+def load_job_buttons(job):
+    device = job.get('device', {})
+    
+    for field in JOB_DEVICE_FIELDS:
+        setattr(TestedDevice, field, device.get(field, ''))
+    
+    # Speed and polling intervals of the connected device with the same ID, if there is one
+    TestedDevice.speed = ''
+    TestedDevice.endpoint_intervals = {}
+    
+    for usb_device in list_devices(USB_SYSFS_ROOT) if os.path.isdir(USB_SYSFS_ROOT) else []:
+        if (usb_device.vendor_id, usb_device.product_id) == (TestedDevice.vendor_id, TestedDevice.product_id):
+            TestedDevice.speed = usb_device.speed
+            TestedDevice.endpoint_intervals = usb_device.interrupt_intervals()
+            break
+    
+    if not job.get('buttons'):
+        raise ValueError('Job has no buttons')
+    
+    TestedDevice.extra_buttons = []
+    
+    for index, details in enumerate(job['buttons']):
+        button = TestedDevice if index == 0 else TriggerButton()
+        button.trigger_name = details.get('name', '')
+        button.beagle_input = details.get('input', index + 1)
+        button.trigger_length = details.get('length', 0)
+        
+        # Buttons give a mask, or the nibble position and value, or neither to be calibrated
+        if 'mask' in details:
+            set_trigger_mask(button, mask_from_dict(details['mask']))
+        elif 'position' in details:
+            set_trigger_mask(button, nibble_mask(details['position'], str(details['value'])))
+        else:
+            set_trigger_mask(button, None)
+        
+        # Calibration finds the packet length along with the mask, given trigger details need it too
+        if button.trigger_mask is not None and not button.trigger_length:
+            raise ValueError(f'Button {button.trigger_name} gives its trigger details without a packet length')
+        
+        if button.beagle_input not in BUTTON_PINS:
+            raise ValueError(f'Button {button.trigger_name} is on digital input {button.beagle_input}, '
+                             f'which has no pins in BUTTON_PINS')
+        
+        if index > 0:
+            TestedDevice.extra_buttons.append(button)
+    
+    # Every button is set up first so all the digital inputs are enabled while calibrating
+    for button in tested_buttons():
+        if button.trigger_mask is None:
+            calibrate(button)
+
+
+# Run one job from a job file, with the job file's settings as defaults.
+# Returns the job's status details
+def run_job(job, name, base_dir, defaults):
+    global output_dir
+    
+    settings = {**defaults, **job.get('settings', {})}
+    unknown = [key for key in settings if key not in JOB_SETTINGS]
+    
+    if unknown:
+        raise ValueError(f'Unknown settings {", ".join(unknown)}')
+    
+    # The job's output directory is put back along with its settings
+    saved = {name: globals()[name] for name in (*JOB_SETTINGS.values(), 'output_dir')}
+    
+    try:
+        for key, value in settings.items():
+            globals()[JOB_SETTINGS[key]] = value
+        
+        load_job_buttons(job)
+        
+        device_dir = f'{TestedDevice.vendor_id}{TestedDevice.product_id}' if TestedDevice.vendor_id else 'UNKNOWN'
+        output_dir = job.get('output_dir', f'{base_dir}/{device_dir}/{current_datetime}/{name}')
+        
+        if 'sequential' in job:
+            sequential = job['sequential']
+            stop = SequentialStop(sequential.get('mean_ms', SEQUENTIAL_MEAN_MS),
+                                  sequential.get('p99_ms', SEQUENTIAL_P99_MS))
+            results, stats = latency_test(sequential.get('max_triggers', SEQUENTIAL_MAX_TRIGGERS), stop)
+        else:
+            results, stats = latency_test(job.get('tests', JOB_TESTS))
+        
+    finally:
+        globals().update(saved)
+    
+    return {'results': results,
+            'triggers': CaptureStats.triggers,
+            'seed': CaptureStats.seed,
+            'clean_times': stats.count,
+            'average_ms': stats.average(),
+            'trigger_position': TestedDevice.trigger_position,
+            'trigger_value': TestedDevice.trigger_nibble,
+            'trigger_mask': mask_details(TestedDevice),
+            'trigger_length': TestedDevice.trigger_length}
+
+
+# Run every job in a job file back to back without the menu.  A job that
+# fails is recorded in the status file and the next one is started.
+# Returns 0 if every job finished, 1 otherwise.
+def run_jobs(path):
+    global INTERACTIVE
+    
+    INTERACTIVE = False
+    
+    with open(path) as job_file:
+        job_list = json.load(job_file)
+    
+    base_dir = job_list.get('output_dir', os.getcwd())
+    status_path = job_list.get('status_file', f'{base_dir}/job_status.json')
+    jobs = job_list['jobs']
+    
+    os.makedirs(os.path.dirname(os.path.abspath(status_path)), exist_ok=True)
+    
+    statuses = [{'name': job.get('name', f'job{i + 1}'), 'state': 'pending'} for i, job in enumerate(jobs)]
+    save_json(status_path, statuses)
+    
+    for i, (job, status) in enumerate(zip(jobs, statuses), start=1):
+        print(f'\n\n===== Job {i} of {len(jobs)} - {status["name"]} =====\n')
+        
+        status['state'] = 'running'
+        status['started'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime())
+        save_json(status_path, statuses)
+        
+        try:
+            status.update(run_job(job, status['name'], base_dir, job_list.get('settings', {})))
+            status['state'] = 'done'
+            
+        except (Exception, SystemExit) as error:
+            print(f'\nJob {status["name"]} failed: {error!r}\n')
+            status['state'] = 'failed'
+            status['error'] = repr(error)
+        
+        status['finished'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime())
+        save_json(status_path, statuses)
+    
+    failed = [status['name'] for status in statuses if status['state'] != 'done']
+    print(f'\n{len(jobs) - len(failed)} of {len(jobs)} jobs finished, status saved to {status_path}\n')
+    
+    if failed:
+        print(f'Failed jobs - {", ".join(failed)}\n')
+    
+    return 1 if failed else 0
 
 
 #=========================================================================
@@ -1125,8 +1997,6 @@ def trigger_adjust(trigger_set):
 # ========================================================================
 # Gather the basic tested device information
 def device_info():
-    import subprocess
-        
     while True:
         print('\n\n==========================')
         print('-----Device Info Menu-----')
@@ -1136,10 +2006,14 @@ def device_info():
         print(f'Product - {TestedDevice.product}')
         print(f'Version - {TestedDevice.version}')
         print(f'Serial - {TestedDevice.serial}')
-        #print('Polling Interval - [display polling interval]')
+        
+        if TestedDevice.speed:
+            print(f'Speed - {TestedDevice.speed} Mbit/s')
+            print(f'Polling Interval - {polling_interval()}')
+        
         print('')
         print('1 - Manually Enter USB Details')
-        print('2 - Pull USB details with lsusb')
+        print('2 - Pull USB details from sysfs')
         print('3 - Return to Main Menu')
         print('==========================')
         print('')
@@ -1152,42 +2026,35 @@ def device_info():
             TestedDevice.product = input('Enter Product: ')
             TestedDevice.version = input('Enter Version: ')
             TestedDevice.serial = input('Enter Serial: ')
+            TestedDevice.speed = ''
+            TestedDevice.endpoint_intervals = {}
+            
+            load_cached_calibration()
             
         elif choice == '2':
-            lsusb_out = subprocess.run('lsusb', capture_output=True)
-            usb_list = str(lsusb_out.stdout)[2:-1].split('\\n')[:-1]
+            usb_list = list_devices(USB_SYSFS_ROOT)
 
-            for counter, i in enumerate(usb_list, start=1):
-                print(counter, '-', i)
+            for counter, device in enumerate(usb_list, start=1):
+                print(counter, '-', device.summary())
 
             usb_choice = input('\nChoose USB device: ')
 
-            usb_split = usb_list[int(usb_choice)-1].split(" ")
-
-            TestedDevice.vendor_id = usb_split[5].split(':')[0]
-            TestedDevice.product_id = usb_split[5].split(':')[1]
+            device = usb_list[int(usb_choice)-1]
 
-            usb_busdev = f'{usb_split[1]}:{usb_split[3][:-1]}'
-            usb_query = f'lsusb -s {usb_busdev} -v'
-            
-            lsusb_out = subprocess.run(usb_query, shell=True, capture_output=True)
-            usb_details = str(lsusb_out.stdout)[2:-1].split('\\n')[:-1]
+            TestedDevice.vendor_id = device.vendor_id
+            TestedDevice.product_id = device.product_id
+            TestedDevice.version = device.version
+            TestedDevice.manufacturer = device.manufacturer
+            TestedDevice.product = device.product
+            TestedDevice.serial = device.serial
+            TestedDevice.speed = device.speed
+            TestedDevice.endpoint_intervals = device.interrupt_intervals()
             
-            for i in usb_details:
-                line = i.split()
-                
-                if 'bcdDevice' in line:
-                    TestedDevice.version = ' '.join(line[1:])
-                elif 'iManufacturer' in line:
-                    TestedDevice.manufacturer = ' '.join(line[2:])
-                elif 'iProduct' in line:
-                    TestedDevice.product = ' '.join(line[2:])
-                elif 'iSerial' in line:
-                    TestedDevice.serial = ' '.join(line[2:])
+            load_cached_calibration()
         
         else:
             print('\n\n')
-            main_menu()
+            return
             
             
 # Change the location for outputting the raw collection, clean collection, and testing results
@@ -1210,7 +2077,67 @@ def output_settings():
             output_dir = input('Enter Output Directory: ')
         
         elif choice == '2':
-            main_menu()
+            return
+            
+
+# Change how packets are captured from the Beagle
+def capture_settings():
+    global RING_BUFFER_CAPTURE, HW_FILTER_PROFILE, TUNED_CAPTURE, ADAPTIVE_TRIGGERS, CLOSED_LOOP_TRIGGERS, \
+        HARDWARE_TIMED_TRIGGERS, TRIGGER_SEED, REPLAY_SCHEDULE
+    
+    while True:
+        print('\n\n===============================')
+        print('-----Capture Settings Menu-----')
+        print('===============================')
+        print(f'Ring Buffer Capture - {"Enabled" if RING_BUFFER_CAPTURE else "Disabled"}')
+        print(f'Hardware Filter - {"Enabled" if HW_FILTER_PROFILE else "Disabled"}')
+        print(f'Tuned Capture - {"Enabled" if TUNED_CAPTURE else "Disabled"}')
+        print(f'Adaptive Triggers - {"Enabled" if ADAPTIVE_TRIGGERS else "Disabled"}')
+        print(f'Closed Loop Triggers - {"Enabled" if CLOSED_LOOP_TRIGGERS else "Disabled"}')
+        print(f'Hardware Timed Triggers - {"Enabled" if HARDWARE_TIMED_TRIGGERS else "Disabled"}')
+        print(f'Trigger Seed - {"New every capture" if TRIGGER_SEED is None else TRIGGER_SEED}')
+        print(f'Replay Trigger Schedule - {REPLAY_SCHEDULE or "Disabled"}')
+        print('')
+        print('1 - Toggle Ring Buffer Capture')
+        print('2 - Toggle Hardware Filter')
+        print('3 - Toggle Tuned Capture')
+        print('4 - Toggle Adaptive Triggers')
+        print('5 - Toggle Closed Loop Triggers')
+        print('6 - Toggle Hardware Timed Triggers')
+        print('7 - Set Trigger Seed')
+        print('8 - Set Replay Trigger Schedule')
+        print('9 - Main Menu')
+        print('===============================')
+        print('')
+        choice = input('Enter Choice #')
+        
+        if choice == '1':
+            RING_BUFFER_CAPTURE = not RING_BUFFER_CAPTURE
+        
+        elif choice == '2':
+            HW_FILTER_PROFILE = not HW_FILTER_PROFILE
+        
+        elif choice == '3':
+            TUNED_CAPTURE = not TUNED_CAPTURE
+        
+        elif choice == '4':
+            ADAPTIVE_TRIGGERS = not ADAPTIVE_TRIGGERS
+        
+        elif choice == '5':
+            CLOSED_LOOP_TRIGGERS = not CLOSED_LOOP_TRIGGERS
+        
+        elif choice == '6':
+            HARDWARE_TIMED_TRIGGERS = not HARDWARE_TIMED_TRIGGERS
+        
+        elif choice == '7':
+            seed = input('Enter Trigger Seed (blank for a new one every capture): ')
+            TRIGGER_SEED = int(seed) if seed else None
+        
+        elif choice == '8':
+            REPLAY_SCHEDULE = input('Enter trigger_schedule.csv Path (blank to generate new schedules): ')
+        
+        elif choice == '9':
+            return
             
 
 # Function for gathering all the trigger button details, other functions to be added later
@@ -1226,30 +2153,44 @@ def test_button():
         print(f'Serial - {TestedDevice.serial}')
         print(f'Trigger Button Position: {TestedDevice.trigger_position}')
         print(f'Trigger Button Value: {TestedDevice.trigger_nibble}')
+        print(f'Trigger Button Mask: {TestedDevice.trigger_mask or ""}')
         print(f'Trigger Button Packet Length: {TestedDevice.trigger_length}')
         print(f'Trigger Button Name: {TestedDevice.trigger_name}')
+        print(f'Device Address: {TestedDevice.device_address}')
+        print(f'Endpoint: {TestedDevice.endpoint}')
+        
+        for button in TestedDevice.extra_buttons:
+            print(f'Extra Button: {button.trigger_name} on digital input {button.beagle_input}, '
+                  f'{button.trigger_mask}, length {button.trigger_length}')
+        
         print('')
         print('1 - Manually Enter Trigger Button Details')
         print('2 - Automatically Find Trigger Button Details')
         print('3 - Pull Trigger Button High/Off')
         print('4 - Pull Trigger Button Low/On')
-        print('5 - Return to Main Menu')
+        print('5 - Add Extra Button')
+        print('6 - Clear Extra Buttons')
+        print('7 - Return to Main Menu')
         #print('X - Pulse Trigger Button')
         print('==========================')
         print('')
         choice = input('Enter Choice #')
         
         if choice == '1':
-            TestedDevice.trigger_position = input('Enter Trigger Button Position (count from 1 by nibbles): ')
-            TestedDevice.trigger_nibble = input('Enter Trigger Button Value (0x): ')
+            enter_trigger_mask(TestedDevice)
             TestedDevice.trigger_length = int(input('Enter Trigger Button Packet Length (count from 1): '))
             TestedDevice.trigger_name = input('Enter Trigger Button Name (eg., A, B, X,...): ')
+            TestedDevice.device_address = input('Enter Device Address (blank for any): ')
+            TestedDevice.endpoint = input('Enter Endpoint (blank for any): ')
             
         elif choice == '2':
             if not TestedDevice.trigger_name:
                 TestedDevice.trigger_name = input('Enter Trigger Button Name (eg., A, B, X,...): ')
             
-            find_trigger()
+            try:
+                calibrate()
+            except TriggerError as error:
+                print(f'{error}\n')
             
         elif choice == '3':
             trigger_adjust(True)
@@ -1258,8 +2199,40 @@ def test_button():
             trigger_adjust(False)
             
         elif choice == '5':
+            free_inputs = [beagle_input for beagle_input in BUTTON_PINS if beagle_input not in active_inputs()]
+            
+            if not free_inputs:
+                print('\nEvery digital input already has a button.')
+                continue
+            
+            beagle_input = int(input(f'Enter Digital Input ({", ".join(str(i) for i in free_inputs)}): '))
+            
+            if beagle_input not in free_inputs:
+                print(f'\nDigital input {beagle_input} is not free.')
+                continue
+            
+            pins = BUTTON_PINS[beagle_input]
+            print(f'Connect pin {pins[0]} to the button and pin {pins[1]} to INT{beagle_input}.')
+            
+            button = TriggerButton(input('Enter Trigger Button Name (eg., A, B, X,...): '), beagle_input)
+            TestedDevice.extra_buttons.append(button)
+            
+            if input('Automatically find details? (y/n): ') == 'y':
+                try:
+                    calibrate(button)
+                except TriggerError as error:
+                    print(f'{error}\n')
+                    TestedDevice.extra_buttons.remove(button)
+            else:
+                enter_trigger_mask(button)
+                button.trigger_length = int(input('Enter Trigger Button Packet Length (count from 1): '))
+            
+        elif choice == '6':
+            TestedDevice.extra_buttons = []
+            
+        elif choice == '7':
             print('\n\n')
-            main_menu()
+            return
             
 
 # Menu for latency testing function
@@ -1270,13 +2243,16 @@ def test_latency():
         print('===========================')
         print(f'Trigger Button Position: {TestedDevice.trigger_position}')
         print(f'Trigger Button Value: {TestedDevice.trigger_nibble}')
+        print(f'Trigger Button Mask: {TestedDevice.trigger_mask or ""}')
         print(f'Trigger Button Packet Length: {TestedDevice.trigger_length}')
         print('')
         print('1 - Run 25 Tests (~18s)')
         print('2 - Run 100 Tests (~1m10s)')
         print('3 - Run 500 Tests (~5m50s)')
         print('4 - Run 1000 Tests (~11m40s)')
-        print('5 - Return to Main Menu')
+        print('5 - Run Sequential Test (until the average is known well enough)')
+        print('6 - Run Rig Test (every connected analyzer at once)')
+        print('7 - Return to Main Menu')
         print('===========================')
         print('')
         choice = input('Enter Choice #')
@@ -1294,46 +2270,73 @@ def test_latency():
             latency_test(1000)
             
         elif choice == '5':
-            main_menu()
+            mean_ms = input(f'Enter Average Confidence Interval (+/- ms, blank for {SEQUENTIAL_MEAN_MS}): ')
+            p99_ms = input('Enter 99th Percentile Confidence Interval (+/- ms, blank to skip): ')
+            max_triggers = input(f'Enter Maximum Triggers (blank for {SEQUENTIAL_MAX_TRIGGERS}): ')
+            
+            stop = SequentialStop(float(mean_ms) if mean_ms else SEQUENTIAL_MEAN_MS,
+                                  float(p99_ms) if p99_ms else SEQUENTIAL_P99_MS)
+            latency_test(int(max_triggers) if max_triggers else SEQUENTIAL_MAX_TRIGGERS, stop)
+            
+        elif choice == '6':
+            test_count = input(f'Enter Tests Per Analyzer (blank for {RIG_TESTS}): ')
+            rig_test(int(test_count) if test_count else RIG_TESTS)
+            
+        elif choice == '7':
+            return
             
             
-# Main function
+# Main function, the other menus return here
 def main_menu():
     global output_dir
     
-    # Path should have vid and pid in path for easy searching
-    if ('UNKNOWN' in output_dir) and TestedDevice.vendor_id:
-        output_dir = f'{os.getcwd()}/{TestedDevice.vendor_id}{TestedDevice.product_id}/{current_datetime}'
-    
-    print('===================')
-    print('-----Main Menu-----')
-    print('===================')
-    print(f'Output Directory - {output_dir}')
-    print('')
-    print('1 - Device Info')
-    print('2 - Output Settings')
-    print('3 - Test Button')
-    print('4 - Test Latency')
-    print('5 - Exit')
-    print('===================')
-    print('')
-    choice = input('Enter Choice #')
-    
-    if choice == '1':
-        device_info()        
-    elif choice == '2':
-        output_settings()
-    elif choice == '3':
-        test_button()
-    elif choice == '4':
-        # Without trigger details the testing would be inaccurate
-        if ('' in (TestedDevice.trigger_position, TestedDevice.trigger_nibble)) or (TestedDevice.trigger_length == 0):
-            print('\nMissing trigger details, run "Test Button" first.\n')
-            main_menu()
-        else:
-            test_latency()
-    elif choice == '5':
-        sys.exit(0)
+    while True:
+        # Path should have vid and pid in path for easy searching
+        if ('UNKNOWN' in output_dir) and TestedDevice.vendor_id:
+            output_dir = f'{os.getcwd()}/{TestedDevice.vendor_id}{TestedDevice.product_id}/{current_datetime}'
+        
+        print('===================')
+        print('-----Main Menu-----')
+        print('===================')
+        print(f'Output Directory - {output_dir}')
+        print('')
+        print('1 - Device Info')
+        print('2 - Output Settings')
+        print('3 - Test Button')
+        print('4 - Test Latency')
+        print('5 - Capture Settings')
+        print('6 - Exit')
+        print('===================')
+        print('')
+        choice = input('Enter Choice #')
+        
+        if choice == '1':
+            device_info()        
+        elif choice == '2':
+            output_settings()
+        elif choice == '3':
+            test_button()
+        elif choice == '4':
+            # Without trigger details the testing would be inaccurate
+            if (TestedDevice.trigger_mask is None) or (TestedDevice.trigger_length == 0):
+                print('\nMissing trigger details, run "Test Button" first.\n')
+            else:
+                test_latency()
+        elif choice == '5':
+            capture_settings()
+        elif choice == '6':
+            sys.exit(0)
         
 
-main_menu()
+# A job file runs headless, otherwise the menu is shown
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='USB input latency testing with a Beagle 480')
+    parser.add_argument('--jobs', help='run the jobs in this JSON file without the menu')
+    args = parser.parse_args()
+    
+    if args.jobs:
+        sys.exit(run_jobs(args.jobs))
+    
+    main_menu()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# Calibration cache, the trigger details found for each device and button so
+# the same device does not need calibrating again.  Stored as JSON:
+#   "vendor_id:product_id:version:button name" -> {trigger_mask,
+#   trigger_length, endpoint, saved}
+# Entries saved before trigger masks have trigger_position and
+# trigger_nibble instead.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import json
+import time
+
+from capture import save_json
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+def calibration_key(vendor_id, product_id, version, button_name):
+    return f'{vendor_id}:{product_id}:{version}:{button_name}'
+
+
+# Every saved calibration, empty if nothing has been saved yet
+def load_calibrations(path):
+    try:
+        with open(path) as cache_file:
+            return json.load(cache_file)
+    except FileNotFoundError:
+        return {}
+
+
+# Calibrations saved for one device and firmware version, button name -> details
+def device_calibrations(path, vendor_id, product_id, version):
+    prefix = calibration_key(vendor_id, product_id, version, '')
+
+    return {key[len(prefix):]: details for key, details in load_calibrations(path).items()
+            if key.startswith(prefix)}
+
+
+# Add or replace one calibration, an interrupted save never loses the others
+def save_calibration(path, key, details):
+    calibrations = load_calibrations(path)
+    calibrations[key] = {**details, 'saved': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime())}
+    save_json(path, calibrations, sort_keys=True)
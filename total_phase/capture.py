@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import json
+import mmap
+import os
+import struct
+
+from array import array
+from fractions import Fraction
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+# File layout:
+#   file header - magic, version, samplerate (kHz), host interface speed, metadata length
+#   metadata    - JSON with the TestedDevice details and trigger config
+#   records     - fixed size record header followed by the raw packet bytes
+CAPTURE_MAGIC = b'USBLATCP'
+CAPTURE_VERSION = 2
+FILE_HEADER = struct.Struct('<8sHIBI')
+
+# time_sop (ticks), events, length, pid, device address, endpoint
+# The address and endpoint come from the IN token before each DATA packet
+RECORD_HEADER = struct.Struct('<QIHBBB')
+
+# Version 1 records did not have the device address and endpoint
+RECORD_HEADER_V1 = struct.Struct('<QIHB')
+
+# Address and endpoint of trigger events, or DATA packets without an IN token
+NO_DEVICE = 0xff
+
+# Buffered records are written out once this many bytes are waiting,
+# so memory use stays the same no matter how long the capture runs
+CHUNK_SIZE = 64 * 1024
+
+# Same values as beagle_py, repeated here so captures can be read back
+# on a machine without the Beagle shared object
+BG_EVENT_USB_DIGITAL_INPUT = 0x00800000
+BG_EVENT_USB_DIGITAL_INPUT_MASK = 0x0000000f
+
+PID_NAMES = {0xe1: 'OUT', 0x69: 'IN', 0xa5: 'SOF', 0x2d: 'SETUP', 0xc3: 'DATA0', 0x4b: 'DATA1', 0x87: 'DATA2',
+             0x0f: 'MDATA', 0xd2: 'ACK', 0x5a: 'NAK', 0x1e: 'STALL', 0x96: 'NYET', 0x3c: 'PRE', 0x78: 'SPLIT',
+             0xb4: 'PING', 0xf0: 'EXT'}
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+# Streams trigger and data packets to disk while usb_dump() is running
+class CaptureWriter:
+    def __init__(self, path, samplerate_khz, host_speed, metadata, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.records = 0
+        self._file = open(path, 'wb')
+        self._buffer = bytearray()
+
+        metadata_bytes = json.dumps(metadata).encode()
+        self._buffer += FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, samplerate_khz, host_speed,
+                                         len(metadata_bytes))
+        self._buffer += metadata_bytes
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, time_sop, events, data, length, address=NO_DEVICE, endpoint=NO_DEVICE):
+        length = max(length, 0)
+        pid = data[0] if length > 0 else 0
+
+        self._buffer += RECORD_HEADER.pack(time_sop, events, length, pid, address, endpoint)
+        self._buffer += memoryview(data)[:length]
+        self.records += 1
+
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer.clear()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+# Memory maps a capture file for reanalysis.  Records are returned as
+# (time_sop, events, length, pid, address, endpoint, data) where data is a memoryview into the
+# mapped file, so payloads are never copied.  The views are only valid
+# until the reader is closed.
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._offsets = None
+
+        if len(self._view) < FILE_HEADER.size:
+            self.close()
+            raise ValueError(f'{path} is not a capture file')
+
+        magic, self.version, self.samplerate_khz, self.host_speed, metadata_length = \
+            FILE_HEADER.unpack_from(self._view)
+
+        if magic != CAPTURE_MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a capture file')
+
+        if self.version > CAPTURE_VERSION:
+            self.close()
+            raise ValueError(f'{path} is capture version {self.version}, only up to {CAPTURE_VERSION} is supported')
+
+        self._start = FILE_HEADER.size + metadata_length
+        self.metadata = json.loads(bytes(self._view[FILE_HEADER.size:self._start]))
+        self._record_header = RECORD_HEADER if self.version >= 2 else RECORD_HEADER_V1
+
+    # Version 1 records are returned with NO_DEVICE for the address and endpoint
+    def _unpack_from(self, view, offset):
+        if self.version >= 2:
+            return RECORD_HEADER.unpack_from(view, offset)
+        return RECORD_HEADER_V1.unpack_from(view, offset) + (NO_DEVICE, NO_DEVICE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        view = self._view
+        end = len(view)
+        offset = self._start
+        header_size = self._record_header.size
+        unpack_from = self._unpack_from
+
+        while offset + header_size <= end:
+            time_sop, events, length, pid, address, endpoint = unpack_from(view, offset)
+            offset += header_size
+            yield time_sop, events, length, pid, address, endpoint, view[offset:offset + length]
+            offset += length
+
+    def __len__(self):
+        return len(self._index())
+
+    def __getitem__(self, i):
+        offset = self._index()[i]
+        time_sop, events, length, pid, address, endpoint = self._unpack_from(self._view, offset)
+        offset += self._record_header.size
+        return time_sop, events, length, pid, address, endpoint, self._view[offset:offset + length]
+
+    # Offset of every record in buffer, for reading records in bulk
+    def record_offsets(self):
+        return self._index()
+
+    # The whole mapped file
+    @property
+    def buffer(self):
+        return self._view
+
+    # Record offsets are only found the first time random access is needed
+    def _index(self):
+        if self._offsets is None:
+            offsets = array('Q')
+            view = self._view
+            end = len(view)
+            offset = self._start
+            header_size = self._record_header.size
+            unpack_from = self._record_header.unpack_from
+
+            while offset + header_size <= end:
+                offsets.append(offset)
+                offset += header_size + unpack_from(view, offset)[2]
+
+            self._offsets = offsets
+
+        return self._offsets
+
+    def close(self):
+        self._view.release()
+        self._file.close()
+
+        # The map stays open while any record data is still referenced,
+        # and is closed when the last of it is garbage collected
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Nanoseconds per Beagle tick.  Kept as a fraction so converting never
+# rounds anything but the final result.
+def ns_per_tick(samplerate_khz):
+    return Fraction(1000000, samplerate_khz)
+
+
+def ticks_to_ns(ticks, scale):
+    return (ticks * scale.numerator) // scale.denominator
+
+
+# Write data to path as JSON through a temporary file next to it, so the
+# file is replaced in one go and neither a reader nor an interrupted save
+# ever sees half of it
+def save_json(path, data, sort_keys=False):
+    temp_path = f'{path}.tmp'
+
+    try:
+        with open(temp_path, 'w') as out_file:
+            json.dump(data, out_file, indent=2, sort_keys=sort_keys)
+
+        os.replace(temp_path, path)
+
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+# Digital input events carry the level of every enabled input in the low bits
+def is_input_event(events):
+    return events & ~BG_EVENT_USB_DIGITAL_INPUT_MASK == BG_EVENT_USB_DIGITAL_INPUT
+
+
+# Render a record the same way raw_output.txt has always been written.
+# Digital input events are named TRIGGER_ON/OFF when digital input 1 is the
+# only one in use, otherwise (or if named is False) the level of every input
+# is shown, input 4 first.
+def record_to_text(time_field, events, length, data, named=True):
+    if events & BG_EVENT_USB_DIGITAL_INPUT:
+        if named and events == BG_EVENT_USB_DIGITAL_INPUT:
+            return f'{time_field},{length},TRIGGER_ON'
+        if named and events == BG_EVENT_USB_DIGITAL_INPUT | 1:
+            return f'{time_field},{length},TRIGGER_OFF'
+        return f'{time_field},{length},INPUTS_{events & BG_EVENT_USB_DIGITAL_INPUT_MASK:04b}'
+
+    return f'{time_field},{length},{PID_NAMES.get(data[0], "INVALID")},{data.hex(" ")} '
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+#==========================================================================
+# GLOBALS
+#==========================================================================
+# Packet groups, also the index of each group's counter
+SOF = 0
+IN_ACK = 1
+IN_NAK = 2
+PING_NAK = 3
+SPLIT_IN_ACK = 4
+SPLIT_IN_NYET = 5
+SPLIT_IN_NAK = 6
+SPLIT_OUT_NYET = 7
+SPLIT_SETUP_NYET = 8
+KEEP_ALIVE = 9
+GROUPS = 10
+
+# States used in collapsing state machine
+IDLE = 0
+IN = 1
+PING = 3
+SPLIT = 4
+SPLIT_IN = 5
+SPLIT_OUT = 7
+SPLIT_SETUP = 8
+STATES = 9
+
+# Disable COMBINE_SPLITS by setting to False.  Disabling
+# will show individual split counts for each group (such as
+# SPLIT/IN/ACK, SPLIT/IN/NYET, ...).  Enabling will show all the
+# collapsed split counts combined.
+COMBINE_SPLITS = True
+
+# Same values as beagle_py, repeated here so the table can be built
+# on a machine without the Beagle shared object
+PID_OUT = 0xe1
+PID_IN = 0x69
+PID_SOF = 0xa5
+PID_SETUP = 0x2d
+PID_ACK = 0xd2
+PID_NAK = 0x5a
+PID_NYET = 0x96
+PID_SPLIT = 0x78
+PID_PING = 0xb4
+
+# What to do with a packet, looked up with the next state
+COLLAPSE = 0x1  # count the packet in its group and drop the queue
+SAVE = 0x2      # keep the packet in the queue until the sequence is complete
+EMIT = 0x4      # end the collapsing, the caller outputs the packet
+FLUSH = 0x8     # the saved packets were not a complete sequence, drop them first
+
+# Packets that end a sequence from each state: pid -> (action, group)
+SEQUENCES = {
+    IDLE: {KEEP_ALIVE: (COLLAPSE, KEEP_ALIVE), PID_SOF: (COLLAPSE, SOF)},
+    IN: {PID_ACK: (COLLAPSE, IN_ACK), PID_NAK: (COLLAPSE, IN_NAK)},
+    PING: {PID_NAK: (COLLAPSE, PING_NAK)},
+    SPLIT: {},
+    SPLIT_IN: {PID_NYET: (COLLAPSE, SPLIT_IN_NYET), PID_NAK: (COLLAPSE, SPLIT_IN_NAK),
+               PID_ACK: (COLLAPSE, SPLIT_IN_ACK)},
+    SPLIT_OUT: {PID_NYET: (COLLAPSE, SPLIT_OUT_NYET)},
+    SPLIT_SETUP: {PID_NYET: (COLLAPSE, SPLIT_SETUP_NYET)},
+}
+
+# Packets that start or continue a sequence: state -> {pid: next state}
+SAVED = {
+    IDLE: {PID_IN: IN, PID_PING: PING, PID_SPLIT: SPLIT},
+    SPLIT: {PID_IN: SPLIT_IN, PID_OUT: SPLIT_OUT, PID_SETUP: SPLIT_SETUP},
+}
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Transition for a packet arriving in IDLE
+def idle_transition(pid):
+    if pid in SEQUENCES[IDLE]:
+        action, group = SEQUENCES[IDLE][pid]
+        return action, group, IDLE
+
+    if pid in SAVED[IDLE]:
+        return SAVE, 0, SAVED[IDLE][pid]
+
+    return EMIT, 0, IDLE
+
+
+# Transition for any state.  Anything that does not continue the sequence
+# flushes the saved packets and is handled again from IDLE, which is
+# folded into the same entry so a packet only ever needs one lookup.
+def transition(state, pid):
+    if state == IDLE:
+        return idle_transition(pid)
+
+    if pid in SEQUENCES.get(state, {}):
+        action, group = SEQUENCES[state][pid]
+        return action, group, IDLE
+
+    if pid in SAVED.get(state, {}):
+        return SAVE, 0, SAVED[state][pid]
+
+    action, group, next_state = idle_transition(pid)
+    return action | FLUSH, group, next_state
+
+
+# Table of (action, group, next state) indexed by [state][pid].  PIDs are
+# a byte, and KEEP_ALIVE events are looked up with the KEEP_ALIVE group
+# number, same as the old state machine.  Rows for the unused state
+# numbers are never reached.
+def build_transitions():
+    table = []
+
+    for state in range(STATES):
+        table.append([transition(state, pid) for pid in range(256)])
+
+    return table
+
+
+TRANSITIONS = build_transitions()
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+# Collapses SOF* (IN (ACK|NAK))* (PING NAK)*
+# (SPLIT (OUT|SETUP) NYET)* (SPLIT IN (ACK|NYET|NACK))*
+# with one table lookup per packet.  The packet queue is the
+# PacketQueue from usb_dump(), packets are saved to and cleared from it
+# the same way the old nested state machine did.
+class CollapseEngine:
+    def __init__(self, pkt_q, idle_samples):
+        self.pkt_q = pkt_q
+        self.idle_samples = idle_samples
+        self.state = IDLE
+        self.transitions = TRANSITIONS
+
+        # Timestamp when collapsing begins
+        self.time_sop = 0
+        # The number of packets collapsed for each packet group
+        self.count = [0] * GROUPS
+        self.signal_errors = 0
+
+    # Output the counts and zero out the counters
+    def clear(self):
+        self.time_sop = 0
+        self.count[:] = [0] * GROUPS
+        self.signal_errors = 0
+
+    # Feed the current packet (the tail of the queue).  Returns True when
+    # the packet was not collapsed or saved, and should be output.
+    def step(self, pid, time_sop):
+        # If the time elapsed since collapsing began is greater than
+        # the threshold, output the counts and zero out the counters.
+        if time_sop - self.time_sop >= self.idle_samples:
+            self.clear()
+
+        action, group, self.state = self.transitions[self.state][pid]
+
+        if action & FLUSH:
+            self.clear()
+            self.pkt_q.clear(dequeue=True)
+
+        if action & COLLAPSE:
+            self.count[group] += 1
+
+            if self.time_sop == 0:
+                self.time_sop = time_sop
+
+            self.pkt_q.clear()
+
+        elif action & SAVE:
+            self.pkt_q.save_packet()
+
+        else:
+            self.clear()
+            return True
+
+        return False
+
+    # Renders the collapsed counts, only used for debugging
+    def summary(self):
+        count = self.count
+        summary = ""
+
+        if any(count):
+            summary += "COLLAPSED "
+
+            if count[KEEP_ALIVE] > 0:
+                summary += "[%d KEEP-ALIVE] " % count[KEEP_ALIVE]
+
+            if count[SOF] > 0:
+                summary += "[%d SOF] " % count[SOF]
+
+            if count[IN_ACK] > 0:
+                summary += "[%d IN/ACK] " % count[IN_ACK]
+
+            if count[IN_NAK] > 0:
+                summary += "[%d IN/NAK] " % count[IN_NAK]
+
+            if count[PING_NAK] > 0:
+                summary += "[%d PING/NAK] " % count[PING_NAK]
+
+            if COMBINE_SPLITS:
+                split_count = sum(count[SPLIT_IN_ACK:SPLIT_SETUP_NYET + 1])
+
+                if split_count > 0:
+                    summary += "[%d SPLITS] " % split_count
+            else:
+                if count[SPLIT_IN_ACK] > 0:
+                    summary += "[%d SPLIT/IN/ACK] " % count[SPLIT_IN_ACK]
+
+                if count[SPLIT_IN_NYET] > 0:
+                    summary += "[%d SPLIT/IN/NYET] " % count[SPLIT_IN_NYET]
+
+                if count[SPLIT_IN_NAK] > 0:
+                    summary += "[%d SPLIT/IN/NAK] " % count[SPLIT_IN_NAK]
+
+                if count[SPLIT_OUT_NYET] > 0:
+                    summary += "[%d SPLIT/OUT/NYET] " % count[SPLIT_OUT_NYET]
+
+                if count[SPLIT_SETUP_NYET] > 0:
+                    summary += "[%d SPLIT/SETUP/NYET] " % count[SPLIT_SETUP_NYET]
+
+        # Output any signal errors
+        if self.signal_errors > 0:
+            summary += "<%d SIGNAL ERRORS>" % self.signal_errors
+
+        return summary
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# Event pipeline for cleaning captures.  A capture is decoded once into typed
+# events (InputChange, Trigger, OtherInput, Report, Record) by a generator,
+# and stages subscribe to the events they need: writing raw_output.txt,
+# turning a digital input into trigger edges, pairing each edge with the
+# DATA packet that answers it, and collecting the latencies and clean lines.
+# Every stage keeps only the state of the packet it is waiting on, so
+# nothing is re-parsed and no history is rewritten.
+#
+#   capture_events() -> RawText
+#                    -> Responders
+#                    -> DeviceFilter -> ReportLengths
+#                                    -> ButtonEdges -> LatencyCleaner -> CleanText, LatencyTimes, ResponseLog,
+#                                                                       LatencySummary
+#                                                   -> Calibration
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from collections import Counter
+
+from capture import BG_EVENT_USB_DIGITAL_INPUT, BG_EVENT_USB_DIGITAL_INPUT_MASK, PID_NAMES, CaptureReader, \
+    record_to_text, ticks_to_ns
+from latency_stats import LatencyStats
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+# Levels of every enabled digital input, as the Beagle reports them
+class InputChange:
+    def __init__(self, time, levels, length=0):
+        self.time = time
+        self.levels = levels
+        self.length = length
+
+
+# An edge of the button being analyzed, pressed pulls its input low
+class Trigger:
+    def __init__(self, time, pressed, length=0):
+        self.time = time
+        self.pressed = pressed
+        self.length = length
+
+    @property
+    def name(self):
+        return 'TRIGGER_ON' if self.pressed else 'TRIGGER_OFF'
+
+
+# Another button's input changed while this one did not
+class OtherInput:
+    name = 'OTHER_INPUT'
+
+    def __init__(self, time, length=0):
+        self.time = time
+        self.length = length
+
+
+# A DATA packet and the device address and endpoint it came from
+class Report:
+    def __init__(self, time, name, data, address, endpoint):
+        self.time = time
+        self.name = name
+        self.data = data
+        self.address = address
+        self.endpoint = endpoint
+
+    @property
+    def length(self):
+        return len(self.data)
+
+
+# Any other packet, bg480_collect-raspi.py only saves edges and DATA packets so these come from old text captures
+class Record:
+    def __init__(self, time, name, length=0, data=b'', address=None, endpoint=None):
+        self.time = time
+        self.name = name
+        self.length = length
+        self.data = data
+        self.address = address
+        self.endpoint = endpoint
+
+
+# A trigger edge and the DATA packet that answered it
+class Response:
+    def __init__(self, trigger, report):
+        self.trigger = trigger
+        self.report = report
+
+    @property
+    def latency(self):
+        return self.report.time - self.trigger.time
+
+
+# Base for every stage.  Events are passed on to subscribers with emit(),
+# finish() is called once the capture has been read.
+class Stage:
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, stage):
+        self.subscribers.append(stage)
+        return stage
+
+    def emit(self, event):
+        for stage in self.subscribers:
+            stage.feed(event)
+
+    def feed(self, event):
+        self.emit(event)
+
+    def finish(self):
+        for stage in self.subscribers:
+            stage.finish()
+
+
+# Only packets from one device address and endpoint (None for any) go through
+class DeviceFilter(Stage):
+    def __init__(self, address=None, endpoint=None):
+        super().__init__()
+        self.address = address
+        self.endpoint = endpoint
+
+    def feed(self, event):
+        if isinstance(event, (Report, Record)):
+            if self.address is not None and self.address != event.address:
+                return
+            if self.endpoint is not None and self.endpoint != event.endpoint:
+                return
+
+        self.emit(event)
+
+
+# Digital input levels to edges of the button on input_pin (1-4), or
+# OtherInput when only another input changed
+class ButtonEdges(Stage):
+    def __init__(self, input_pin):
+        super().__init__()
+        self.input_pin = input_pin
+        self.last_levels = None
+
+    def feed(self, event):
+        if not isinstance(event, InputChange):
+            self.emit(event)
+            return
+
+        changed = event.levels ^ self.last_levels if self.last_levels is not None else 0
+        self.last_levels = event.levels
+
+        if changed and not changed >> (self.input_pin - 1) & 1:
+            self.emit(OtherInput(event.time, event.length))
+        else:
+            self.emit(Trigger(event.time, not event.levels >> (self.input_pin - 1) & 1, event.length))
+
+
+# Pairs each trigger edge with the first DATA packet of the button's length
+# that shows the button in the same state, and emits a Response for it.
+# Edges out of order, or anything else that is not expected, replace the
+# edge waiting for an answer.  An edge waiting when another button changes
+# is dropped, and the same edge is waited for again.  The last edge is
+# emitted on its own at the end if it was never answered.
+#
+# bg480_collect-raspi.py used to clean raw_output.txt after the capture with
+# the same rules, but went back and overwrote a DATA line it had already kept
+# when a misaligned edge or packet came along, which left every later trigger
+# paired with the wrong packet.  Here a Response is final once emitted.
+class LatencyCleaner(Stage):
+    def __init__(self, trigger_mask, length):
+        super().__init__()
+        self.trigger_mask = trigger_mask
+        self.length = length
+        self.first_run = True
+        self.data_off_test = False
+        self.data_on_test = False
+        # Last event kept, only a Trigger can still be answered
+        self.last = None
+        self.kept = 0
+
+    def feed(self, event):
+        if isinstance(event, OtherInput):
+            if self.last is not None and not isinstance(self.last, Report) and 'DATA' not in self.last.name:
+                if isinstance(self.last, Trigger) and not self.last.pressed:
+                    self.data_on_test = True
+                else:
+                    self.data_off_test = True
+
+                self.last = None
+                self.kept -= 1
+                self.first_run = self.kept == 0
+
+        elif isinstance(event, Trigger) and not event.pressed and (self.data_on_test or self.first_run):
+            self.keep_trigger(event)
+            self.first_run = False
+
+        elif isinstance(event, Trigger) and event.pressed and self.data_off_test:
+            self.keep_trigger(event)
+
+        elif isinstance(event, Report) and event.name.strip().startswith('DATA'):
+            if self.first_run or event.length != self.length or not isinstance(self.last, Trigger):
+                return
+
+            released, pressed = self.trigger_mask.state(event.data)
+
+            if released and not self.last.pressed:
+                self.data_off_test = True
+                self.data_on_test = False
+                self.keep_response(event)
+
+            elif pressed and self.last.pressed:
+                self.data_off_test = False
+                self.data_on_test = True
+                self.keep_response(event)
+
+        elif not self.first_run:
+            self.last = event
+
+    def keep_trigger(self, trigger):
+        self.data_off_test = False
+        self.data_on_test = False
+        self.last = trigger
+        self.kept += 1
+
+    def keep_response(self, report):
+        self.emit(Response(self.last, report))
+        self.last = report
+        self.kept += 1
+
+    def finish(self):
+        if isinstance(self.last, Trigger):
+            self.emit(self.last)
+
+        super().finish()
+
+
+# Latency in ticks of every Response
+class LatencyTimes(Stage):
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    def feed(self, event):
+        if isinstance(event, Response):
+            self.times.append(event.latency)
+
+
+# LatencyStats of every Response, latencies in ticks are converted to
+# nanoseconds with scale so runs at any sample rate can be merged
+class LatencySummary(Stage):
+    def __init__(self, scale):
+        super().__init__()
+        self.scale = scale
+        self.stats = LatencyStats()
+
+    def feed(self, event):
+        if isinstance(event, Response):
+            self.stats.add(event.latency * self.scale)
+
+
+# Every Response as (pressed, trigger time, response time), in order
+class ResponseLog(Stage):
+    def __init__(self):
+        super().__init__()
+        self.responses = []
+
+    def feed(self, event):
+        if isinstance(event, Response):
+            self.responses.append((event.trigger.pressed, event.trigger.time, event.report.time))
+
+
+# Writes the kept edges and DATA packets in the clean_output.txt format,
+# with tick times converted to nanoseconds
+class CleanText(Stage):
+    def __init__(self, out_file, scale):
+        super().__init__()
+        self.out_file = out_file
+        self.scale = scale
+
+    def feed(self, event):
+        if isinstance(event, Response):
+            self.write(event.trigger)
+            self.write(event.report)
+        else:
+            self.write(event)
+
+    def write(self, event):
+        self.out_file.write(f'{clean_line(event, ticks_to_ns(event.time, self.scale))}\n')
+
+
+# Writes every record in the raw_output.txt format, one line per record
+class RawText(Stage):
+    def __init__(self, out_file, scale, named=True):
+        super().__init__()
+        self.out_file = out_file
+        self.scale = scale
+        self.named = named
+
+    def feed(self, event):
+        time_field = ticks_to_ns(event.time, self.scale)
+
+        if isinstance(event, InputChange):
+            line = record_to_text(time_field, BG_EVENT_USB_DIGITAL_INPUT | event.levels, event.length, b'', self.named)
+        else:
+            line = record_to_text(time_field, 0, event.length, event.data)
+
+        self.out_file.write(f'{line}\n')
+
+
+# Which device address and endpoint sent the first DATA packet after each
+# digital input change
+class Responders(Stage):
+    def __init__(self):
+        super().__init__()
+        self.responders = Counter()
+        self.waiting = False
+
+    def feed(self, event):
+        if isinstance(event, InputChange):
+            self.waiting = True
+
+        elif self.waiting:
+            self.responders[(event.address, event.endpoint)] += 1
+            self.waiting = False
+
+
+# DATA packet lengths seen, the trigger button's packet length is picked from these
+class ReportLengths(Stage):
+    def __init__(self):
+        super().__init__()
+        self.lengths = []
+
+    def feed(self, event):
+        if isinstance(event, Report) and event.name.strip().startswith('DATA'):
+            self.lengths.append(event.length)
+
+
+# The payload of the first DATA packet of the given length after each edge,
+# split by whether the button was released or pressed.  Used to find which
+# bits the button changes, so no trigger mask is known yet.
+class Calibration(Stage):
+    def __init__(self, length):
+        super().__init__()
+        self.length = length
+        self.first_run = True
+        self.data_off_test = False
+        self.data_on_test = False
+        self.last = None
+        self.packet_data_off = []
+        self.packet_data_on = []
+
+    def feed(self, event):
+        # Only this button is pressed while finding its details
+        if isinstance(event, OtherInput):
+            return
+
+        if isinstance(event, Trigger) and not event.pressed and (self.data_on_test or self.first_run):
+            self.data_off_test = False
+            self.data_on_test = False
+            self.first_run = False
+            self.last = event
+
+        elif isinstance(event, Trigger) and event.pressed and self.data_off_test:
+            self.data_off_test = False
+            self.data_on_test = False
+            self.last = event
+
+        elif isinstance(event, Report) and event.name.strip().startswith('DATA'):
+            if self.first_run or event.length != self.length or not isinstance(self.last, Trigger):
+                return
+
+            if self.last.pressed:
+                self.packet_data_on.append(event.data)
+                self.data_off_test = False
+                self.data_on_test = True
+            else:
+                self.packet_data_off.append(event.data)
+                self.data_off_test = True
+                self.data_on_test = False
+
+            self.last = event
+
+        elif not self.first_run:
+            self.last = event
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Events of a binary capture, every record decoded once
+def capture_events(path):
+    with CaptureReader(path) as reader:
+        for time_sop, events, length, pid, address, endpoint, data in reader:
+            if events & BG_EVENT_USB_DIGITAL_INPUT:
+                yield InputChange(time_sop, events & BG_EVENT_USB_DIGITAL_INPUT_MASK, length)
+            else:
+                name = PID_NAMES.get(data[0], 'INVALID')
+
+                if name.startswith('DATA'):
+                    yield Report(time_sop, name, bytes(data), address, endpoint)
+                else:
+                    yield Record(time_sop, name, length, bytes(data), address, endpoint)
+
+
+# Events of raw_output.txt or clean_output.txt style lines (time,length,type[,data]),
+# edges named TRIGGER_ON/OFF are for digital input 1
+def line_events(lines):
+    for line in lines:
+        fields = line.rstrip('\n').split(',')
+        time = int(fields[0])
+        length = int(fields[1] or 0)
+        name = fields[2]
+        packet_type = name.strip()
+
+        if packet_type in ('TRIGGER_ON', 'TRIGGER_OFF'):
+            yield Trigger(time, packet_type == 'TRIGGER_ON', length)
+        elif packet_type == 'OTHER_INPUT':
+            yield OtherInput(time, length)
+        elif packet_type.startswith('INPUTS_'):
+            yield InputChange(time, int(packet_type[len('INPUTS_'):], 2), length)
+        elif packet_type.startswith('DATA') and len(fields) > 3:
+            try:
+                data = bytes.fromhex(fields[3])
+            except ValueError:
+                data = b''
+
+            yield Report(time, name, data, None, None)
+        else:
+            yield Record(time, name, length)
+
+
+# Feed every event to the stages, then finish them
+def run_pipeline(events, *stages):
+    for event in events:
+        for stage in stages:
+            stage.feed(event)
+
+    for stage in stages:
+        stage.finish()
+
+
+# An event as a clean_output.txt line, with time_field in front
+def clean_line(event, time_field):
+    if isinstance(event, Report):
+        return f'{time_field},{event.name},{event.data.hex(" ")} '
+    return f'{time_field},{event.name}'
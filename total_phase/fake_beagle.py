@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# Local stand-in for the native beagle module, used with FAKE_BEAGLE so
+# bg480_collect-raspi.py (and beagle_py.py on top of it) can be run without
+# a Beagle 480.  Only the calls made by bg480_collect-raspi.py are covered.
+#
+# FAKE_BEAGLE_PORTS analyzers are listed by bg_find_devices_ext(), 2 by
+# default.  Each one sees a full speed device on address 5 endpoint 1 behind
+# SOF and IN/NAK traffic.  The enabled digital inputs are toggled in turn every
+# 300-600ms, and the device answers each edge 1-8ms later (plus 1ms per port
+# number, so the analyzers give different results) with 0x20 << (input - 1)
+# set in bytes 6-7 (little endian) while that button is pressed.  Triggers
+# are generated here, not read from the GPIO pins, and the hardware filter
+# is ignored.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import os
+import random
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+PORTS = int(os.environ.get('FAKE_BEAGLE_PORTS', '2'))
+
+# Same values as beagle_py
+SW_VERSION = 0x053c
+REQ_API_VERSION = 0x051e
+BG_OK = 0
+BG_UNABLE_TO_OPEN = -2
+BG_EVENT_USB_DIGITAL_INPUT = 0x00800000
+
+SAMPLERATE_KHZ = 60000
+TICKS_PER_MS = SAMPLERATE_KHZ
+HOST_BUFFER_SIZE = 4 * 1024 * 1024
+
+PID_SOF = 0xa5
+PID_IN = 0x69
+PID_NAK = 0x5a
+PID_ACK = 0xd2
+PID_DATA0 = 0xc3
+PID_DATA1 = 0x4b
+
+DEVICE_ADDRESS = 5
+DEVICE_ENDPOINT = 1
+
+# Open analyzers, handle -> FakeAnalyzer
+analyzers = {}
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+class FakeAnalyzer:
+    def __init__(self, port):
+        self.port = port
+        self.unique_id = 1000000000 + port
+        self.inputs = 0x1
+        self.host_buffer_size = HOST_BUFFER_SIZE
+        self.packets = None
+
+    # Packets as (time_sop, events, data), started again on every bg_enable()
+    def traffic(self):
+        rng = random.Random(self.unique_id)
+        inputs = [i for i in range(4) if self.inputs & (1 << i)]
+        levels = self.inputs
+        edge = 0
+        frame = 0
+        toggle = 0
+        buttons = 0
+        time_sop = 0
+        next_edge = 5 * TICKS_PER_MS
+        response = None
+
+        # The analyzer reports the input levels when the capture starts
+        yield time_sop, BG_EVENT_USB_DIGITAL_INPUT | levels, []
+
+        while True:
+            time_sop += TICKS_PER_MS // 8
+            frame += 1
+            yield time_sop, 0, [PID_SOF, frame & 0xff, (frame >> 8) & 0x07]
+
+            if time_sop >= next_edge:
+                levels ^= 1 << inputs[edge // 2 % len(inputs)]
+                edge += 1
+                yield time_sop + 7, BG_EVENT_USB_DIGITAL_INPUT | levels, []
+
+                # Pressed buttons pull their input low
+                pressed = ~levels & self.inputs
+                response = (time_sop + rng.randrange(TICKS_PER_MS, 8 * TICKS_PER_MS) + self.port * TICKS_PER_MS,
+                            sum(0x20 << i for i in range(4) if pressed & (1 << i)))
+                next_edge = time_sop + rng.randrange(300, 600) * TICKS_PER_MS
+
+            # Full speed device, polled once a millisecond
+            if frame % 8 == 0:
+                yield time_sop + 100, 0, [PID_IN, (DEVICE_ADDRESS | (DEVICE_ENDPOINT << 7)) & 0xff,
+                                          (DEVICE_ENDPOINT >> 1) & 0x07]
+
+                if response is not None and time_sop >= response[0]:
+                    buttons = response[1]
+                    response = None
+
+                    yield time_sop + 150, 0, [PID_DATA1 if toggle else PID_DATA0, 0x20, 0x00, frame & 0xff, 0x0e,
+                                              0x00, buttons & 0xff, buttons >> 8, 0x00, 0x00, 0x12, 0x34]
+                    yield time_sop + 170, 0, [PID_ACK]
+                    toggle ^= 1
+
+                else:
+                    yield time_sop + 150, 0, [PID_NAK]
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+def py_version():
+    return (REQ_API_VERSION << 16) | SW_VERSION
+
+
+def py_bg_find_devices(num_devices, devices):
+    for i in range(min(num_devices, PORTS)):
+        devices[i] = i
+
+    return PORTS
+
+
+def py_bg_find_devices_ext(num_devices, num_ids, devices, unique_ids):
+    for i in range(min(num_devices, PORTS)):
+        devices[i] = i
+
+    for i in range(min(num_ids, PORTS)):
+        unique_ids[i] = FakeAnalyzer(i).unique_id
+
+    return PORTS
+
+
+def py_bg_open(port_number):
+    if port_number >= PORTS:
+        return BG_UNABLE_TO_OPEN
+
+    analyzers[port_number + 1] = FakeAnalyzer(port_number)
+    return port_number + 1
+
+
+def py_bg_close(beagle):
+    analyzers.pop(beagle, None)
+    return 1
+
+
+def py_bg_port(beagle):
+    return analyzers[beagle].port
+
+
+def py_bg_unique_id(beagle):
+    return analyzers[beagle].unique_id
+
+
+def py_bg_status_string(status):
+    return f'fake status {status}'
+
+
+def py_bg_samplerate(beagle, samplerate_khz):
+    return SAMPLERATE_KHZ
+
+
+def py_bg_timeout(beagle, milliseconds):
+    return milliseconds
+
+
+def py_bg_latency(beagle, milliseconds):
+    return milliseconds
+
+
+def py_bg_host_ifce_speed(beagle):
+    return 1
+
+
+def py_bg_host_buffer_size(beagle, num_bytes):
+    if num_bytes:
+        analyzers[beagle].host_buffer_size = num_bytes
+
+    return analyzers[beagle].host_buffer_size
+
+
+def py_bg_host_buffer_free(beagle):
+    return analyzers[beagle].host_buffer_size
+
+
+def py_bg_host_buffer_used(beagle):
+    return 0
+
+
+def py_bg_usb2_digital_in_config(beagle, in_enable_mask):
+    analyzers[beagle].inputs = in_enable_mask
+    return BG_OK
+
+
+def py_bg_usb2_capture_config(beagle, capture_mode):
+    return BG_OK
+
+
+def py_bg_usb2_target_config(beagle, target_config):
+    return BG_OK
+
+
+def py_bg_usb_configure(beagle, cap_mask, trigger_mode):
+    return BG_OK
+
+
+def py_bg_usb2_hw_filter_config(beagle, filter_enable_mask):
+    return BG_OK
+
+
+def py_bg_usb2_complex_match_enable(beagle):
+    return BG_OK
+
+
+def py_bg_usb2_complex_match_disable(beagle):
+    return BG_OK
+
+
+def py_bg_usb2_complex_match_config_single(beagle, validate, digout, c_state):
+    return BG_OK
+
+
+def py_bg_enable(beagle, protocol):
+    analyzers[beagle].packets = analyzers[beagle].traffic()
+    return BG_OK
+
+
+def py_bg_disable(beagle):
+    analyzers[beagle].packets = None
+    return BG_OK
+
+
+def py_bg_usb2_read(beagle, max_bytes, packet):
+    time_sop, events, data = next(analyzers[beagle].packets)
+
+    for i, value in enumerate(data[:max_bytes]):
+        packet[i] = value
+
+    # length, status, events, time_sop, time_duration, time_dataoffset
+    return len(data), 0, events, time_sop, 10, 0
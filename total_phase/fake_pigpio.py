@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# Local stand-in for the pigpio module and daemon, used with FAKE_PIGPIO so the
+# trigger functions can be run without a Raspberry Pi.  Only the calls made by
+# bg480_collect-raspi.py are covered.  Waves are played back by a thread with
+# time.sleep(), so timing is only as good as the host scheduler.
+#
+# Every level change is appended to the file named by FAKE_PIGPIO_LOG, if set,
+# as time_ns,bank_1 so it can be compared with trigger_schedule.csv.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import os
+import threading
+import time
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+INPUT = 0
+OUTPUT = 1
+
+WAVE_MODE_ONE_SHOT = 0
+WAVE_MODE_REPEAT = 1
+WAVE_MODE_ONE_SHOT_SYNC = 2
+WAVE_MODE_REPEAT_SYNC = 3
+
+WAVE_NOT_FOUND = 9998
+NO_TX_WAVE = 9999
+
+# Same limit as the daemon's default DMA setup
+MAX_PULSES = 12000
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+class pulse:
+    def __init__(self, gpio_on, gpio_off, delay):
+        self.gpio_on = gpio_on
+        self.gpio_off = gpio_off
+        self.delay = delay
+
+
+class pi:
+    def __init__(self, host='localhost', port=8888):
+        self.connected = True
+        self._bank_1 = 0
+        self._modes = {}
+        self._pending = []
+        self._waves = {}
+        self._next_wid = 0
+        self._queue = []
+        self._tx = NO_TX_WAVE
+        self._stop = threading.Event()
+        self._lock = threading.Condition()
+        self._log = os.environ.get('FAKE_PIGPIO_LOG')
+        self._thread = threading.Thread(target=self._play, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.wave_tx_stop()
+        self.connected = False
+
+    def set_mode(self, gpio, mode):
+        self._modes[gpio] = mode
+        return 0
+
+    def read_bank_1(self):
+        return self._bank_1
+
+    def set_bank_1(self, bits):
+        self._set_levels(bits, 0)
+        return 0
+
+    def clear_bank_1(self, bits):
+        self._set_levels(0, bits)
+        return 0
+
+    def _set_levels(self, gpio_on, gpio_off):
+        self._bank_1 = (self._bank_1 | gpio_on) & ~gpio_off
+
+        if self._log and (gpio_on or gpio_off):
+            with open(self._log, 'a') as log_file:
+                log_file.write(f'{time.monotonic_ns()},{self._bank_1}\n')
+
+    def wave_clear(self):
+        self.wave_tx_stop()
+        self._pending = []
+        self._waves = {}
+        return 0
+
+    def wave_add_new(self):
+        self._pending = []
+        return 0
+
+    def wave_add_generic(self, pulses):
+        self._pending.extend(pulses)
+        return len(self._pending)
+
+    def wave_get_max_pulses(self):
+        return MAX_PULSES
+
+    def wave_create(self):
+        if sum(len(wave) for wave in self._waves.values()) + len(self._pending) > MAX_PULSES:
+            raise RuntimeError('No more CBs for waveform')
+
+        wid = self._next_wid
+        self._next_wid += 1
+        self._waves[wid] = self._pending
+        self._pending = []
+        return wid
+
+    def wave_delete(self, wid):
+        with self._lock:
+            if wid == self._tx or wid in self._queue:
+                raise RuntimeError('Wave is still in use')
+            del self._waves[wid]
+        return 0
+
+    def wave_send_once(self, wid):
+        return self.wave_send_using_mode(wid, WAVE_MODE_ONE_SHOT)
+
+    def wave_send_using_mode(self, wid, mode):
+        with self._lock:
+            if mode == WAVE_MODE_ONE_SHOT:
+                self._queue = [wid]
+                self._stop.set()
+            else:
+                self._queue.append(wid)
+            self._lock.notify()
+        return len(self._waves[wid])
+
+    def wave_chain(self, data):
+        with self._lock:
+            self._queue = list(data)
+            self._stop.set()
+            self._lock.notify()
+        return 0
+
+    def wave_tx_busy(self):
+        return 1 if self._tx != NO_TX_WAVE or self._queue else 0
+
+    def wave_tx_at(self):
+        return self._tx
+
+    def wave_tx_stop(self):
+        with self._lock:
+            self._queue = []
+            self._stop.set()
+            self._lock.notify()
+        return 0
+
+    # Plays queued waves one after another, like the daemon's DMA.  Pulse
+    # times are kept against a running deadline so sleep overhead does not
+    # add up, and a wave queued before the last one ended carries on from it.
+    def _play(self):
+        deadline = None
+
+        while True:
+            with self._lock:
+                if not self._queue:
+                    deadline = None
+                while not self._queue:
+                    self._lock.wait()
+                self._tx = self._queue.pop(0)
+                self._stop.clear()
+                pulses = self._waves.get(self._tx, [])
+
+            if deadline is None:
+                deadline = time.monotonic()
+
+            for wave_pulse in pulses:
+                self._set_levels(wave_pulse.gpio_on, wave_pulse.gpio_off)
+                deadline += wave_pulse.delay / 1000000
+
+                if self._stop.wait(max(deadline - time.monotonic(), 0)):
+                    deadline = None
+                    break
+
+            with self._lock:
+                self._tx = NO_TX_WAVE
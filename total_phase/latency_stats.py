@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# Latency statistics.  Sequential tests and adaptive spacing follow the
+# samples in bounded memory while the capture runs.  LatencyStats summarises a run without
+# keeping its latencies: exact sums for the Results section, a t-digest for
+# percentiles and a log bucketed histogram.  It is saved with each run as
+# latency_stats.json, and any number of them can be merged, so soak runs
+# split over several captures add up to one set of results.
+#
+# usage: python3 latency_stats.py [--save PATH] [--histogram] latency_stats.json ...
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import argparse
+import json
+import math
+import random
+import sys
+
+from fractions import Fraction
+from statistics import NormalDist
+
+from capture import save_json
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+# Confidence level of the intervals used to decide when to stop
+CONFIDENCE = 0.95
+
+# Never stop on fewer samples than this, the normal approximation used for
+# the interval on the mean is poor below it
+MIN_SAMPLES = 30
+
+# t-digest size, about half this many centroids are kept.  Percentiles are
+# most accurate in the tails, p99.9 of a long run is within a few samples.
+DIGEST_COMPRESSION = 200
+
+# Histogram resolution, every bucket is 2^(1/64) (about 1.1%) wider than
+# the one before it, from 1 ns up
+HISTOGRAM_BUCKETS_PER_DOUBLING = 64
+
+# Percentiles shown for saved statistics
+SHOWN_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+# Running mean and variance (Welford), updated one sample at a time
+class RunningStats:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    # Sample variance, same as statistics.variance()
+    def variance(self):
+        if self.n < 2:
+            return math.inf
+        return self._m2 / (self.n - 1)
+
+    def stdev(self):
+        return math.sqrt(self.variance())
+
+
+# Latencies seen so far in a sequential test.  The mean comes from running
+# sums and the percentiles from a LatencyDigest, so memory stays bounded
+# however long the test runs.
+class LatencySamples:
+    def __init__(self, confidence=CONFIDENCE):
+        self.stats = RunningStats()
+        self.digest = LatencyDigest()
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    def add(self, latency):
+        self.stats.add(latency)
+        self.digest.add(latency)
+
+    # Half width of the confidence interval on the mean
+    def mean_half_width(self):
+        if self.stats.n < 2:
+            return math.inf
+        return self.z * self.stats.stdev() / math.sqrt(self.stats.n)
+
+    # Sample quantile
+    def quantile(self, q):
+        return self.digest.quantile(q)
+
+    # Half width of the distribution free confidence interval on the q quantile,
+    # from the binomial ranks around q * n, read off the digest.  inf until there
+    # are enough samples in the tail for the upper rank to exist.
+    def quantile_half_width(self, q):
+        n = self.stats.n
+        spread = self.z * math.sqrt(n * q * (1 - q))
+        lower = math.floor(n * q - spread) - 1
+        upper = math.ceil(n * q + spread) - 1
+
+        if lower < 0 or upper >= n:
+            return math.inf
+        return (self.digest.quantile((upper + 0.5) / n) - self.digest.quantile((lower + 0.5) / n)) / 2
+
+
+# Decides when a sequential latency test has measured enough.  Bounds are
+# half widths in the same units as the samples, quantile_bound is optional.
+class SequentialStop:
+    def __init__(self, mean_bound, quantile_bound=None, quantile=0.99, min_samples=MIN_SAMPLES,
+                 confidence=CONFIDENCE):
+        self.mean_bound = mean_bound
+        self.quantile_bound = quantile_bound
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.samples = LatencySamples(confidence)
+        self.done = False
+
+    # Add a latency, returns True once every bound is met
+    def add(self, latency):
+        self.samples.add(latency)
+
+        if self.samples.stats.n < self.min_samples:
+            return False
+
+        if self.samples.mean_half_width() > self.mean_bound:
+            return False
+
+        if self.quantile_bound is not None and \
+                self.samples.quantile_half_width(self.quantile) > self.quantile_bound:
+            return False
+
+        self.done = True
+        return True
+
+
+# Spacing between trigger edges that adapts to how fast the device answers.
+# Until learn_samples latencies have been seen the fixed window is used.
+# After that the floor is a safe multiple of the observed p99.9, and the
+# random part spans jitter_polls polling intervals so edges still land at
+# random points in the polling cycle.  The spread of the latencies (p99.9
+# minus the fastest) is used as the polling interval, since a response waits
+# anywhere up to one interval for the next IN token.  All times in ms.
+class AdaptiveSpacing:
+    def __init__(self, min_delay, max_delay, learn_samples, multiple, floor, jitter_polls, min_poll=1.0,
+                 rng=random):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.learn_samples = learn_samples
+        self.multiple = multiple
+        self.floor = floor
+        self.jitter_polls = jitter_polls
+        self.min_poll = min_poll
+        self.rng = rng
+        self.samples = LatencySamples()
+
+    def add(self, latency):
+        self.samples.add(latency)
+
+    # Learned (floor, width) of the random window, None while still learning
+    # or if the device is too slow for a shorter window to help
+    def window(self):
+        if self.samples.stats.n < self.learn_samples:
+            return None
+
+        tail = self.samples.quantile(0.999)
+        start = max(self.multiple * tail, self.floor)
+
+        if start >= self.min_delay:
+            return None
+
+        poll = max(tail - self.samples.digest.minimum, self.min_poll)
+        return start, self.jitter_polls * poll
+
+    # Delay before the next edge
+    def delay(self):
+        window = self.window()
+
+        if window is None:
+            return self.rng.randrange(self.min_delay, self.max_delay)
+
+        start, width = window
+        return start + self.rng.uniform(0, width)
+
+
+# Percentiles of a stream of values in bounded memory (a merging t-digest).
+# Values are buffered and merged into centroids, which are kept small in
+# the tails so the high percentiles stay accurate.  Digests merge by
+# pouring one's centroids into the other.
+class LatencyDigest:
+    def __init__(self, compression=DIGEST_COMPRESSION):
+        self.compression = compression
+        # (mean, weight), sorted by mean
+        self.centroids = []
+        self.buffer = []
+        self.count = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value, weight=1):
+        self.buffer.append((value, weight))
+        self.count += weight
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+        if len(self.buffer) >= self.compression * 5:
+            self.compress()
+
+    def merge(self, other):
+        other.compress()
+        self.buffer += other.centroids
+        self.count += other.count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.compress()
+
+    # Centroid size limit, in scale units every centroid spans at most 1
+    def scale(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * min(q, 1) - 1)
+
+    def compress(self):
+        if not self.buffer:
+            return
+
+        items = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        centroids = []
+        done = 0
+        limit = self.scale(0) + 1
+        mean, weight = items[0]
+
+        for next_mean, next_weight in items[1:]:
+            if self.scale((done + weight + next_weight) / self.count) <= limit:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                centroids.append((mean, weight))
+                done += weight
+                limit = self.scale(done / self.count) + 1
+                mean, weight = next_mean, next_weight
+
+        centroids.append((mean, weight))
+        self.centroids = centroids
+
+    # Value at quantile q (0-1), interpolated between centroid centres with
+    # the smallest and largest values at the ends.  None if empty.
+    def quantile(self, q):
+        self.compress()
+
+        if not self.centroids:
+            return None
+
+        target = q * self.count
+        points = [(0, self.minimum)]
+        rank = 0
+
+        for mean, weight in self.centroids:
+            points.append((rank + weight / 2, mean))
+            rank += weight
+
+        points.append((rank, self.maximum))
+
+        for (rank_low, value_low), (rank_high, value_high) in zip(points, points[1:]):
+            if target <= rank_high:
+                if rank_high == rank_low:
+                    return value_high
+                return value_low + (value_high - value_low) * (target - rank_low) / (rank_high - rank_low)
+
+        return self.maximum
+
+    def to_dict(self):
+        self.compress()
+        return {'compression': self.compression, 'count': self.count,
+                'minimum': self.minimum if self.count else None, 'maximum': self.maximum if self.count else None,
+                'centroids': [list(centroid) for centroid in self.centroids]}
+
+    @classmethod
+    def from_dict(cls, details):
+        digest = cls(details['compression'])
+        digest.count = details['count']
+        digest.minimum = details['minimum'] if digest.count else math.inf
+        digest.maximum = details['maximum'] if digest.count else -math.inf
+        digest.centroids = [tuple(centroid) for centroid in details['centroids']]
+        return digest
+
+
+# Counts of values in log sized buckets, buckets_per_doubling buckets for
+# every power of two.  Values below 1 share the zero bucket.
+class LatencyHistogram:
+    def __init__(self, buckets_per_doubling=HISTOGRAM_BUCKETS_PER_DOUBLING):
+        self.buckets_per_doubling = buckets_per_doubling
+        self.zero = 0
+        # bucket index -> count, bucket i holds 2^(i / buckets_per_doubling) up to the next one
+        self.counts = {}
+
+    def add(self, value):
+        if value < 1:
+            self.zero += 1
+            return
+
+        bucket = math.floor(math.log2(value) * self.buckets_per_doubling)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+    def merge(self, other):
+        if other.buckets_per_doubling != self.buckets_per_doubling:
+            raise ValueError(f'Histograms with {self.buckets_per_doubling} and {other.buckets_per_doubling} '
+                             f'buckets per doubling cannot be merged')
+
+        self.zero += other.zero
+
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    # (lower bound, upper bound, count) of every bucket in use, in order
+    def rows(self):
+        rows = [(0, 1, self.zero)] if self.zero else []
+
+        for bucket in sorted(self.counts):
+            rows.append((2 ** (bucket / self.buckets_per_doubling), 2 ** ((bucket + 1) / self.buckets_per_doubling),
+                         self.counts[bucket]))
+
+        return rows
+
+    def to_dict(self):
+        return {'buckets_per_doubling': self.buckets_per_doubling, 'zero': self.zero,
+                'counts': {str(bucket): count for bucket, count in sorted(self.counts.items())}}
+
+    @classmethod
+    def from_dict(cls, details):
+        histogram = cls(details['buckets_per_doubling'])
+        histogram.zero = details['zero']
+        histogram.counts = {int(bucket): count for bucket, count in details['counts'].items()}
+        return histogram
+
+
+# Everything kept about the latencies of a run, in nanoseconds, updated one
+# latency at a time.  Sums are exact fractions (Beagle ticks are a fraction
+# of a nanosecond), so the Results section is the same as it was from the
+# full list, and merged runs give the same average as one long run.
+class LatencyStats:
+    def __init__(self, compression=DIGEST_COMPRESSION, buckets_per_doubling=HISTOGRAM_BUCKETS_PER_DOUBLING):
+        self.count = 0
+        self.total = Fraction(0)
+        self.total_squares = Fraction(0)
+        self.minimum = None
+        self.maximum = None
+        self.digest = LatencyDigest(compression)
+        self.histogram = LatencyHistogram(buckets_per_doubling)
+
+    def add(self, latency):
+        latency = Fraction(latency)
+        self.count += 1
+        self.total += latency
+        self.total_squares += latency * latency
+        self.minimum = latency if self.minimum is None else min(self.minimum, latency)
+        self.maximum = latency if self.maximum is None else max(self.maximum, latency)
+        self.digest.add(float(latency))
+        self.histogram.add(float(latency))
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+
+        self.count += other.count
+        self.total += other.total
+        self.total_squares += other.total_squares
+        self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+        self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+        self.digest.merge(other.digest)
+        self.histogram.merge(other.histogram)
+
+    # Sample variance, same as statistics.variance() of every latency
+    def variance(self):
+        if self.count < 2:
+            raise ValueError(f'Sample variance needs at least two latencies, there are {self.count}')
+
+        return (self.total_squares - self.total * self.total / self.count) / (self.count - 1)
+
+    # Average latency in milliseconds, None without any latencies
+    def average(self):
+        return float(self.total / self.count / 1000000) if self.count else None
+
+    # Min, max, average and sample standard deviation in milliseconds, None
+    # with fewer than two latencies
+    def summary(self):
+        if self.count < 2:
+            return None
+
+        return (float(self.minimum / 1000000), float(self.maximum / 1000000), self.average(),
+                math.sqrt(self.variance() / 1000000000000))
+
+    # Latency at quantile q (0-1) in milliseconds, None without any latencies
+    def quantile(self, q):
+        return self.digest.quantile(q) / 1000000 if self.count else None
+
+    def to_dict(self):
+        return {'count': self.count, 'total': str(self.total), 'total_squares': str(self.total_squares),
+                'minimum': str(self.minimum) if self.minimum is not None else None,
+                'maximum': str(self.maximum) if self.maximum is not None else None,
+                'digest': self.digest.to_dict(), 'histogram': self.histogram.to_dict()}
+
+    @classmethod
+    def from_dict(cls, details):
+        stats = cls()
+        stats.count = details['count']
+        stats.total = Fraction(details['total'])
+        stats.total_squares = Fraction(details['total_squares'])
+        stats.minimum = Fraction(details['minimum']) if details['minimum'] is not None else None
+        stats.maximum = Fraction(details['maximum']) if details['maximum'] is not None else None
+        stats.digest = LatencyDigest.from_dict(details['digest'])
+        stats.histogram = LatencyHistogram.from_dict(details['histogram'])
+        return stats
+
+    def save(self, path):
+        save_json(path, self.to_dict())
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as in_file:
+            return cls.from_dict(json.load(in_file))
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Write the Results section of a results file, summary is None if there
+# were too few clean times for one
+def write_latency_summary(out_file, summary):
+    out_file.write('Results:\n')
+
+    if summary is None:
+        out_file.write('\tNot enough clean times for a summary\n')
+        return
+
+    latency_min, latency_max, latency_avg, latency_stdev = summary
+    out_file.write(f'\tMinimum - {latency_min} ms\n')
+    out_file.write(f'\tMaximum - {latency_max} ms\n')
+    out_file.write(f'\tAverage - {latency_avg} ms\n')
+    out_file.write(f'\tSample Standard Deviation - {latency_stdev} ms\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the latency statistics of saved runs')
+    parser.add_argument('stats_files', nargs='+', help='latency_stats.json files of the runs')
+    parser.add_argument('--save', help='save the merged statistics here')
+    parser.add_argument('--histogram', action='store_true', help='print every histogram bucket in use')
+    args = parser.parse_args()
+
+    merged = LatencyStats()
+
+    for path in args.stats_files:
+        merged.merge(LatencyStats.load(path))
+
+    print(f'{merged.count} clean times from {len(args.stats_files)} statistics files\n')
+    write_latency_summary(sys.stdout, merged.summary())
+
+    if merged.count:
+        for q in SHOWN_QUANTILES:
+            print(f'\tp{q * 100:g} - {merged.quantile(q)} ms')
+
+    if args.histogram:
+        print('\nHistogram:')
+
+        for lower, upper, count in merged.histogram.rows():
+            print(f'\t{lower / 1000000:.6f} - {upper / 1000000:.6f} ms: {count}')
+
+    if args.save:
+        merged.save(args.save)
+        print(f'\nSaved merged statistics to {args.save}')
+
+
+if __name__ == "__main__":
+    main()
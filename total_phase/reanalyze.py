@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# Cleans every run under results/ again with the current cleaning rules,
+# without a Beagle attached.  Each run directory with a raw capture
+# (raw_output.bin, or raw_output.txt for runs saved before it) is read once
+# through the events.py stages, then its clean_output and latency_stats files
+# and the Results sections of its results file are written again.  Runs are
+# spread over every core with a process pool.  With NumPy installed runs are
+# cleaned from arrays with analysis.py instead, which gives the same results.
+#
+# Trigger details come from the results file: the Mask line if there is one,
+# otherwise the nibble position and value (the oldest runs count bytes and
+# give a whole byte as the value).  Runs with only a clean_output.txt have
+# no raw capture to clean and are skipped.
+#
+# usage: python3 reanalyze.py [--processes N] [--dry-run] [results directory]
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import argparse
+import glob
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from fractions import Fraction
+
+from analysis import HAVE_NUMPY, clean_arrays, load_capture, load_lines
+from capture import CaptureReader, ns_per_tick
+from events import ButtonEdges, CleanText, DeviceFilter, LatencyCleaner, LatencySummary, capture_events, line_events, \
+    run_pipeline
+from latency_stats import LatencyStats, write_latency_summary
+from trigger_mask import mask_from_text, nibble_mask
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+RESULTS_DIR = f'{os.path.dirname(os.path.abspath(__file__))}/results'
+
+EXTRA_BUTTON = re.compile(r'Extra Button - (.*) \(digital input (\d+)\)')
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+# One button's section of a results file, the lines before its Results
+class RunButton:
+    def __init__(self, name, beagle_input, lines):
+        self.name = name
+        self.beagle_input = beagle_input
+        self.lines = lines
+        # Average latency the results file had before
+        self.average = None
+
+    # Trigger Button lines, keyed by what follows "Trigger Button "
+    @property
+    def details(self):
+        details = {}
+
+        for line in self.lines:
+            if line.startswith('Trigger Button ') and ':' in line:
+                key, value = line[len('Trigger Button '):].split(':', 1)
+                details[key] = value.strip()
+
+        return details
+
+    @property
+    def trigger_length(self):
+        return int(self.details['Packet Length'])
+
+    # The Mask line, or the nibble position and value of older results
+    @property
+    def trigger_mask(self):
+        if self.details.get('Mask'):
+            return mask_from_text(self.details['Mask'])
+
+        value = self.details['Value']
+        return nibble_mask(self.details['Position'], value, byte_positions=len(value) == 2)
+
+    @property
+    def clean_output(self):
+        return 'clean_output.txt' if self.beagle_input == 1 else f'clean_output-input{self.beagle_input}.txt'
+
+    @property
+    def stats_output(self):
+        return 'latency_stats.json' if self.beagle_input == 1 else f'latency_stats-input{self.beagle_input}.json'
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Every directory with a results file and a raw capture, and those without a raw capture
+def find_runs(results_dir):
+    runs = []
+    skipped = []
+
+    for results in sorted(glob.glob(f'{results_dir}/**/results-*.txt', recursive=True)):
+        run_dir = os.path.dirname(results)
+
+        if run_dir in runs or run_dir in skipped:
+            continue
+
+        if run_source(run_dir):
+            runs.append(run_dir)
+        else:
+            skipped.append(run_dir)
+
+    return runs, skipped
+
+
+# The capture a run is cleaned from, the raw capture if there is one.  With
+# clean_output, runs saved with only a clean_output.txt are cleaned from that.
+def run_source(run_dir, clean_output=False):
+    for source in ('raw_output.bin', 'raw_output.txt') + (('clean_output.txt',) if clean_output else ()):
+        if os.path.exists(f'{run_dir}/{source}'):
+            return source
+
+    return None
+
+
+# Events of a capture, text captures are only open while they are read
+def source_events(path):
+    if path.endswith('.bin'):
+        yield from capture_events(path)
+        return
+
+    with open(path) as in_file:
+        # clean_output.txt lines have no length field
+        if os.path.basename(path) == 'clean_output.txt':
+            yield from line_events(line.replace(',', ',0,', 1) for line in in_file)
+        else:
+            yield from line_events(in_file)
+
+
+# Events of a run's capture, its nanoseconds per tick, and the DeviceFilter
+# to feed them to.  Text captures are already in nanoseconds, and have no
+# device addresses to filter on.
+def open_run(run_dir, source, buttons, device):
+    path = f'{run_dir}/{source}'
+
+    if not source.endswith('.bin'):
+        return source_events(path), Fraction(1), DeviceFilter()
+
+    with CaptureReader(path) as reader:
+        scale = ns_per_tick(reader.samplerate_khz)
+        buttons[0].beagle_input = reader.metadata.get('beagle_input', 1)
+
+    address = int(device['Device Address']) if device.get('Device Address') else None
+    endpoint = int(device['Endpoint']) if device.get('Endpoint') else None
+
+    return source_events(path), scale, DeviceFilter(address, endpoint)
+
+
+# Buttons of a results file, the trigger button first, and the device
+# address and endpoint line values
+def read_results(path):
+    buttons = [RunButton('', 1, [])]
+    device = {}
+    in_results = False
+
+    with open(path) as in_file:
+        for line in in_file:
+            line = line.rstrip('\n')
+            match = EXTRA_BUTTON.match(line)
+
+            if match:
+                buttons.append(RunButton(match.group(1), int(match.group(2)), [line]))
+                in_results = False
+
+            elif line.startswith('Results:') or line.startswith('Clean Times -'):
+                in_results = True
+
+            elif in_results:
+                if line.strip().startswith('Average - '):
+                    buttons[-1].average = line.split(' - ', 1)[1]
+
+            else:
+                buttons[-1].lines.append(line)
+
+                for key in ('Device Address', 'Endpoint'):
+                    if line.startswith(f'{key}:'):
+                        device[key] = line.split(':', 1)[1].strip()
+
+    buttons[0].name = buttons[0].details.get('Name', '')
+    return buttons, device
+
+
+# Rewrite a results file with new Results sections, keeping everything
+# the capture wrote about itself
+def write_results(path, buttons, summaries):
+    with open(path, 'w') as out_file:
+        header = [line for line in buttons[0].lines if not line.startswith('Reanalyzed - ')]
+
+        while header and not header[-1]:
+            header.pop()
+
+        for line in header:
+            out_file.write(f'{line}\n')
+
+        out_file.write(f'Reanalyzed - {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}\n')
+        out_file.write('\n')
+        write_latency_summary(out_file, summaries[0][1])
+
+        for button, (count, summary) in zip(buttons[1:], summaries[1:]):
+            out_file.write('\n')
+
+            for line in button.lines:
+                if line:
+                    out_file.write(f'{line}\n')
+
+            out_file.write(f'Clean Times - {count}\n')
+            write_latency_summary(out_file, summary)
+
+
+# Clean every button from the events of a run, each button's clean lines go
+# to its out_file.  Returns a LatencyStats per button.
+def clean_events(events, buttons, device_filter, scale, out_files):
+    stats = []
+
+    for button, out_file in zip(buttons, out_files):
+        cleaner = device_filter.subscribe(ButtonEdges(button.beagle_input)).subscribe(
+            LatencyCleaner(button.trigger_mask, button.trigger_length))
+        cleaner.subscribe(CleanText(out_file, scale))
+        stats.append(cleaner.subscribe(LatencySummary(scale)).stats)
+
+    run_pipeline(events, device_filter)
+    return stats
+
+
+# Same as clean_events() from the arrays of analysis.py.  A binary capture is
+# loaded once per button, with that button's digital input as the edges.
+def clean_arrays_run(path, buttons, device_filter, scale, out_files):
+    stats = []
+
+    if not path.endswith('.bin'):
+        with open(path) as in_file:
+            arrays = load_lines(in_file)
+
+    for button, out_file in zip(buttons, out_files):
+        if path.endswith('.bin'):
+            arrays = load_capture(path, device_filter.address, device_filter.endpoint, button.beagle_input)
+
+        kept, latencies = clean_arrays(arrays, button.trigger_mask, button.trigger_length)
+
+        for line in arrays.clean_lines(kept, scale if path.endswith('.bin') else None):
+            out_file.write(f'{line}\n')
+
+        button_stats = LatencyStats()
+
+        for latency in latencies.tolist():
+            button_stats.add(latency * scale)
+
+        stats.append(button_stats)
+
+    return stats
+
+
+# Clean one run again.  Everything is written to temporary files first and
+# only replaces the old files once every button has been cleaned.  On an
+# error only the temporary files this run created are removed.
+# Returns (run directory, [(button name, clean times, old average, new summary)], error)
+def reanalyze_run(run_dir, dry_run=False):
+    temp_files = []
+
+    try:
+        results = sorted(glob.glob(f'{run_dir}/results-*.txt'))[0]
+        buttons, device = read_results(results)
+        source = run_source(run_dir)
+        events, scale, device_filter = open_run(run_dir, source, buttons, device)
+        out_files = []
+
+        try:
+            for button in buttons:
+                if dry_run:
+                    out_files.append(open(os.devnull, 'w'))
+                else:
+                    temp_files.append(f'{run_dir}/{button.clean_output}.tmp')
+                    out_files.append(open(temp_files[-1], 'w'))
+
+            # Text captures with extra buttons name every input level, only events.py turns those into edges
+            if HAVE_NUMPY and (source.endswith('.bin') or len(buttons) == 1):
+                stats = clean_arrays_run(f'{run_dir}/{source}', buttons, device_filter, scale, out_files)
+            else:
+                stats = clean_events(events, buttons, device_filter, scale, out_files)
+
+        finally:
+            for out_file in out_files:
+                out_file.close()
+
+        summaries = []
+
+        for button, button_stats in zip(buttons, stats):
+            if button_stats.count < 2:
+                raise ValueError(f'only {button_stats.count} clean times for button {button.name}')
+
+            summaries.append((button_stats.count, button_stats.summary()))
+
+        if not dry_run:
+            temp_files.append(f'{results}.tmp')
+            write_results(temp_files[-1], buttons, summaries)
+
+            for button, button_stats in zip(buttons, stats):
+                temp_files.append(f'{run_dir}/{button.stats_output}.tmp')
+                button_stats.save(temp_files[-1])
+
+            for button in buttons:
+                os.replace(f'{run_dir}/{button.clean_output}.tmp', f'{run_dir}/{button.clean_output}')
+                os.replace(f'{run_dir}/{button.stats_output}.tmp', f'{run_dir}/{button.stats_output}')
+
+            os.replace(f'{results}.tmp', results)
+
+        return run_dir, [(button.name, count, button.average, summary)
+                         for button, (count, summary) in zip(buttons, summaries)], None
+
+    except (OSError, ValueError, KeyError, IndexError) as error:
+        for temp_file in temp_files:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+        return run_dir, [], str(error)
+
+
+def dry_run_reanalyze(run_dir):
+    return reanalyze_run(run_dir, True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Clean saved runs again without a Beagle attached')
+    parser.add_argument('results_dir', nargs='?', default=RESULTS_DIR, help='directory searched for runs')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes, one per core by default')
+    parser.add_argument('--dry-run', action='store_true', help='print the new results without writing anything')
+    args = parser.parse_args()
+
+    runs, skipped = find_runs(args.results_dir)
+
+    for run_dir in skipped:
+        print(f'{os.path.relpath(run_dir, args.results_dir)} - skipped, no raw capture')
+
+    failed = 0
+    start = time.time()
+
+    with multiprocessing.Pool(args.processes) as pool:
+        for run_dir, buttons, error in pool.imap_unordered(dry_run_reanalyze if args.dry_run else reanalyze_run,
+                                                           runs):
+            run = os.path.relpath(run_dir, args.results_dir)
+
+            if error:
+                print(f'{run} - failed, {error}')
+                failed += 1
+                continue
+
+            for name, count, old_average, summary in buttons:
+                print(f'{run} - button {name}: {count} clean times, average {summary[2]} ms '
+                      f'(was {old_average or "unknown"})')
+
+    print(f'\n{len(runs) - failed} of {len(runs)} runs cleaned again in {round(time.time() - start, 2)}s.')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import multiprocessing
+import struct
+
+from multiprocessing import shared_memory
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+# Values shared by the reading process through the start of the shared memory
+CONTROL_FIELDS = ('samplerate_khz', 'host_speed', 'overflows', 'high_water', 'host_buffer_size',
+                  'host_buffer_high_water', 'host_buffer_abort')
+CONTROL = struct.Struct('<7I')
+
+# length, status, events, time_sop, time_duration, time_dataoffset
+SLOT_HEADER = struct.Struct('<iIIQQI')
+
+# How long either side waits before checking if the capture was stopped
+POLL_TIMEOUT = 0.5
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+# Shared memory ring buffer between the process reading the Beagle and
+# the process decoding packets.  Every slot is allocated up front, and the
+# two semaphores count filled and free slots so neither side spins.
+#
+# If the reader finds the ring full it counts an overflow and waits for
+# the decoder, leaving packets in the Beagle host buffer until there is
+# room again.
+class PacketRing:
+    def __init__(self, slots, slot_size):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ready = multiprocessing.Event()
+        self.stop = multiprocessing.Event()
+
+        self._slot_stride = SLOT_HEADER.size + slot_size
+        self._shm = shared_memory.SharedMemory(create=True, size=CONTROL.size + slots * self._slot_stride)
+        self._items = multiprocessing.Semaphore(0)
+        self._spaces = multiprocessing.Semaphore(slots)
+
+        # Each side only ever touches its own index
+        self._write_index = 0
+        self._read_index = 0
+        self._control = dict.fromkeys(CONTROL_FIELDS, 0)
+        self._overflows = 0
+        self._high_water = 0
+
+        self._update_counters()
+
+    def __getattr__(self, attr):
+        if attr in CONTROL_FIELDS:
+            values = CONTROL.unpack_from(self._shm.buf, 0)
+            return values[CONTROL_FIELDS.index(attr)]
+        raise AttributeError("%s not an attribute of PacketRing" % attr)
+
+    # Producer side, called once the Beagle is configured
+    def set_info(self, samplerate_khz, host_speed, host_buffer_size):
+        self._control.update(samplerate_khz=samplerate_khz, host_speed=host_speed, host_buffer_size=host_buffer_size)
+        self._update_counters()
+        self.ready.set()
+
+    # Producer side, publish the Beagle host buffer monitoring results
+    def set_host_buffer(self, high_water, abort):
+        self._control.update(host_buffer_high_water=high_water, host_buffer_abort=abort)
+        self._update_counters()
+
+    # Producer side, copy one bg_usb2_read() result into the next free slot.
+    # Returns False if the capture was stopped while waiting for room.
+    def put(self, length, status, events, time_sop, time_duration, time_dataoffset, data):
+        if not self._spaces.acquire(block=False):
+            self._overflows += 1
+            self._update_counters()
+
+            while not self._spaces.acquire(timeout=POLL_TIMEOUT):
+                if self.stop.is_set():
+                    self._update_counters()
+                    return False
+
+        offset = CONTROL.size + self._write_index * self._slot_stride
+        buf = self._shm.buf
+        SLOT_HEADER.pack_into(buf, offset, length, status, events, time_sop, time_duration, time_dataoffset)
+
+        if length > 0:
+            offset += SLOT_HEADER.size
+            buf[offset:offset + length] = memoryview(data)[:length]
+
+        self._write_index = (self._write_index + 1) % self.slots
+
+        used = self.slots - self._spaces.get_value()
+        if used > self._high_water:
+            self._high_water = used
+            self._update_counters()
+
+        self._items.release()
+
+        return True
+
+    # Producer side, publish the overflow and high water counters
+    def _update_counters(self):
+        self._control.update(overflows=self._overflows, high_water=self._high_water)
+        CONTROL.pack_into(self._shm.buf, 0, *[self._control[field] for field in CONTROL_FIELDS])
+
+    # Consumer side, fill a PacketInfo from the oldest slot.
+    # Returns False if nothing arrived within the timeout.
+    def get(self, packet, timeout=POLL_TIMEOUT):
+        if not self._items.acquire(timeout=timeout):
+            return False
+
+        offset = CONTROL.size + self._read_index * self._slot_stride
+        buf = self._shm.buf
+        (packet.length, packet.status, packet.events, packet.time_sop, packet.time_duration,
+         packet.time_dataoffset) = SLOT_HEADER.unpack_from(buf, offset)
+
+        if packet.length > 0:
+            offset += SLOT_HEADER.size
+            memoryview(packet.data)[:packet.length] = buf[offset:offset + packet.length]
+
+        self._read_index = (self._read_index + 1) % self.slots
+        self._spaces.release()
+
+        return True
+
+    def close(self, unlink=False):
+        self._shm.close()
+
+        if unlink:
+            self._shm.unlink()
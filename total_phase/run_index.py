@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# SQLite index of every run and every clean time, so devices can be compared
+# with one query instead of opening results files by hand.
+#
+#   runs     a row per run directory: device details, sample rate, when it ran
+#   buttons  a row per button of a run: trigger mask, packet length, clean times
+#   samples  a row per clean time: sequence number, edge direction (pressed or
+#            released), trigger and response ticks, latency in nanoseconds,
+#            and its rank among the button's latencies
+#
+# Ticks are Beagle ticks for runs with a raw_output.bin (runs.samplerate_khz
+# gives their length) and nanoseconds for older text captures.  Runs are
+# only read again when their results file or capture changes, so the index
+# can be updated after every test.  Runs with only a clean_output.txt are
+# indexed from it.
+#
+# Quantiles never sort the samples.  Each button's rank index gives how many
+# of its latencies are at or under a value with one lookup, and the quantile
+# of a group is found by bisecting on the value.
+#
+# usage: python3 run_index.py [--db PATH] [results directory ...]
+#        python3 run_index.py [--db PATH] --quantile 0.95 --by version [--vendor-id 045e] [--product-id 0b12]
+#                             [--button RB]
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from fractions import Fraction
+
+from capture import CaptureReader, ns_per_tick, ticks_to_ns
+from events import ButtonEdges, LatencyCleaner, ResponseLog, run_pipeline
+from reanalyze import RESULTS_DIR, open_run, read_results, run_source
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+RUN_INDEX = f'{os.path.dirname(os.path.abspath(__file__))}/run_index.sqlite'
+
+# Bumped whenever the tables change.  The index can always be built again
+# from the results, so an index made by an older version is started over.
+SCHEMA_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_dir TEXT NOT NULL UNIQUE,
+    stamp TEXT NOT NULL,
+    source TEXT NOT NULL,
+    run_time TEXT,
+    vendor_id TEXT,
+    product_id TEXT,
+    manufacturer TEXT,
+    product TEXT,
+    version TEXT,
+    serial TEXT,
+    speed TEXT,
+    samplerate_khz INTEGER,
+    triggers_sent INTEGER,
+    trigger_seed TEXT,
+    device_address TEXT,
+    endpoint TEXT
+);
+CREATE TABLE IF NOT EXISTS buttons (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT,
+    beagle_input INTEGER,
+    trigger_offset INTEGER,
+    trigger_mask INTEGER,
+    trigger_on INTEGER,
+    trigger_off INTEGER,
+    trigger_length INTEGER,
+    clean_times INTEGER,
+    average_ms REAL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    button_id INTEGER NOT NULL REFERENCES buttons(id) ON DELETE CASCADE,
+    sequence INTEGER NOT NULL,
+    pressed INTEGER NOT NULL,
+    trigger_tick INTEGER NOT NULL,
+    response_tick INTEGER NOT NULL,
+    latency_ns INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    PRIMARY KEY (button_id, sequence)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_device ON runs(vendor_id, product_id, version);
+CREATE INDEX IF NOT EXISTS runs_time ON runs(run_time);
+CREATE INDEX IF NOT EXISTS buttons_run ON buttons(run_id);
+CREATE INDEX IF NOT EXISTS samples_rank ON samples(button_id, latency_ns, rank);
+'''
+
+# Dropped from an index made by an older version, children first
+OLD_TABLES = ('samples', 'buttons', 'runs')
+
+# runs columns a quantile query can be grouped by
+GROUP_COLUMNS = ('vendor_id', 'product_id', 'manufacturer', 'product', 'version', 'serial', 'speed', 'run_dir')
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+def connect(db_path=RUN_INDEX):
+    # Rig tests add their runs from several processes at once
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA foreign_keys = ON')
+
+    # Only one of them checks and sets up the tables at a time
+    conn.execute('BEGIN IMMEDIATE')
+
+    if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+        for table in OLD_TABLES:
+            conn.execute(f'DROP TABLE IF EXISTS {table}')
+
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    for statement in SCHEMA.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+    conn.commit()
+    return conn
+
+
+# Changes whenever the results file or the capture of a run is written again
+def run_stamp(run_dir, results, source):
+    stats = [os.stat(path) for path in (results, f'{run_dir}/{source}')]
+    return ','.join(f'{stat.st_mtime_ns}:{stat.st_size}' for stat in stats)
+
+
+# When a run was started, from its .../date/[job/]time directory names
+def run_time(run_dir):
+    parts = os.path.normpath(run_dir).split(os.sep)
+    dates = [i for i, part in enumerate(parts) if re.fullmatch(r'\d{8}', part)]
+
+    if not dates:
+        return None
+
+    date = parts[dates[-1]]
+    times = [part for part in parts[dates[-1] + 1:] if re.fullmatch(r'\d{6}', part)]
+    stamp = f'{date[:4]}-{date[4:6]}-{date[6:]}'
+
+    return f'{stamp} {times[0][:2]}:{times[0][2:4]}:{times[0][4:]}' if times else stamp
+
+
+# "Key - value" lines of a results file header, blank values left out
+def header_fields(lines):
+    fields = {}
+
+    for line in lines:
+        if ' - ' in line and not line.startswith('\t'):
+            key, value = line.split(' - ', 1)
+
+            if value.strip():
+                fields[key.strip()] = value.strip()
+
+    return fields
+
+
+# Add a run to the index, or replace it if it changed since it was added.
+# responses are each button's (pressed, trigger tick, response tick) in the
+# results file's order, as ResponseLog stages collected them while the run
+# was cleaned.  Without them the capture is read and cleaned here.
+# Returns True if the run was read.
+def index_run(conn, run_dir, responses=None):
+    run_dir = os.path.realpath(run_dir)
+    results = sorted(glob.glob(f'{run_dir}/results-*.txt'))[0]
+    source = run_source(run_dir, clean_output=True)
+    stamp = run_stamp(run_dir, results, source)
+    row = conn.execute('SELECT id, stamp FROM runs WHERE run_dir = ?', (run_dir,)).fetchone()
+
+    if row is not None and row[1] == stamp:
+        return False
+
+    buttons, device = read_results(results)
+
+    if responses is None:
+        events, scale, device_filter = open_run(run_dir, source, buttons, device)
+        logs = []
+
+        for button in buttons:
+            logs.append(device_filter.subscribe(ButtonEdges(button.beagle_input)).subscribe(
+                LatencyCleaner(button.trigger_mask, button.trigger_length)).subscribe(ResponseLog()))
+
+        run_pipeline(events, device_filter)
+        responses = [log.responses for log in logs]
+
+    samplerate_khz = None
+    scale = Fraction(1)
+
+    if source.endswith('.bin'):
+        with CaptureReader(f'{run_dir}/{source}') as reader:
+            samplerate_khz = reader.samplerate_khz
+            scale = ns_per_tick(samplerate_khz)
+            buttons[0].beagle_input = reader.metadata.get('beagle_input', 1)
+
+    fields = header_fields(buttons[0].lines)
+    vendor_id, _, product_id = fields.get('Device ID', ':').partition(':')
+    triggers_sent = fields.get('Triggers sent')
+
+    if row is not None:
+        conn.execute('DELETE FROM runs WHERE id = ?', (row[0],))
+
+    run_id = conn.execute(
+        'INSERT INTO runs (run_dir, stamp, source, run_time, vendor_id, product_id, manufacturer, product, version, '
+        'serial, speed, samplerate_khz, triggers_sent, trigger_seed, device_address, endpoint) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (run_dir, stamp, source, run_time(run_dir), vendor_id or None, product_id or None, fields.get('Manufacturer'),
+         fields.get('Product'), fields.get('Version'), fields.get('Serial'),
+         fields.get('Speed', '').replace(' Mbit/s', '') or None, samplerate_khz,
+         int(triggers_sent) if triggers_sent else None, fields.get('Trigger Seed'), device.get('Device Address'),
+         device.get('Endpoint'))).lastrowid
+
+    for button, button_responses in zip(buttons, responses):
+        trigger_mask = button.trigger_mask
+        latencies = [ticks_to_ns(response - trigger, scale) for pressed, trigger, response in button_responses]
+        average_ms = sum(latencies) / len(latencies) / 1000000 if latencies else None
+        ranks = [0] * len(latencies)
+
+        for rank, sequence in enumerate(sorted(range(len(latencies)), key=latencies.__getitem__), start=1):
+            ranks[sequence] = rank
+
+        button_id = conn.execute(
+            'INSERT INTO buttons (run_id, name, beagle_input, trigger_offset, trigger_mask, trigger_on, trigger_off, '
+            'trigger_length, clean_times, average_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (run_id, button.name, button.beagle_input, trigger_mask.offset, trigger_mask.mask, trigger_mask.on,
+             trigger_mask.off, button.trigger_length, len(latencies), average_ms)).lastrowid
+
+        conn.executemany(
+            'INSERT INTO samples (button_id, sequence, pressed, trigger_tick, response_tick, latency_ns, rank) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((button_id, sequence, int(pressed), trigger, response, latency, rank)
+             for sequence, ((pressed, trigger, response), latency, rank)
+             in enumerate(zip(button_responses, latencies, ranks))))
+
+    return True
+
+
+# Index every run under a directory, and drop runs under it that are gone.
+# Returns (runs read, runs unchanged, runs dropped, [(run directory, error)])
+def index_tree(conn, root):
+    root = os.path.realpath(root)
+    run_dirs = sorted({os.path.dirname(results)
+                       for results in glob.glob(f'{root}/**/results-*.txt', recursive=True)})
+    read = unchanged = 0
+    errors = []
+
+    for run_dir in run_dirs:
+        if run_source(run_dir, clean_output=True) is None:
+            continue
+
+        try:
+            if index_run(conn, run_dir):
+                read += 1
+            else:
+                unchanged += 1
+
+            conn.commit()
+
+        except (OSError, ValueError, KeyError, IndexError) as error:
+            conn.rollback()
+            errors.append((run_dir, str(error)))
+
+    dropped = 0
+
+    for run_id, run_dir in conn.execute('SELECT id, run_dir FROM runs').fetchall():
+        if run_dir.startswith(f'{root}{os.sep}') and not glob.glob(f'{run_dir}/results-*.txt'):
+            conn.execute('DELETE FROM runs WHERE id = ?', (run_id,))
+            dropped += 1
+
+    conn.commit()
+    return read, unchanged, dropped, errors
+
+
+# Add a run to the index at db_path, as latency_test() in
+# bg480_collect-raspi.py does after each test with the responses it paired
+def add_run(db_path, run_dir, responses=None):
+    conn = connect(db_path)
+
+    try:
+        index_run(conn, run_dir, responses)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# Nearest rank quantile of the latencies in each group of runs, as
+# (group, samples, latency in ms).  filters are runs columns (or button for
+# the button name) that have to match.
+def latency_quantiles(conn, quantile, by='version', filters=None):
+    if by not in GROUP_COLUMNS:
+        raise ValueError(f'Runs can only be grouped by {", ".join(GROUP_COLUMNS)}')
+
+    where = []
+    values = {}
+
+    for column, value in (filters or {}).items():
+        if column == 'button':
+            where.append('buttons.name = :button')
+        elif column in GROUP_COLUMNS:
+            where.append(f'runs.{column} = :{column}')
+        else:
+            raise ValueError(f'Unknown filter {column}')
+
+        values[column] = value
+
+    group_buttons = f'''
+        SELECT buttons.id AS id FROM buttons
+        JOIN runs ON runs.id = buttons.run_id
+        WHERE {" AND ".join(where + [f"runs.{by} IS :group"])}'''
+
+    # How many latencies of the group are at or under :latency, one rank lookup per button
+    count_query = f'''
+        SELECT TOTAL((SELECT rank FROM samples WHERE button_id = grp.id AND latency_ns <= :latency
+                      ORDER BY latency_ns DESC, rank DESC LIMIT 1))
+        FROM ({group_buttons}) AS grp'''
+
+    range_query = f'''
+        SELECT MIN((SELECT latency_ns FROM samples WHERE button_id = grp.id ORDER BY latency_ns LIMIT 1)),
+               MAX((SELECT latency_ns FROM samples WHERE button_id = grp.id ORDER BY latency_ns DESC LIMIT 1))
+        FROM ({group_buttons}) AS grp'''
+
+    groups = conn.execute(f'''
+        SELECT runs.{by}, SUM(buttons.clean_times) FROM buttons
+        JOIN runs ON runs.id = buttons.run_id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        GROUP BY runs.{by} ORDER BY runs.{by}''', values).fetchall()
+
+    rows = []
+
+    for group, total in groups:
+        if not total:
+            continue
+
+        group_values = {**values, 'group': group}
+        rank = max(1, int(total * quantile + 0.999999999))
+        low, high = conn.execute(range_query, group_values).fetchone()
+
+        # Smallest latency with at least rank latencies at or under it, which is always one of them
+        while low < high:
+            middle = (low + high) // 2
+
+            if conn.execute(count_query, {**group_values, 'latency': middle}).fetchone()[0] >= rank:
+                high = middle
+            else:
+                low = middle + 1
+
+        rows.append((group, total, low / 1000000.0))
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite index of every run and clean time')
+    parser.add_argument('results_dirs', nargs='*', default=[RESULTS_DIR], help='directories searched for runs')
+    parser.add_argument('--db', default=RUN_INDEX, help='index database')
+    parser.add_argument('--quantile', type=float, help='print this latency quantile (0-1) instead of indexing')
+    parser.add_argument('--by', default='version', choices=GROUP_COLUMNS, help='group runs by this column')
+    parser.add_argument('--vendor-id', help='only runs of this vendor ID')
+    parser.add_argument('--product-id', help='only runs of this product ID')
+    parser.add_argument('--button', help='only this button')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+
+    try:
+        if args.quantile is not None:
+            filters = {column: value for column, value in (('vendor_id', args.vendor_id),
+                                                           ('product_id', args.product_id),
+                                                           ('button', args.button)) if value}
+            start = time.perf_counter()
+            rows = latency_quantiles(conn, args.quantile, args.by, filters)
+
+            for group, total, latency_ms in rows:
+                print(f'{group} - p{round(args.quantile * 100, 3):g} {latency_ms} ms over {total} clean times')
+
+            print(f'\n{len(rows)} groups in {round((time.perf_counter() - start) * 1000, 2)} ms.')
+            return
+
+        failed = False
+
+        for results_dir in args.results_dirs:
+            read, unchanged, dropped, errors = index_tree(conn, results_dir)
+            print(f'{results_dir} - {read} runs read, {unchanged} unchanged, {dropped} dropped')
+
+            for run_dir, error in errors:
+                print(f'\t{run_dir} - failed, {error}')
+                failed = True
+
+        sys.exit(1 if failed else 0)
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import random
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+# Edge levels, the pins start high (trigger off) and alternate from there
+LEVEL_ON = 'ON'
+LEVEL_OFF = 'OFF'
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Seed for a capture that was not given one, saved with the schedule so it can be replayed
+def new_seed():
+    return random.SystemRandom().randrange(2 ** 32)
+
+
+# Delay in microseconds before each trigger edge, picked the same way
+# trigger_on() always has, between min_delay and max_delay milliseconds.
+# The same seed always gives the same schedule.
+def make_schedule(edges, min_delay, max_delay, seed):
+    rng = random.Random(seed)
+    return [rng.randrange(min_delay, max_delay) * 1000 for i in range(edges)]
+
+
+# Level each edge leaves the trigger in.  Even edges pull the pins high
+# (trigger released), odd edges pull them low (trigger pressed), same order
+# as trigger_on().
+def edge_level(edge):
+    return LEVEL_OFF if edge % 2 == 0 else LEVEL_ON
+
+
+# Beagle digital input of the button each edge belongs to.  With several
+# buttons each one is pressed and released in turn, edge 0 only makes sure
+# every button starts released.
+def edge_input(edge, inputs):
+    return inputs[max(edge - 1, 0) // 2 % len(inputs)]
+
+
+# Save the schedule so the intended time of every edge is known afterwards,
+# and so it can be replayed.  time_us is counted from the start of the schedule.
+def save_schedule(path, delays, seed, inputs=(1,)):
+    time_us = 0
+
+    with open(path, 'w') as out_file:
+        out_file.write(f'# seed {seed}\n')
+        out_file.write('edge,level,delay_us,time_us,input\n')
+
+        for edge, delay in enumerate(delays):
+            time_us += delay
+            out_file.write(f'{edge},{edge_level(edge)},{delay},{time_us},{edge_input(edge, inputs)}\n')
+
+
+# Read back a saved schedule, returns (seed, delays)
+def load_schedule(path):
+    seed = None
+    delays = []
+
+    with open(path) as in_file:
+        for line in in_file:
+            if line.startswith('# seed '):
+                seed = int(line.split()[2])
+            elif line[0].isdigit():
+                delays.append(int(line.split(',')[2]))
+
+    return seed, delays
@@ -0,0 +1,38 @@
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# The scripts import each other as top level modules, same as running them from total_phase
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'results')
+COLLECT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bg480_collect-raspi.py')
+
+
+##==========================================================================
+# FIXTURES
+##==========================================================================
+# A fresh copy of bg480_collect-raspi.py for each test, on the simulated
+# analyzers and pigpio, with nothing written next to the scripts
+@pytest.fixture
+def collect(monkeypatch, tmp_path):
+    monkeypatch.setenv('FAKE_BEAGLE', '1')
+    monkeypatch.setenv('FAKE_PIGPIO', '1')
+
+    spec = importlib.util.spec_from_file_location('bg480_collect_raspi', COLLECT_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    module.CALIBRATION_CACHE = str(tmp_path / 'calibration_cache.json')
+    module.RUN_INDEX = ''
+    module.output_dir = str(tmp_path / 'output')
+
+    return module
@@ -0,0 +1,134 @@
+# Checks CollapseEngine against the if/elif state machine usb_dump() used
+# before it, on streams rebuilt from the captures in results/ and on short
+# streams that stop anywhere in a sequence.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import glob
+import itertools
+import os
+
+import pytest
+
+from bench_collapse import (IDLE_SAMPLES, PID_DATA0, PID_DATA1, QUEUE_SIZE, BenchQueue, engine_collapse,
+                            legacy_collapse, make_stream)
+from collapse import *
+from conftest import RESULTS_DIR
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+CAPTURES = sorted(glob.glob(os.path.join(RESULTS_DIR, '*', '*', '*', 'raw_output.txt')))
+
+# Beagle ticks per nanosecond, at the 60 MHz sample rate usb_dump() uses
+TICKS_PER_NS = 0.06
+
+# Polls shown between two captured packets, one per 125us microframe.  The
+# captures only kept what was output, the collapsed traffic is put back.
+MAX_POLLS = 8
+MICROFRAME = 7500
+
+# Every PID the collapsing looks at, plus DATA and a trigger event (0)
+PIDS = (0, KEEP_ALIVE, PID_SOF, PID_IN, PID_OUT, PID_SETUP, PID_PING, PID_SPLIT, PID_ACK, PID_NAK, PID_NYET,
+        PID_DATA0)
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Turn a raw_output.txt back into the packets the Beagle saw: every DATA
+# packet as IN DATA ACK, triggers as input events, and SOF plus IN/NAK
+# polling leading up to each of them
+def capture_stream(path):
+    stream = []
+    last = 0
+
+    with open(path) as in_file:
+        for line in in_file:
+            fields = line.split(',')
+            time_sop = int(int(fields[0]) * TICKS_PER_NS) + MAX_POLLS * MICROFRAME
+
+            polls = min(MAX_POLLS, (time_sop - last) // MICROFRAME)
+            for i in range(polls, 0, -1):
+                poll_time = time_sop - i * MICROFRAME
+                stream += [(PID_SOF, poll_time), (PID_IN, poll_time + 20), (PID_NAK, poll_time + 40)]
+
+            if fields[2].startswith('DATA'):
+                pid = PID_DATA0 if fields[2] == 'DATA0' else PID_DATA1
+                stream += [(PID_IN, time_sop), (pid, time_sop + 20), (PID_ACK, time_sop + 40)]
+            else:
+                stream.append((0, time_sop))
+
+            last = time_sop + 40
+
+    return stream
+
+
+@pytest.mark.parametrize('path', CAPTURES, ids=lambda path: os.path.relpath(path, RESULTS_DIR))
+def test_captures(path):
+    stream = capture_stream(path)
+
+    assert engine_collapse(stream) == legacy_collapse(stream)
+
+
+def test_generated_stream():
+    stream = make_stream(20000, 1)
+
+    assert engine_collapse(stream) == legacy_collapse(stream)
+
+
+def test_empty_stream():
+    pkt_q = BenchQueue()
+    engine = CollapseEngine(pkt_q, IDLE_SAMPLES)
+
+    assert engine_collapse([]) == legacy_collapse([]) == []
+    assert engine.state == IDLE
+    assert not any(engine.count)
+    assert engine.summary() == ''
+
+
+@pytest.mark.parametrize('pid', PIDS)
+def test_single_packet(pid):
+    stream = [(pid, 1)]
+
+    assert engine_collapse(stream) == legacy_collapse(stream)
+
+
+# Every short stream, so each one stops part way through some sequence
+@pytest.mark.parametrize('length', (1, 2, 3))
+def test_short_streams(length):
+    for pids in itertools.product(PIDS, repeat=length):
+        stream = [(pid, i * MICROFRAME + 1) for i, pid in enumerate(pids)]
+
+        assert engine_collapse(stream) == legacy_collapse(stream), pids
+
+
+# A capture ending in the middle of a sequence leaves its packets saved in
+# the queue, and the end of capture clear() drops the counts
+def test_ends_mid_collapse():
+    stream = [(PID_SOF, 1), (PID_IN, 2), (PID_NAK, 3), (PID_SPLIT, 4), (PID_IN, 5)]
+    pkt_q = BenchQueue()
+    engine = CollapseEngine(pkt_q, IDLE_SAMPLES)
+
+    for pid, time_sop in stream:
+        assert not engine.step(pid, time_sop)
+
+    assert engine_collapse(stream) == legacy_collapse(stream)
+    assert engine.state == SPLIT_IN
+    assert engine.count[SOF] == engine.count[IN_NAK] == 1
+    assert (pkt_q._tail - pkt_q._head) % QUEUE_SIZE == 2
+    assert engine.summary() == 'COLLAPSED [1 SOF] [1 IN/NAK] '
+
+    engine.clear()
+
+    assert not any(engine.count)
+    assert engine.time_sop == 0
+
+
+# Collapsing starts over once a sequence has been idle long enough
+def test_idle_threshold():
+    stream = [(PID_SOF, 1), (PID_SOF, 2), (PID_SOF, IDLE_SAMPLES + 1), (PID_SOF, IDLE_SAMPLES + 2)]
+    result = engine_collapse(stream)
+
+    assert result == legacy_collapse(stream)
+    assert [step[1][SOF] for step in result] == [1, 2, 1, 2]
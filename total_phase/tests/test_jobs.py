@@ -0,0 +1,32 @@
+# Checks job files are checked before anything is captured.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import json
+
+import pytest
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Given trigger details need the packet length, calibration would find it but also replace the mask
+@pytest.mark.parametrize('button', ({'name': 'RB', 'position': 13, 'value': '2'},
+                                    {'name': 'RB', 'mask': {'offset': 6, 'mask': '0x20', 'on': '0x20'}}))
+def test_button_without_length(collect, button):
+    with pytest.raises(ValueError):
+        collect.load_job_buttons({'buttons': [button]})
+
+
+def test_failed_job_status(collect, tmp_path):
+    job_path = tmp_path / 'jobs.json'
+    status_path = tmp_path / 'job_status.json'
+    job_path.write_text(json.dumps({'output_dir': str(tmp_path), 'status_file': str(status_path),
+                                    'jobs': [{'name': 'no-length', 'buttons': [{'name': 'RB', 'position': 13,
+                                                                              'value': '2'}], 'tests': 10}]}))
+
+    assert collect.run_jobs(str(job_path)) == 1
+
+    status, = json.loads(status_path.read_text())
+    assert status['state'] == 'failed'
+    assert 'packet length' in status['error']
@@ -0,0 +1,155 @@
+# Checks LatencyStats merged from pieces of a run give the same results as
+# the whole run, and survive being saved and loaded, and that the samples
+# sequential tests keep stay bounded.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import math
+import random
+import statistics
+
+from fractions import Fraction
+
+import pytest
+
+from latency_stats import LatencyHistogram, LatencySamples, LatencyStats
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+# Beagle ticks at 60 MHz, in nanoseconds
+TICK = Fraction(50, 3)
+
+LATENCIES = 3000
+
+# How far a digest quantile may be from the exact one, as a share of the range
+QUANTILE_TOLERANCE = 0.01
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Latencies in nanoseconds, mostly 1-9ms with a slow tail
+def make_latencies(count, seed):
+    rng = random.Random(seed)
+    return [rng.randrange(60000, 540000) * TICK if rng.random() < 0.98 else rng.randrange(540000, 1200000) * TICK
+            for i in range(count)]
+
+
+def make_stats(latencies):
+    stats = LatencyStats()
+
+    for latency in latencies:
+        stats.add(latency)
+
+    return stats
+
+
+def exact_quantile(latencies, q):
+    ordered = sorted(latencies)
+    return float(ordered[min(int(q * len(ordered)), len(ordered) - 1)]) / 1000000
+
+
+def test_merge_matches_one_run():
+    latencies = make_latencies(LATENCIES, 1)
+    whole = make_stats(latencies)
+    merged = LatencyStats()
+
+    for start in range(0, LATENCIES, 700):
+        merged.merge(make_stats(latencies[start:start + 700]))
+
+    # Sums are exact, so everything but the percentiles is the same to the last digit
+    assert merged.count == whole.count == LATENCIES
+    assert merged.summary() == whole.summary()
+    assert merged.average() == float(statistics.mean(latencies) / 1000000)
+    assert merged.histogram.counts == whole.histogram.counts
+
+    minimum, maximum, average, stdev = merged.summary()
+    assert minimum == float(min(latencies) / 1000000)
+    assert maximum == float(max(latencies) / 1000000)
+    assert stdev == pytest.approx(math.sqrt(statistics.variance(latencies)) / 1000000)
+
+    spread = maximum - minimum
+
+    for q in (0.5, 0.9, 0.99, 0.999):
+        assert abs(merged.quantile(q) - exact_quantile(latencies, q)) < QUANTILE_TOLERANCE * spread, q
+        assert abs(merged.quantile(q) - whole.quantile(q)) < QUANTILE_TOLERANCE * spread, q
+
+    assert merged.quantile(0) == minimum
+    assert merged.quantile(1) == maximum
+
+
+def test_merge_empty():
+    stats = make_stats(make_latencies(10, 2))
+    before = stats.to_dict()
+
+    stats.merge(LatencyStats())
+    assert stats.to_dict() == before
+
+    empty = LatencyStats()
+    empty.merge(stats)
+    assert empty.to_dict() == before
+
+
+# A run needs two clean times for a summary, and one for an average
+def test_too_few():
+    stats = LatencyStats()
+
+    assert (stats.summary(), stats.average(), stats.quantile(0.5)) == (None, None, None)
+
+    stats.add(1000000)
+    assert stats.summary() is None
+    assert stats.average() == stats.quantile(0.5) == 1.0
+
+    stats.add(3000000)
+    assert stats.summary() == (1.0, 3.0, 2.0, math.sqrt(2))
+
+
+@pytest.mark.parametrize('count', (0, 1, 500))
+def test_save_load(tmp_path, count):
+    stats = make_stats(make_latencies(count, 3))
+    path = tmp_path / 'latency_stats.json'
+
+    stats.save(path)
+    loaded = LatencyStats.load(path)
+
+    assert loaded.to_dict() == stats.to_dict()
+    assert loaded.summary() == stats.summary()
+    assert loaded.quantile(0.99) == stats.quantile(0.99)
+    assert not (tmp_path / 'latency_stats.json.tmp').exists()
+
+    # Loaded statistics keep merging like the ones they were saved from
+    loaded.merge(stats)
+    assert loaded.count == 2 * count
+
+
+# Sequential tests read their percentiles off a digest, so a long test keeps
+# a bounded number of centroids and still finds the exact interval
+def test_samples_bounded():
+    latencies = make_latencies(10 * LATENCIES, 4)
+    samples = LatencySamples()
+    exact = sorted(latencies)
+
+    for latency in latencies:
+        samples.add(latency)
+
+    digest = samples.digest
+    assert len(digest.centroids) + len(digest.buffer) < 10 * digest.compression
+
+    n = len(latencies)
+    spread = exact[-1] - exact[0]
+    assert samples.mean_half_width() == pytest.approx(samples.z * statistics.stdev(latencies) / math.sqrt(n))
+
+    for q in (0.5, 0.99):
+        assert abs(samples.quantile(q) - exact[math.ceil(q * n) - 1]) < QUANTILE_TOLERANCE * spread, q
+
+        width = samples.z * math.sqrt(n * q * (1 - q))
+        half_width = (exact[math.ceil(n * q + width) - 1] - exact[math.floor(n * q - width) - 1]) / 2
+        assert abs(samples.quantile_half_width(q) - half_width) < QUANTILE_TOLERANCE * spread, q
+
+    assert LatencySamples().quantile_half_width(0.99) == math.inf
+
+
+def test_histogram_buckets_must_match():
+    with pytest.raises(ValueError):
+        LatencyHistogram(64).merge(LatencyHistogram(32))
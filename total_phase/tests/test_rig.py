@@ -0,0 +1,80 @@
+# Runs a rig test on two simulated analyzers (fake_beagle.py) and checks each
+# one gets its own results, and that the rig summary merges them.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import glob
+import os
+
+import fake_beagle
+import pytest
+
+from latency_stats import LatencyStats
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+TESTS = 10
+
+# fake_beagle answers 1-8ms after an edge, plus 1ms per port number
+RESPONSE_MS = (1, 8)
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+@pytest.fixture
+def rig(collect, monkeypatch, tmp_path):
+    monkeypatch.setattr(fake_beagle, 'PORTS', 2)
+
+    # The workers share one pigpio daemon, so they never play waves even when asked to
+    monkeypatch.setattr(collect, 'HARDWARE_TIMED_TRIGGERS', True)
+    monkeypatch.setattr(collect, 'trigger_waves', lambda *args: (tmp_path / 'waves_played').touch())
+
+    # The button fake_beagle presses on digital input 1, 0x20 in byte 7
+    collect.set_trigger_mask(collect.TestedDevice, collect.nibble_mask(13, '2'))
+    collect.TestedDevice.trigger_length = 12
+    collect.TestedDevice.trigger_name = 'RB'
+
+    # usb_dump() only starts the trigger process when run as a script
+    monkeypatch.setattr(collect, '__name__', '__main__')
+
+    collect.rig_test(TESTS)
+
+    rig_dirs = glob.glob(os.path.join(collect.output_dir, 'rig-*'))
+    assert len(rig_dirs) == 1
+
+    return rig_dirs[0]
+
+
+def test_no_waves(tmp_path, rig):
+    assert not (tmp_path / 'waves_played').exists()
+
+
+def test_rig(collect, rig):
+    with open(os.path.join(rig, 'rig_summary.txt')) as in_file:
+        summary = in_file.read().splitlines()
+
+    rows = summary[summary.index('port,unique_id,clean_times,min_ms,max_ms,avg_ms,stdev_ms,results') + 1:]
+    rows = [row.split(',') for row in rows[:rows.index('')]]
+
+    assert 'Analyzers - 2 of 2 finished' in summary
+    assert [(int(row[0]), int(row[1])) for row in rows] == [(0, 1000000000), (1, 1000000001)]
+
+    all_stats = LatencyStats.load(os.path.join(rig, 'latency_stats.json'))
+    counts = 0
+
+    for port, unique_id, clean_times, min_ms, max_ms, avg_ms, stdev_ms, results in rows:
+        # Every analyzer has its own output directory, named after its unique ID
+        assert os.path.dirname(os.path.dirname(results)) == os.path.join(rig, unique_id)
+        assert os.path.isfile(results)
+
+        stats = LatencyStats.load(os.path.join(os.path.dirname(results), 'latency_stats.json'))
+
+        assert stats.count == int(clean_times) > 0
+        assert RESPONSE_MS[0] <= float(min_ms) <= float(max_ms) <= RESPONSE_MS[1] + int(port) + 1
+
+        counts += stats.count
+
+    assert all_stats.count == counts
+    assert f'All analyzers - {counts} clean times' in summary
@@ -0,0 +1,88 @@
+# Checks PacketRing keeps packets in order through a full ring, and counts
+# the overflow instead of dropping or overwriting anything.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import threading
+
+from types import SimpleNamespace
+
+import pytest
+
+from ring_buffer import PacketRing
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+SLOTS = 2
+SLOT_SIZE = 16
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+@pytest.fixture
+def ring():
+    ring = PacketRing(SLOTS, SLOT_SIZE)
+    yield ring
+    ring.close(unlink=True)
+
+
+def new_packet():
+    return SimpleNamespace(length=0, status=0, events=0, time_sop=0, time_duration=0, time_dataoffset=0,
+                           data=bytearray(SLOT_SIZE))
+
+
+# Packet i carries i in its time and payload
+def put_packet(ring, i):
+    return ring.put(3, 0, 0, 1000 + i, 10, 0, bytes((0xc3, i, i)))
+
+
+def test_in_order(ring):
+    packet = new_packet()
+
+    for i in range(5):
+        assert put_packet(ring, i)
+        assert ring.get(packet)
+        assert (packet.length, packet.time_sop, bytes(packet.data[:3])) == (3, 1000 + i, bytes((0xc3, i, i)))
+
+    assert not ring.get(packet, timeout=0.01)
+    assert ring.overflows == 0
+    assert ring.high_water == 1
+
+
+# The reader waits for a slot once the ring is full, and the packet lands
+# after the ones already in the ring
+def test_overflow(ring):
+    for i in range(SLOTS):
+        assert put_packet(ring, i)
+
+    writer = threading.Thread(target=put_packet, args=(ring, SLOTS))
+    writer.start()
+    writer.join(0.2)
+
+    assert writer.is_alive()
+    assert ring.overflows == 1
+    assert ring.high_water == SLOTS
+
+    packet = new_packet()
+    times = []
+
+    while ring.get(packet, timeout=0.5):
+        times.append(packet.time_sop)
+
+    writer.join()
+
+    assert times == [1000 + i for i in range(SLOTS + 1)]
+    assert ring.overflows == 1
+
+
+# Stopping the capture while the reader waits for room gives up the packet
+def test_stop_while_full(ring):
+    for i in range(SLOTS):
+        assert put_packet(ring, i)
+
+    ring.stop.set()
+
+    assert not put_packet(ring, SLOTS)
+    assert ring.overflows == 1
@@ -0,0 +1,185 @@
+# Checks latency quantiles from the run index on a small database made up
+# for the test, and indexing a run from results/.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import math
+import os
+import random
+
+import sqlite3
+
+import pytest
+
+from conftest import RESULTS_DIR
+from events import ButtonEdges, DeviceFilter, LatencyCleaner, ResponseLog, run_pipeline
+from reanalyze import open_run, read_results, run_source
+from run_index import SCHEMA_VERSION, connect, index_run, latency_quantiles
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+# (vendor_id, product_id, version, button) of each run, and how many clean times it gets
+RUNS = [('045e', '0b12', '5.09', 'RB', 101),
+        ('045e', '0b12', '5.09', 'A', 37),
+        ('045e', '0b12', '5.15', 'RB', 64),
+        ('054c', '09cc', '1.00', 'RB', 1)]
+
+INDEXED_RUN = os.path.join(RESULTS_DIR, '045e0b12', '20221004', '165937')
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+@pytest.fixture
+def index(tmp_path):
+    rng = random.Random(5)
+    conn = connect(str(tmp_path / 'run_index.sqlite'))
+    latencies = {}
+
+    for i, (vendor_id, product_id, version, name, count) in enumerate(RUNS):
+        run_id = conn.execute(
+            'INSERT INTO runs (run_dir, stamp, source, vendor_id, product_id, version) VALUES (?, ?, ?, ?, ?, ?)',
+            (f'/runs/{i}', '', 'raw_output.txt', vendor_id, product_id, version)).lastrowid
+        button_id = conn.execute('INSERT INTO buttons (run_id, name, clean_times) VALUES (?, ?, ?)',
+                                 (run_id, name, count)).lastrowid
+        # Some repeated latencies, so ranks of equal latencies are covered
+        run_latencies = [rng.randrange(500000, 20000000) // 100000 * 100000 for sequence in range(count)]
+        ranks = {sequence: rank for rank, sequence in enumerate(sorted(range(count), key=run_latencies.__getitem__),
+                                                                 start=1)}
+
+        conn.executemany(
+            'INSERT INTO samples (button_id, sequence, pressed, trigger_tick, response_tick, latency_ns, rank) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((button_id, sequence, sequence % 2, sequence * 10 ** 9, sequence * 10 ** 9 + latency, latency,
+              ranks[sequence])
+             for sequence, latency in enumerate(run_latencies)))
+
+        latencies[i] = run_latencies
+
+    conn.commit()
+    yield conn, latencies
+    conn.close()
+
+
+# Nearest rank quantile in milliseconds, the same way the query picks it
+def nearest_rank(latencies, quantile):
+    ordered = sorted(latencies)
+    return ordered[max(1, math.ceil(len(ordered) * quantile)) - 1] / 1000000
+
+
+def expected(latencies, quantile, key, runs=range(len(RUNS))):
+    groups = {}
+
+    for i in runs:
+        groups.setdefault(key(RUNS[i]), []).extend(latencies[i])
+
+    return [(group, len(values), nearest_rank(values, quantile)) for group, values in sorted(groups.items())]
+
+
+@pytest.mark.parametrize('quantile', (0, 0.5, 0.95, 0.999, 1))
+def test_by_version(index, quantile):
+    conn, latencies = index
+
+    assert latency_quantiles(conn, quantile) == expected(latencies, quantile, lambda run: run[2])
+
+
+def test_by_product(index):
+    conn, latencies = index
+
+    assert latency_quantiles(conn, 0.9, by='product_id') == expected(latencies, 0.9, lambda run: run[1])
+
+
+def test_filters(index):
+    conn, latencies = index
+
+    assert latency_quantiles(conn, 0.5, filters={'vendor_id': '045e', 'button': 'RB'}) == \
+           expected(latencies, 0.5, lambda run: run[2], runs=(0, 2))
+    assert latency_quantiles(conn, 0.5, filters={'product_id': 'ffff'}) == []
+
+
+def test_bad_arguments(index):
+    conn, latencies = index
+
+    with pytest.raises(ValueError):
+        latency_quantiles(conn, 0.5, by='latency_ns')
+
+    with pytest.raises(ValueError):
+        latency_quantiles(conn, 0.5, filters={'name': 'RB'})
+
+
+# A saved run is indexed once, with a sample for every clean time
+def test_index_run(tmp_path):
+    conn = connect(str(tmp_path / 'run_index.sqlite'))
+
+    assert index_run(conn, INDEXED_RUN)
+    assert not index_run(conn, INDEXED_RUN)
+
+    vendor_id, product_id, source = conn.execute('SELECT vendor_id, product_id, source FROM runs').fetchone()
+    clean_times, average_ms = conn.execute('SELECT clean_times, average_ms FROM buttons').fetchone()
+    samples, average_ns = conn.execute('SELECT COUNT(*), AVG(latency_ns) FROM samples').fetchone()
+
+    assert (vendor_id, product_id, source) == ('045e', '0b12', 'raw_output.txt')
+    assert clean_times == samples > 0
+    assert average_ns / 1000000 == pytest.approx(average_ms, abs=1e-6)
+
+    conn.close()
+
+
+# Responses handed over after a test index the same samples as cleaning the capture again
+def test_index_responses(tmp_path):
+    buttons, device = read_results(os.path.join(INDEXED_RUN, 'results-1000.txt'))
+    events, scale, device_filter = open_run(INDEXED_RUN, run_source(INDEXED_RUN, clean_output=True), buttons, device)
+    logs = [device_filter.subscribe(ButtonEdges(button.beagle_input)).subscribe(
+        LatencyCleaner(button.trigger_mask, button.trigger_length)).subscribe(ResponseLog()) for button in buttons]
+    run_pipeline(events, device_filter)
+
+    cleaned = connect(str(tmp_path / 'cleaned.sqlite'))
+    handed = connect(str(tmp_path / 'handed.sqlite'))
+    index_run(cleaned, INDEXED_RUN)
+    index_run(handed, INDEXED_RUN, [log.responses for log in logs])
+
+    query = 'SELECT sequence, pressed, trigger_tick, response_tick, latency_ns, rank FROM samples ORDER BY sequence'
+    assert handed.execute(query).fetchall() == cleaned.execute(query).fetchall()
+    assert latency_quantiles(handed, 0.99) == latency_quantiles(cleaned, 0.99)
+
+    cleaned.close()
+    handed.close()
+
+
+# An index made before the samples had ranks is started over
+def test_old_schema(tmp_path):
+    path = str(tmp_path / 'run_index.sqlite')
+    old = sqlite3.connect(path)
+    old.execute('CREATE TABLE samples (button_id INTEGER, sequence INTEGER, latency_ns INTEGER)')
+    old.execute('INSERT INTO samples VALUES (1, 0, 1000)')
+    old.commit()
+    old.close()
+
+    conn = connect(path)
+
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    assert conn.execute('SELECT COUNT(*) FROM samples').fetchone()[0] == 0
+    assert index_run(conn, INDEXED_RUN)
+
+    conn.close()
+
+
+# latency_test() indexes every run with the responses it paired, the same samples reading the run again gives
+def test_latency_test_index(collect, monkeypatch, tmp_path):
+    collect.set_trigger_mask(collect.TestedDevice, collect.nibble_mask(13, '2'))
+    collect.TestedDevice.trigger_length = 12
+    monkeypatch.setattr(collect, '__name__', '__main__')
+    monkeypatch.setattr(collect, 'RUN_INDEX', str(tmp_path / 'run_index.sqlite'))
+
+    results, stats = collect.latency_test(10)
+    reread = connect(str(tmp_path / 'reread.sqlite'))
+    index_run(reread, os.path.dirname(results))
+    conn = connect(collect.RUN_INDEX)
+
+    query = 'SELECT sequence, pressed, trigger_tick, response_tick, latency_ns, rank FROM samples ORDER BY sequence'
+    assert len(conn.execute(query).fetchall()) == stats.count > 0
+    assert conn.execute(query).fetchall() == reread.execute(query).fetchall()
+
+    conn.close()
+    reread.close()
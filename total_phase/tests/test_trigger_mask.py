@@ -0,0 +1,111 @@
+# Checks trigger bits are found from calibration packets the same way with
+# and without NumPy, with other buttons, counters and stray packets around.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import random
+
+import pytest
+
+import trigger_mask
+
+from trigger_mask import BitStability, TriggerMask, derive_masks, nibble_mask, stable_columns
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+PID_DATA0 = 0xc3
+PID_DATA1 = 0x4b
+
+PACKETS = 40
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+@pytest.fixture(params=[True, False], ids=['numpy', 'python'])
+def have_numpy(request, monkeypatch):
+    if request.param and not trigger_mask.HAVE_NUMPY:
+        pytest.skip('NumPy is not installed')
+
+    monkeypatch.setattr(trigger_mask, 'HAVE_NUMPY', request.param)
+    return request.param
+
+
+# A controller report: PID, a counter, sticks, two buttons sharing byte 4
+# with a held button, and a CRC that changes with everything else
+def report(i, pressed, rng):
+    buttons = 0x01 | (0x20 if pressed else 0) | (0x04 if rng.random() < 0.5 else 0)
+    payload = bytes([PID_DATA1 if i % 2 else PID_DATA0, i // 2 & 0xff, 0x80, 0x7f, buttons, 0x00])
+    return payload + rng.randbytes(2)
+
+
+def calibration_packets(seed=1):
+    rng = random.Random(seed)
+    data_off = [report(i, False, rng) for i in range(0, 2 * PACKETS, 2)]
+    data_on = [report(i, True, rng) for i in range(1, 2 * PACKETS, 2)]
+    return data_off, data_on
+
+
+def test_stable_columns(have_numpy):
+    reports = [bytes([0xf0, 0x01 | (i & 1) << 7]) for i in range(20)]
+
+    assert stable_columns(reports) == ([0xff, 0x7f], [0xf0, 0x01])
+    assert stable_columns([]) == ([], [])
+
+
+# A bit can disagree in up to a tolerance share of the packets and still hold still
+def test_stable_columns_tolerance(have_numpy):
+    reports = [bytes([0x10])] * 19 + [bytes([0x18])]
+
+    assert stable_columns(reports, 0.05) == ([0xff], [0x10])
+    assert stable_columns(reports, 0.0) == ([0xf7], [0x10])
+
+
+def test_derive_masks(have_numpy):
+    stability = BitStability(*calibration_packets())
+    masks = derive_masks(stability)
+
+    # The PID alternating with DATA0/DATA1 and the CRC are never a button
+    assert masks == [TriggerMask(4, 0x20, 0x20, 0x00)]
+    assert stability.noisy[1] and stability.noisy[4] == 0x04
+    assert stability.constant[2] == stability.constant[3] == 0xff
+
+    # The button, and the two bits DATA0 and DATA1 differ in
+    constant, toggling, noisy = stability.counts()
+    assert stability.toggling[0] == PID_DATA0 ^ PID_DATA1
+    assert toggling == 3
+    assert constant + toggling + noisy == 8 * len(stability.toggling)
+
+
+# The result does not depend on the order of the packets, or on NumPy
+def test_order(monkeypatch):
+    data_off, data_on = calibration_packets(2)
+    expected = derive_masks(BitStability(data_off, data_on))
+
+    monkeypatch.setattr(trigger_mask, 'HAVE_NUMPY', False)
+    random.Random(3).shuffle(data_off)
+    stability = BitStability(data_off, data_on)
+
+    assert derive_masks(stability) == expected
+
+
+# A couple of stray packets with the button in the wrong state still find it
+def test_stray_packets(have_numpy):
+    data_off, data_on = calibration_packets(4)
+    data_off[5] = data_on[5]
+    data_on[7] = data_off[7]
+
+    assert derive_masks(BitStability(data_off, data_on)) == [TriggerMask(4, 0x20, 0x20, 0x00)]
+
+
+def test_nibble_mask():
+    mask = nibble_mask(9, '2')
+
+    assert mask == TriggerMask(4, 0xf0, 0x20)
+    assert mask.nibble() == (9, '2')
+    assert mask.state(bytes([0, 0, 0, 0, 0x21])) == (False, True)
+    assert mask.state(bytes([0, 0, 0, 0, 0x01])) == (True, False)
+    assert mask.state(bytes([0, 0, 0, 0, 0x01]), length=4) == (False, False)
+    assert TriggerMask(4, 0x20, 0x20).nibble() == (9, '2')
+    assert TriggerMask(4, 0x18, 0x18).nibble() == ('', '')
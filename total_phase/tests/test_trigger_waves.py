@@ -0,0 +1,109 @@
+# Plays a trigger schedule through trigger_waves() on fake_pigpio and checks
+# every edge lands on the pins, in order, at the time make_schedule() gave it.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import fake_pigpio
+
+from schedule import LEVEL_OFF, edge_level, make_schedule
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+EDGES = 20
+SEED = 7
+
+# Small waves, so the schedule is split over several chained ones
+WAVE_EDGES = 6
+
+# Delays between 25 and 50 milliseconds, longer than the tolerance below so
+# an edge played in the wrong slot is always caught
+MIN_DELAY = 25
+MAX_DELAY = 50
+
+# How far the thread playing fake_pigpio waves may stray from the schedule,
+# a busy single core host can hold it up for about 10ms
+TOLERANCE_US = 20000
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+# fake_pigpio.pi that keeps every wave it was asked to send
+class RecordingPi(fake_pigpio.pi):
+    sent = []
+
+    def wave_send_using_mode(self, wid, mode):
+        RecordingPi.sent.append((list(self._waves[wid]), mode))
+        return super().wave_send_using_mode(wid, mode)
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+def play_schedule(collect, monkeypatch, tmp_path, inputs):
+    log = tmp_path / 'pigpio_log.csv'
+    monkeypatch.setenv('FAKE_PIGPIO_LOG', str(log))
+    monkeypatch.setattr(fake_pigpio, 'pi', RecordingPi)
+    monkeypatch.setattr(RecordingPi, 'sent', [])
+    monkeypatch.setattr(collect, 'WAVE_EDGES', WAVE_EDGES)
+    monkeypatch.setattr(collect, 'POLL_TIMEOUT', 0.001)
+
+    # trigger_waves() carries on with random triggers once the schedule is done
+    monkeypatch.setattr(collect, 'trigger_on', lambda seed=None, inputs=(1,): None)
+
+    delays = make_schedule(EDGES, MIN_DELAY, MAX_DELAY, SEED)
+    collect.trigger_waves(delays, SEED, inputs)
+
+    with open(log) as in_file:
+        levels = [tuple(int(field) for field in line.split(',')) for line in in_file]
+
+    return delays, RecordingPi.sent, levels
+
+
+def test_waves_follow_schedule(collect, monkeypatch, tmp_path):
+    delays, sent, levels = play_schedule(collect, monkeypatch, tmp_path, (1,))
+    pulses = [pulse for wave, mode in sent for pulse in wave]
+
+    # Every wave but the first waits for the one before it to finish
+    assert len(sent) == (EDGES + 1 + WAVE_EDGES - 1) // WAVE_EDGES
+    assert all(mode == fake_pigpio.WAVE_MODE_ONE_SHOT_SYNC for wave, mode in sent)
+
+    # The first pulse only waits out the first delay, then each edge waits for the next one
+    assert [pulse.delay for pulse in pulses] == delays + [0]
+    assert (pulses[0].gpio_on, pulses[0].gpio_off) == (0, 0)
+
+    for edge, pulse in enumerate(pulses[1:]):
+        pins = collect.edge_bits(edge, (1,))
+
+        if edge_level(edge) == LEVEL_OFF:
+            assert (pulse.gpio_on, pulse.gpio_off) == (pins, 0)
+        else:
+            assert (pulse.gpio_on, pulse.gpio_off) == (0, pins)
+
+    # Played back, the edges keep the schedule's spacing.  The first edge is
+    # as late as the host scheduler makes it, so the edges are compared
+    # after taking out the typical offset from the schedule.
+    assert len(levels) == EDGES
+    start = levels[0][0]
+    errors = [(time_ns - start) / 1000 - sum(delays[1:edge + 1]) for edge, (time_ns, bank_1) in enumerate(levels)]
+    offset = sorted(errors)[EDGES // 2]
+
+    assert all(abs(error - offset) < TOLERANCE_US for error in errors), errors
+
+    assert not fake_pigpio.pi().wave_tx_busy()
+
+
+# With two buttons each edge only moves the pins of the button it belongs to
+def test_two_buttons(collect, monkeypatch, tmp_path):
+    delays, sent, levels = play_schedule(collect, monkeypatch, tmp_path, (1, 2))
+    pins = {beagle_input: collect.input_bits([beagle_input]) for beagle_input in (1, 2)}
+
+    assert levels[0][1] == pins[1] | pins[2]
+
+    for edge, (time_ns, bank_1) in enumerate(levels[1:], start=1):
+        pressed = collect.edge_input(edge, (1, 2))
+        released = bank_1 & pins[pressed] == pins[pressed]
+
+        assert released == (edge_level(edge) == LEVEL_OFF), edge
+        assert bank_1 & pins[3 - pressed] == pins[3 - pressed], edge
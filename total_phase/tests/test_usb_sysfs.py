@@ -0,0 +1,138 @@
+# Reads devices from a sysfs tree made under tmp_path, laid out the way
+# /sys/bus/usb/devices is.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import pytest
+
+from usb_sysfs import DEVICE_DESCRIPTOR_LENGTH, bcd_version, list_devices, parse_endpoints
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+# Device descriptor, only its length is looked at
+DEVICE_DESCRIPTOR = bytes([18, 0x01]) + bytes(16)
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+def config_descriptor(*endpoints):
+    descriptors = bytes([9, 0x02, 0, 0, 1, 1, 0, 0x80, 50])
+    descriptors += bytes([9, 0x04, 0, 0, len(endpoints), 3, 0, 0, 0])
+
+    for address, attributes, max_packet_size, b_interval in endpoints:
+        descriptors += bytes([7, 0x05, address, attributes]) + max_packet_size.to_bytes(2, 'little') + \
+                       bytes([b_interval])
+
+    return descriptors
+
+
+def add_device(root, name, busnum, devnum, speed, descriptors=None, **attributes):
+    path = root / name
+    path.mkdir()
+
+    for attribute, value in {'busnum': busnum, 'devnum': devnum, 'speed': speed, **attributes}.items():
+        (path / attribute).write_text(f'{value}\n')
+
+    if descriptors is not None:
+        (path / 'descriptors').write_bytes(DEVICE_DESCRIPTOR + descriptors)
+
+    return path
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    root = tmp_path / 'devices'
+    root.mkdir()
+
+    add_device(root, 'usb1', 1, 1, '480', idVendor='1d6b', idProduct='0002', bcdDevice='0601',
+               manufacturer='Linux 6.1.21-v8+ xhci-hcd', product='xHCI Host Controller')
+    add_device(root, '1-1.2', 1, 5, '12', config_descriptor((0x81, 0x03, 64, 4), (0x02, 0x03, 64, 8)),
+               idVendor='045e', idProduct='02ea', bcdDevice='0509', manufacturer='Microsoft',
+               product='Controller', serial='3033363030343634')
+    add_device(root, '2-1', 2, 3, '480', config_descriptor((0x83, 0x03, 1024, 4), (0x84, 0x02, 512, 0)),
+               idVendor='1235', idProduct='ab12', bcdDevice='0100')
+
+    # Interfaces and anything without a device ID are not devices
+    (root / '1-1.2:1.0').mkdir()
+    (root / '1-1.2:1.0' / 'idVendor').write_text('045e\n')
+    (root / '1-0:1.0').mkdir()
+
+    return root
+
+
+def test_list_devices(sysfs):
+    devices = list_devices(str(sysfs))
+
+    assert [device.name for device in devices] == ['usb1', '1-1.2', '2-1']
+
+    controller = devices[1]
+    assert (controller.vendor_id, controller.product_id, controller.version) == ('045e', '02ea', '5.09')
+    assert (controller.manufacturer, controller.product, controller.serial) == ('Microsoft', 'Controller',
+                                                                              '3033363030343634')
+    assert controller.speed == '12'
+    assert controller.summary() == 'Bus 001 Device 005: ID 045e:02ea Microsoft Controller'
+
+    # Missing attribute files read as blank, missing descriptors as no endpoints
+    assert devices[2].product == ''
+    assert devices[0].endpoints == []
+
+
+# Full speed interrupt endpoints count bInterval in frames, high speed as 2^(bInterval - 1) microframes
+def test_interrupt_intervals(sysfs):
+    controller, high_speed = list_devices(str(sysfs))[1:]
+
+    assert controller.interrupt_intervals() == {1: 4000}
+    assert high_speed.interrupt_intervals() == {3: 1000}
+
+    endpoint = high_speed.endpoints[1]
+    assert (endpoint.number, endpoint.direction, endpoint.transfer_type, endpoint.max_packet_size) == \
+           (4, 'IN', 'Bulk', 512)
+    assert endpoint.interval_us(high_speed.speed) is None
+
+
+# A device that was reconnected has a new device number and is read again
+def test_cache(sysfs):
+    path = sysfs / '1-1.2'
+    controller = list_devices(str(sysfs))[1]
+
+    (path / 'product').write_text('Renamed\n')
+    assert list_devices(str(sysfs))[1] is controller
+
+    (path / 'devnum').write_text('6\n')
+    reconnected = list_devices(str(sysfs))[1]
+
+    assert reconnected is not controller
+    assert (reconnected.devnum, reconnected.product) == (6, 'Renamed')
+
+
+def test_truncated_descriptors():
+    descriptors = DEVICE_DESCRIPTOR + config_descriptor((0x81, 0x03, 8, 10))
+
+    assert len(parse_endpoints(descriptors)) == 1
+    assert parse_endpoints(descriptors[:-1]) == []
+    assert parse_endpoints(descriptors[:DEVICE_DESCRIPTOR_LENGTH]) == []
+
+
+def test_bcd_version():
+    assert bcd_version('0509') == '5.09'
+    assert bcd_version('1000') == '10.00'
+    assert bcd_version('') == ''
+
+
+# A job's device is looked up by its ID, and the speed and polling intervals come from sysfs
+def test_job_device_lookup(collect, sysfs, monkeypatch):
+    monkeypatch.setattr(collect, 'USB_SYSFS_ROOT', str(sysfs))
+
+    collect.load_job_buttons({'device': {'vendor_id': '045e', 'product_id': '02ea'},
+                              'buttons': [{'name': 'A', 'position': 13, 'value': '2', 'length': 12}]})
+
+    assert collect.TestedDevice.speed == '12'
+    assert collect.TestedDevice.endpoint_intervals == {1: 4000}
+
+    collect.load_job_buttons({'device': {'vendor_id': '046d', 'product_id': 'c52b'},
+                              'buttons': [{'name': 'A', 'position': 13, 'value': '2', 'length': 12}]})
+
+    assert collect.TestedDevice.speed == ''
+    assert collect.TestedDevice.endpoint_intervals == {}
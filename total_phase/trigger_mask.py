@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# Trigger button definitions as a byte of the DATA packet, the bits of it
+# that belong to the button, and what those bits read when the button is
+# pressed and released.  A packet is tested with one AND and a comparison,
+# so buttons sharing a nibble with other buttons or axes can be told apart.
+#
+# Older trigger details (calibration cache, job files, results files and
+# manual entry) give a nibble position counted from 1 and the hex digit
+# read when pressed, released being 0.  The oldest results files count the
+# position in bytes and give a whole byte.  Both map onto a mask covering
+# the whole nibble or byte.
+#
+# Calibration looks at every bit of every byte across all the released and
+# pressed packets at once: a bit is constant, toggles with the trigger, or
+# is noisy (counters, checksums, sticks and sensors).  The bits are counted
+# as columns with NumPy when it is installed, so hundreds of calibration
+# packets take no longer than ten, and the result does not depend on order.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    np = None
+    HAVE_NUMPY = False
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+# DATA packets are captured with the PID byte in front and the CRC16 after the payload
+PID_BYTES = 1
+CRC_BYTES = 2
+
+# Share of packets that can disagree with the rest on a bit before it
+# counts as noisy, so a few stray packets in a long capture do not hide the button
+NOISE_TOLERANCE = 0.05
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+class TriggerMask:
+    def __init__(self, offset, mask, on, off=0):
+        # Byte of the DATA packet, counting from 0
+        self.offset = offset
+        self.mask = mask
+        self.on = on
+        self.off = off
+
+    # Whether a DATA payload shows the button released and pressed.  length
+    # is for buffers longer than the packet in them.
+    def state(self, data, length=None):
+        if self.offset >= (len(data) if length is None else length):
+            return False, False
+
+        bits = data[self.offset] & self.mask
+        return bits == self.off, bits == self.on
+
+    # Nibble position (count from 1) and pressed hex digit of the nibble
+    # holding the mask, as older trigger details give them.  Blank if the
+    # mask spans both nibbles of its byte or the released value is not 0.
+    def nibble(self):
+        if self.off != 0:
+            return '', ''
+
+        if self.mask & 0x0f == 0:
+            return self.offset * 2 + 1, f'{self.on >> 4:x}'
+
+        if self.mask & 0xf0 == 0:
+            return self.offset * 2 + 2, f'{self.on:x}'
+
+        return '', ''
+
+    def to_dict(self):
+        return {'offset': self.offset, 'mask': self.mask, 'on': self.on, 'off': self.off}
+
+    def __eq__(self, other):
+        return isinstance(other, TriggerMask) and self.to_dict() == other.to_dict()
+
+    def __str__(self):
+        return f'byte {self.offset + 1}, mask 0x{self.mask:02x}, on 0x{self.on:02x}, off 0x{self.off:02x}'
+
+
+# What every bit did across the calibration packets, as one bit mask per
+# byte for each kind of bit, and the value most packets had while the
+# button was released and pressed
+class BitStability:
+    def __init__(self, data_off, data_on, tolerance=NOISE_TOLERANCE):
+        stable_off, self.value_off = stable_columns(data_off, tolerance)
+        stable_on, self.value_on = stable_columns(data_on, tolerance)
+        self.constant = []
+        self.toggling = []
+        self.noisy = []
+
+        for offset in range(min(len(stable_off), len(stable_on))):
+            stable = stable_off[offset] & stable_on[offset]
+            changed = self.value_off[offset] ^ self.value_on[offset]
+            self.constant.append(stable & ~changed & 0xff)
+            self.toggling.append(stable & changed)
+            self.noisy.append(~stable & 0xff)
+
+    # Number of constant, toggling and noisy bits
+    def counts(self):
+        return tuple(sum(bin(bits).count('1') for bits in kind) for kind in (self.constant, self.toggling, self.noisy))
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Mask for older trigger details, a nibble position counted from 1 and its
+# pressed hex digit.  With byte_positions the position counts bytes and the
+# value is a whole byte.
+def nibble_mask(position, value, byte_positions=False):
+    position = int(position) - 1
+    value = int(value, 16)
+
+    if byte_positions:
+        return TriggerMask(position, 0xff, value)
+
+    if position % 2 == 0:
+        return TriggerMask(position // 2, 0xf0, value << 4 & 0xf0)
+
+    return TriggerMask(position // 2, 0x0f, value & 0x0f)
+
+
+# Mask from the way it is shown, as in the Mask lines of results files
+def mask_from_text(text):
+    fields = dict(field.strip().split(' ', 1) for field in text.split(','))
+    return TriggerMask(int(fields['byte']) - 1, int(fields['mask'], 16), int(fields['on'], 16), int(fields['off'], 16))
+
+
+# Mask from a job file, calibration cache or capture header entry.  Numbers
+# can be given as ints or hex strings, offset counts bytes from 0.
+def mask_from_dict(details):
+    def number(field, default=None):
+        value = details.get(field, default)
+        return int(value, 16) if isinstance(value, str) else value
+
+    return TriggerMask(number('offset'), number('mask'), number('on'), number('off', 0))
+
+
+# How many packets have each bit set, bytes in order and the high bit of
+# each byte first.  Every packet has to be the same length.
+def bit_counts(reports):
+    if not reports:
+        return []
+
+    if HAVE_NUMPY:
+        matrix = np.frombuffer(b''.join(reports), dtype=np.uint8).reshape(len(reports), -1)
+        return np.unpackbits(matrix, axis=1).sum(axis=0).tolist()
+
+    return [sum(column[offset] >> (7 - bit) & 1 for column in reports)
+            for offset in range(len(reports[0])) for bit in range(8)]
+
+
+# Bits of each byte that hold still across the packets (allowing for a
+# tolerance share of them to disagree), and the value most packets have
+def stable_columns(reports, tolerance=NOISE_TOLERANCE):
+    counts = bit_counts(reports)
+    allowed = int(len(reports) * tolerance)
+    stable = []
+    values = []
+
+    for offset in range(len(counts) // 8):
+        stable_bits = 0
+        value = 0
+
+        for bit in range(8):
+            count = counts[offset * 8 + bit]
+
+            if min(count, len(reports) - count) <= allowed:
+                stable_bits |= 0x80 >> bit
+
+            if count * 2 > len(reports):
+                value |= 0x80 >> bit
+
+        stable.append(stable_bits)
+        values.append(value)
+
+    return stable, values
+
+
+# Masks of every byte with bits that toggle with the trigger.  Only the
+# bits that change are kept, so other buttons sharing the byte are left
+# out.  The PID in front and the CRC16 at the end are never a button,
+# DATA0 and DATA1 take turns so the PID can change along with the trigger.
+def derive_masks(stability):
+    masks = []
+
+    for offset in range(PID_BYTES, len(stability.toggling) - CRC_BYTES):
+        changed = stability.toggling[offset]
+
+        if changed:
+            masks.append(TriggerMask(offset, changed, stability.value_on[offset] & changed,
+                                     stability.value_off[offset] & changed))
+
+    return masks
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# USB device details read straight from sysfs, instead of running lsusb.
+# Every device is a directory under /sys/bus/usb/devices named after its
+# port path (1-1.2), with one file per descriptor field and the raw
+# descriptors in "descriptors".  Interface directories (1-1.2:1.0) are
+# skipped.  Any directory laid out the same way can be passed as the root,
+# so a fake tree can stand in for a real bus.
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import os
+
+#==========================================================================
+# GLOBALS
+#==========================================================================
+SYSFS_ROOT = '/sys/bus/usb/devices'
+
+# Descriptor types in the descriptors file
+DT_DEVICE = 0x01
+DT_CONFIG = 0x02
+DT_INTERFACE = 0x04
+DT_ENDPOINT = 0x05
+
+DEVICE_DESCRIPTOR_LENGTH = 18
+
+# Endpoint bmAttributes transfer types
+TRANSFER_TYPES = {0: 'Control', 1: 'Isochronous', 2: 'Bulk', 3: 'Interrupt'}
+
+# Devices already read, sysfs directory -> UsbDevice.  An entry is only used
+# while the bus and device numbers still match, a device that was
+# unplugged or reset gets a new device number and is read again.
+_cache = {}
+
+
+##==========================================================================
+# CLASSES
+##==========================================================================
+class UsbEndpoint:
+    def __init__(self, address, attributes, max_packet_size, b_interval, interface, alt_setting):
+        self.address = address
+        self.attributes = attributes
+        self.max_packet_size = max_packet_size
+        self.b_interval = b_interval
+        self.interface = interface
+        self.alt_setting = alt_setting
+
+    @property
+    def number(self):
+        return self.address & 0x0f
+
+    @property
+    def direction(self):
+        return 'IN' if self.address & 0x80 else 'OUT'
+
+    @property
+    def transfer_type(self):
+        return TRANSFER_TYPES[self.attributes & 0x03]
+
+    # Polling interval in microseconds.  Full and low speed interrupt
+    # endpoints give it in frames, everything else as 2^(bInterval - 1)
+    # frames (full speed isochronous) or microframes (high speed and up).
+    def interval_us(self, speed):
+        if self.transfer_type not in ('Interrupt', 'Isochronous') or not self.b_interval:
+            return None
+
+        if speed in ('1.5', '12'):
+            if self.transfer_type == 'Interrupt':
+                return self.b_interval * 1000
+
+            return 2 ** (self.b_interval - 1) * 1000
+
+        return 2 ** (self.b_interval - 1) * 125
+
+
+class UsbDevice:
+    def __init__(self, name, busnum, devnum):
+        self.name = name
+        self.busnum = busnum
+        self.devnum = devnum
+        self.vendor_id = ''
+        self.product_id = ''
+        self.version = ''
+        self.manufacturer = ''
+        self.product = ''
+        self.serial = ''
+        # Link speed in Mbit/s, as sysfs gives it (1.5, 12, 480, 5000, ...)
+        self.speed = ''
+        self.endpoints = []
+
+    # Same line lsusb prints for the device
+    def summary(self):
+        description = ' '.join(part for part in (self.manufacturer, self.product) if part)
+        return f'Bus {self.busnum:03d} Device {self.devnum:03d}: ID {self.vendor_id}:{self.product_id} {description}'
+
+    # Interrupt IN endpoint number -> polling interval in microseconds, the
+    # endpoints a controller sends its button reports on
+    def interrupt_intervals(self):
+        return {endpoint.number: endpoint.interval_us(self.speed) for endpoint in self.endpoints
+                if endpoint.direction == 'IN' and endpoint.transfer_type == 'Interrupt'}
+
+
+##==========================================================================
+# FUNCTIONS
+##==========================================================================
+# Contents of one attribute file, blank if the device does not have it
+def read_attribute(path, name):
+    try:
+        with open(os.path.join(path, name)) as in_file:
+            return in_file.read().strip()
+    except OSError:
+        return ''
+
+
+# Endpoints from the raw descriptors, the device descriptor followed by
+# every configuration descriptor with its interfaces and endpoints
+def parse_endpoints(descriptors):
+    endpoints = []
+    interface = alt_setting = 0
+    offset = DEVICE_DESCRIPTOR_LENGTH
+
+    while offset + 2 <= len(descriptors):
+        length = descriptors[offset]
+        descriptor_type = descriptors[offset + 1]
+
+        if length < 2 or offset + length > len(descriptors):
+            break
+
+        if descriptor_type == DT_INTERFACE and length >= 4:
+            interface = descriptors[offset + 2]
+            alt_setting = descriptors[offset + 3]
+
+        elif descriptor_type == DT_ENDPOINT and length >= 7:
+            endpoints.append(UsbEndpoint(descriptors[offset + 2], descriptors[offset + 3],
+                                         int.from_bytes(descriptors[offset + 4:offset + 6], 'little') & 0x07ff,
+                                         descriptors[offset + 6], interface, alt_setting))
+
+        offset += length
+
+    return endpoints
+
+
+# bcdDevice as lsusb shows it, 0509 -> 5.09
+def bcd_version(bcd):
+    if len(bcd) != 4:
+        return bcd
+
+    return f'{int(bcd[:2], 16):x}.{bcd[2:]}'
+
+
+def read_device(path):
+    device = UsbDevice(os.path.basename(path), int(read_attribute(path, 'busnum') or 0),
+                       int(read_attribute(path, 'devnum') or 0))
+    device.vendor_id = read_attribute(path, 'idVendor')
+    device.product_id = read_attribute(path, 'idProduct')
+    device.version = bcd_version(read_attribute(path, 'bcdDevice'))
+    device.manufacturer = read_attribute(path, 'manufacturer')
+    device.product = read_attribute(path, 'product')
+    device.serial = read_attribute(path, 'serial')
+    device.speed = read_attribute(path, 'speed')
+
+    try:
+        with open(os.path.join(path, 'descriptors'), 'rb') as in_file:
+            device.endpoints = parse_endpoints(in_file.read())
+    except OSError:
+        pass
+
+    return device
+
+
+# Every device on every bus, sorted by bus number and then device number
+def list_devices(root=SYSFS_ROOT):
+    devices = []
+
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+
+        if ':' in name or not os.path.exists(os.path.join(path, 'idVendor')):
+            continue
+
+        busnum = int(read_attribute(path, 'busnum') or 0)
+        devnum = int(read_attribute(path, 'devnum') or 0)
+        device = _cache.get(path)
+
+        if device is None or (device.busnum, device.devnum) != (busnum, devnum):
+            device = _cache[path] = read_device(path)
+
+        devices.append(device)
+
+    return sorted(devices, key=lambda device: (device.busnum, device.devnum))